@@ -28,6 +28,7 @@ import json
 import os
 import subprocess
 import netdev
+import tr.core
 import tr.cwmpbool
 import tr.cwmptypes
 import tr.experiment
@@ -496,11 +497,11 @@ class WlanConfiguration(CATA98WIFI):
       elif station.get('ifname') != self._ifname:
         stations.remove(station)
     self.CollectSignalStrengths(stations)
-    associated_device_list = {}
+    records = []
     for idx, device in enumerate(sorted(stations), start=1):
       filename = os.path.join(directory, device['PhysAddr'])
-      associated_device_list[str(idx)] = AssociatedDevice(device, filename)
-    return associated_device_list
+      records.append((str(idx), (device, filename)))
+    return tr.core.LazyDict(lambda r: AssociatedDevice(*r), records)
 
   def CollectSignalStrengths(self, stations):
     """Iterate through AssociatedDeviceList to populate self.signals.
@@ -1020,6 +1021,9 @@ class WlanConfigurationStats(netdev.NetdevStatsLinux26, BASE98WIFI.Stats):
     BASE98WIFI.Stats.__init__(self)
 
 
+@tr.core.Unexports(params=['AssociatedDeviceIPAddress', 'LastPMKId',
+                           'LastRequestedUnicastCipher',
+                           'LastRequestedMulticastCipher'])
 class AssociatedDevice(CATA98WIFI.AssociatedDevice):
   """InternetGatewayDevice.LANDevice.WLANConfiguration.AssociatedDevice."""
 
@@ -1036,9 +1040,6 @@ class AssociatedDevice(CATA98WIFI.AssociatedDevice):
     super(AssociatedDevice, self).__init__()
     self._params = params
     type(self).AssociatedDeviceMACAddress.Set(self, params.get('PhysAddr', ''))
-    self.Unexport(['AssociatedDeviceIPAddress', 'LastPMKId',
-                   'LastRequestedUnicastCipher',
-                   'LastRequestedMulticastCipher'])
 
   @property
   def AssociatedDeviceAuthenticationState(self):
@@ -25,6 +25,7 @@ import subprocess
 import pynetlinux
 import tr.basemodel
 import tr.cwmptypes
+import tr.mainloop
 import tr.session
 import tr.x_catawampus_tr181_2_0
 import netdev
@@ -34,6 +35,13 @@ BASE181MOCA = tr.basemodel.Device.MoCA
 CATA181MOCA = tr.x_catawampus_tr181_2_0.X_CATAWAMPUS_ORG_Device_v2_0.Device.MoCA
 MOCACTL = 'mocactl'
 PYNETIFCONF = pynetlinux.ifconfig.Interface
+# Seconds to keep mocactl output (see tr.mainloop.LatestOutput).  Nothing
+# here changes the MoCA settings, so --initparms and --config only change
+# when mocad is restarted with a new configuration.  --status and the node
+# tables have the link state, linkUpTime and per-node statistics, so they
+# are kept for less: LastChange can be this far behind.
+MOCACTL_STATUS_MAX_AGE = 10
+MOCACTL_CONFIG_MAX_AGE = 300
 
 
 # Regexps to parse mocactl output
@@ -148,23 +156,22 @@ class BrcmMocaInterface(BASE181MOCA.Interface):
   @tr.session.cache
   def _MocaCtlShowStatus(self):
     """Return output of mocactl show --status."""
-    mc = subprocess.Popen([MOCACTL, 'show', '--status'], stdout=subprocess.PIPE)
-    out, _ = mc.communicate(None)
+    out = tr.mainloop.LatestOutput([MOCACTL, 'show', '--status'],
+                                   max_age=MOCACTL_STATUS_MAX_AGE)
     return out.splitlines()
 
   @tr.session.cache
   def _MocaCtlShowInitParms(self):
     """Return output of mocactl show --initparms."""
-    mc = subprocess.Popen([MOCACTL, 'show', '--initparms'],
-                          stdout=subprocess.PIPE)
-    out, _ = mc.communicate(None)
+    out = tr.mainloop.LatestOutput([MOCACTL, 'show', '--initparms'],
+                                   max_age=MOCACTL_CONFIG_MAX_AGE)
     return out.splitlines()
 
   @tr.session.cache
   def _MocaCtlShowConfig(self):
     """Return output of mocactl show --config."""
-    mc = subprocess.Popen([MOCACTL, 'show', '--config'], stdout=subprocess.PIPE)
-    out, _ = mc.communicate(None)
+    out = tr.mainloop.LatestOutput([MOCACTL, 'show', '--config'],
+                                   max_age=MOCACTL_CONFIG_MAX_AGE)
     return out.splitlines()
 
   def _MocaCtlGetField(self, outfcn, field):
@@ -298,9 +305,8 @@ class BrcmMocaInterface(BASE181MOCA.Interface):
 
   def _MocaCtlGetNodeIDs(self):
     """Return a list of active MoCA Node IDs."""
-    mc = subprocess.Popen([MOCACTL, 'showtbl', '--nodestats'],
-                          stdout=subprocess.PIPE)
-    out, _ = mc.communicate(None)
+    out = tr.mainloop.LatestOutput([MOCACTL, 'showtbl', '--nodestats'],
+                                   max_age=MOCACTL_STATUS_MAX_AGE)
     nodes = set()
     for line in out.splitlines():
       node = NODE_RE.search(line)
@@ -378,9 +384,9 @@ class BrcmMocaAssociatedDevice(CATA181MOCA.Interface.AssociatedDevice):
   @tr.session.cache
   def ParseNodeStatus(self):
     """Run mocactl show --nodestatus for this node, parse the output."""
-    mc = subprocess.Popen([MOCACTL, 'show', '--nodestatus', str(self.NodeID)],
-                          stdout=subprocess.PIPE)
-    out, _ = mc.communicate(None)
+    out = tr.mainloop.LatestOutput(
+        [MOCACTL, 'show', '--nodestatus', str(self.NodeID)],
+        max_age=MOCACTL_STATUS_MAX_AGE)
     bitloading = [[], []]
     bitloadidx = 0
     for line in out.splitlines():
@@ -433,9 +439,9 @@ class BrcmMocaAssociatedDevice(CATA181MOCA.Interface.AssociatedDevice):
   @tr.session.cache
   def ParseNodeStats(self):
     """Run mocactl show --nodestats for this node, parse the output."""
-    mc = subprocess.Popen([MOCACTL, 'show', '--nodestats', str(self.NodeID)],
-                          stdout=subprocess.PIPE)
-    out, _ = mc.communicate(None)
+    out = tr.mainloop.LatestOutput(
+        [MOCACTL, 'show', '--nodestats', str(self.NodeID)],
+        max_age=MOCACTL_STATUS_MAX_AGE)
     rx_err = 0
     for line in out.splitlines():
       tx = TX_RE.search(line)
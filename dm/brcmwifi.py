@@ -39,6 +39,7 @@ import tr.core
 import tr.cwmpbool
 import tr.handle
 import tr.helpers
+import tr.mainloop
 import tr.session
 import netdev
 import wifi
@@ -61,6 +62,12 @@ WL_EXE = 'wl'
 # Broadcom recommendation for delay while scanning for a channel
 WL_AUTOCHAN_SLEEP = 3
 WL_RADIO_STATE_MARKER_FILE = '/tmp/wl_radio_on'
+# Seconds to keep 'wl counters', 'assoclist' and 'sta_info' output (see
+# tr.mainloop.LatestOutput).  They are live radio state which nothing here
+# sets, so being a few seconds behind is harmless, and sessions, statistics
+# samples and rcommand requests which come close together don't each fork
+# wl again.
+WL_STATS_MAX_AGE = 10
 
 # Parameter enumerations
 BEACONS = frozenset(['None', 'Basic', 'WPA', '11i', 'BasicandWPA',
@@ -113,10 +120,24 @@ class Wl(object):
     out, _ = wl.communicate(None)
     return out
 
+  def _LatestOutput(self, cmd):
+    """Like _SubprocessWithOutput, without blocking the ioloop.
+
+    Only for statistics: the result can be up to WL_STATS_MAX_AGE seconds
+    old, so it might not reflect settings made since.
+
+    Args:
+      cmd: the wl arguments, as for _SubprocessWithOutput.
+    Returns:
+      The output, as a string.
+    """
+    return tr.mainloop.LatestOutput([WL_EXE, '-i', self._if] + cmd,
+                                    max_age=WL_STATS_MAX_AGE)
+
   @tr.session.cache
   def GetWlCounters(self):
     """Returns a dict() with the value of every 'wl counters' stat."""
-    out = self._SubprocessWithOutput(['counters'])
+    out = self._LatestOutput(['counters'])
 
     # match three different types of stat output:
     # rxuflo: 1 2 3 4 5 6
@@ -177,7 +198,7 @@ class Wl(object):
   @tr.session.cache
   def GetAssociatedDevices(self):
     """Return a list of MAC addresses of associated STAs."""
-    out = self._SubprocessWithOutput(['assoclist'])
+    out = self._LatestOutput(['assoclist'])
     stamac_re = re.compile(r'((?:[0-9a-fA-F]{2}:){5}[0-9a-fA-F]{2})')
     stations = list()
     for line in out.splitlines():
@@ -207,7 +228,7 @@ class Wl(object):
     ad.LastTransmitKbps = 0
     ad.LastReceiveKbps = 0
     ad.IdleSeconds = 0
-    out = self._SubprocessWithOutput(['sta_info', mac.upper()])
+    out = self._LatestOutput(['sta_info', mac.upper()])
     for line in out.splitlines():
       if 'AUTHENTICATED' in line:
         ad.AuthenticationState = True
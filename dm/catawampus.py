@@ -28,9 +28,12 @@ import sys
 import google3
 import dm.periodic_statistics
 import tr.api
+import tr.cwmpbool
 import tr.cwmptypes
 import tr.experiment
 import tr.handle
+import tr.latency
+import tr.session
 import tr.x_catawampus_tr181_2_0
 
 BASE = tr.x_catawampus_tr181_2_0.X_CATAWAMPUS_ORG_Device_v2_0
@@ -45,6 +48,8 @@ class CatawampusDm(CATABASE):
     self.roothandle = roothandle
     self.Profiler = Profiler()
     self.ExpensiveStuff = ExpensiveStuff()
+    self.Latency = Latency()
+    self.SessionCache = SessionCache()
     self.Experiments = tr.experiment.Experiments(roothandle)
     self.Export(objects=['Experiments'])
 
@@ -121,6 +126,59 @@ class ExpensiveStuff(CATABASE.ExpensiveStuff):
     return self.getTopNSamples(dm.periodic_statistics.ExpensiveStats, 40)
 
 
+class Latency(CATABASE.Latency):
+  """Latency of RPCs, parameter getters and ACS sessions."""
+
+  def GetEnable(self):
+    return tr.latency.Enable
+
+  def SetEnable(self, value):
+    b = tr.cwmpbool.parse(value)
+    if b and not tr.latency.Enable:
+      tr.latency.Reset()
+    tr.latency.Enable = b
+
+  Enable = property(GetEnable, SetEnable, None, 'Latency.Enable')
+
+  @property
+  def RPCs(self):
+    return str(tr.latency.rpcs)
+
+  @property
+  def Parameters(self):
+    return str(tr.latency.parameters)
+
+  @property
+  def Sessions(self):
+    return str(tr.latency.sessions)
+
+
+class SessionCache(CATABASE.SessionCache):
+  """Hits and misses of each @tr.session.cache function and the path cache."""
+
+  @property
+  def Entries(self):
+    return sum(c[4] for c in tr.session.cache.Counters())
+
+  @property
+  def Functions(self):
+    counters = [c for c in tr.session.cache.Counters() if c[1] or c[2]]
+    counters.sort(key=lambda c: (c[4], c[2]), reverse=True)
+    report = ''
+    for name, hits, misses, seconds, entries in counters:
+      report += '%s: %d hits, %d misses, %.3fs, %d entries\n' % (
+          name, hits, misses, seconds, entries)
+    return report
+
+  @property
+  def PathCacheHits(self):
+    return tr.handle.session_path_cache.hits
+
+  @property
+  def PathCacheMisses(self):
+    return tr.handle.session_path_cache.misses
+
+
 if __name__ == '__main__':
   sys.path.append('../')
   cm = CatawampusDm(None)
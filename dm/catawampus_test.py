@@ -27,6 +27,8 @@ import tr.api
 import tr.core
 import tr.experiment
 import tr.handle
+import tr.latency
+import tr.session
 import catawampus
 
 
@@ -89,6 +91,62 @@ class CatawampusTest(unittest.TestCase):
       self.assertFalse(name in c.ExpensiveStuff.Stats)
       self.assertFalse(name in c.ExpensiveStuff.Notifications)
 
+  def testLatency(self):
+    r = tr.core.Exporter()
+    h = tr.experiment.ExperimentHandle(r)
+    c = catawampus.CatawampusDm(h)
+    tr.latency.rpcs.Add('Stale', 1.0)
+    self.assertFalse(c.Latency.Enable)
+    c.Latency.Enable = True
+    self.assertTrue(tr.latency.Enable)
+    self.assertEqual('', c.Latency.RPCs)
+    tr.latency.rpcs.Add('GetParameterValues', 0.002)
+    tr.latency.parameters.Add('Device.Foo', 0.5)
+    tr.latency.sessions.Add(2.0, 100, 200, 3)
+    c.Latency.Enable = False
+    self.assertFalse(tr.latency.Enable)
+    self.assertTrue('GetParameterValues: count=1' in c.Latency.RPCs)
+    self.assertTrue('Device.Foo: 0.500000s' in c.Latency.Parameters)
+    self.assertTrue('100 bytes in, 200 bytes out, 3 round trips'
+                    in c.Latency.Sessions)
+    # SetParameterValues passes strings.
+    c.Latency.Enable = 'true'
+    self.assertTrue(tr.latency.Enable)
+    c.Latency.Enable = 'false'
+    self.assertFalse(tr.latency.Enable)
+    c.Latency.Enable = '1'
+    c.Latency.Enable = '0'
+    self.assertFalse(tr.latency.Enable)
+    tr.latency.Reset()
+
+  def testSessionCache(self):
+    r = tr.core.Exporter()
+    h = tr.experiment.ExperimentHandle(r)
+    c = catawampus.CatawampusDm(h)
+    tr.session.cache.flush()
+
+    @tr.session.cache
+    def Cached(arg):
+      return arg
+
+    for i in range(10):
+      Cached(i % 4)
+    self.assertEqual(4, c.SessionCache.Entries)
+    line = c.SessionCache.Functions.splitlines()[0]
+    self.assertTrue(line.startswith('%s.Cached: 6 hits, 4 misses' % __name__))
+    self.assertTrue(line.endswith(', 4 entries'))
+    tr.session.cache.flush()
+    self.assertEqual(0, c.SessionCache.Entries)
+
+    tr.handle.session_path_cache.Reset()
+    ch = tr.handle.Handle(c)
+    for unused_i in range(3):
+      ch.GetExport('SessionCache.Entries')
+    self.assertEqual(2, c.SessionCache.PathCacheHits)
+    self.assertEqual(1, c.SessionCache.PathCacheMisses)
+    tr.handle.session_path_cache.Reset()
+    self.assertEqual(0, c.SessionCache.PathCacheHits)
+
 
 if __name__ == '__main__':
   unittest.main()
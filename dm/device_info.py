@@ -25,7 +25,6 @@ by http://www.broadband-forum.org/cwmp/tr-181-2-2-0.html
 __author__ = 'dgentry@google.com (Denton Gentry)'
 
 import abc
-import glob
 import os
 import tornado.ioloop
 import tr.core
@@ -237,7 +236,10 @@ class ProcessStatusLinux26(BASE181DEVICE.DeviceInfo.ProcessStatus):
     self.cpu_total = 0
     self.ProcessList = tr.core.AutoDict('ProcessList',
                                         iteritems=self.IterProcesses,
-                                        getitem=self.GetProcess)
+                                        getitem=self.GetProcessItem,
+                                        len=self._CountProcesses,
+                                        keys=self._ListPids,
+                                        contains=self._HasPid)
 
   def _LinuxStateToTr181(self, linux_state):
     """Maps Linux process states to TR-181 process state names.
@@ -327,19 +329,49 @@ class ProcessStatusLinux26(BASE181DEVICE.DeviceInfo.ProcessStatus):
                        State=self._LinuxStateToTr181(fields[self._STATE]))
     except IOError:
       # This isn't an error. We have a list of files which existed the
-      # moment the glob.glob was run. If a process exits before we get
+      # moment /proc was listed. If a process exits before we get
       # around to reading it, its /proc files will go away.
       p = self.Process(PID=pid, Command='<exited>', Size=0, Priority=0,
                        CPUTime=0, State='X_CATAWAMPUS-ORG_Exited')
     return p
 
-  @tr.session.cache_as_list
+  @tr.session.cache
+  def _GetProcesses(self):
+    """Return a LazyDict of pid -> Process for every /proc/<pid>.
+
+    Process objects are only built (ie. their stat files read) when they
+    are looked at, and then only once per session.
+
+    Returns:
+      a tr.core.LazyDict.
+    """
+    return tr.core.LazyDict(self.GetProcess,
+                            ((pid, pid) for pid in self._ListPids()))
+
+  @tr.session.cache
+  def _ListPids(self):
+    """Return the list of pids, from a single listing of /proc."""
+    try:
+      return [int(d) for d in os.listdir(SLASH_PROC) if d.isdigit()]
+    except OSError:
+      return []
+
+  def _CountProcesses(self):
+    return len(self._ListPids())
+
+  def _HasPid(self, pid):
+    return pid in self._GetProcesses()
+
+  def GetProcessItem(self, pid):
+    """Like GetProcess(), but reuses the Process built this session, if any."""
+    processes = self._GetProcesses()
+    if pid in processes:
+      return processes[pid]
+    return self.GetProcess(pid)
+
   def IterProcesses(self):
     """Walks through /proc/<pid>/stat to return a list of all processes."""
-    for filename in glob.glob(self._ProcFileName('[0123456789]*')):
-      pid = int(filename.split('/')[-2])
-      proc = self.GetProcess(pid)
-      yield pid, proc
+    return self._GetProcesses().iteritems()
 
 
 class LedStatusReadFromFile(
@@ -21,6 +21,9 @@
 __author__ = 'dgentry@google.com (Denton Gentry)'
 
 import os
+import shutil
+import tempfile
+import time
 import google3
 from tr.wvtest import unittest
 import tornado.testing
@@ -224,6 +227,57 @@ class DeviceInfoTest(tornado.testing.AsyncTestCase, unittest.TestCase):
       fake_p = fake_processes[p.PID]
       self.assertEqual(tr.handle.Dump(fake_p), tr.handle.Dump(p))
 
+  def _FakeProc(self, count):
+    """Returns a temporary SLASH_PROC with count processes in it."""
+    tmpdir = tempfile.mkdtemp()
+    stat = open('testdata/device_info/processes/1/stat').read()
+    for pid in range(1, count + 1):
+      os.mkdir(os.path.join(tmpdir, str(pid)))
+      with open(os.path.join(tmpdir, str(pid), 'stat'), 'w') as f:
+        f.write(stat.replace('1 (init)', '%d (init)' % pid, 1))
+    os.mkdir(os.path.join(tmpdir, 'self'))
+    return tmpdir
+
+  def testProcessCount(self):
+    old_slash_proc = device_info.SLASH_PROC
+    tmpdir = self._FakeProc(10)
+    try:
+      device_info.SLASH_PROC = tmpdir
+      ps = device_info.ProcessStatusLinux26(self.io_loop)
+      built = []
+      ps.Process = lambda **kwargs: built.append(kwargs)
+      self.assertEqual(10, ps.ProcessNumberOfEntries)
+      self.assertEqual(10, len(ps.ProcessList.keys()))
+      self.assertTrue(10 in ps.ProcessList)
+      self.assertFalse(11 in ps.ProcessList)
+      # Counting them didn't need any Process objects.
+      self.assertEqual([], built)
+    finally:
+      device_info.SLASH_PROC = old_slash_proc
+      shutil.rmtree(tmpdir)
+
+  def testProcessCountBenchmark(self):
+    if not os.environ.get('BENCHMARK'):
+      return  # a timing, not a test; set BENCHMARK=1 to run it
+    old_slash_proc = device_info.SLASH_PROC
+    tmpdir = self._FakeProc(400)
+    try:
+      device_info.SLASH_PROC = tmpdir
+      ps = device_info.ProcessStatusLinux26(self.io_loop)
+      start = time.time()
+      self.assertEqual(400, sum(1 for _ in ps.ProcessList.iteritems()))
+      by_iterating = time.time() - start
+
+      ps = device_info.ProcessStatusLinux26(self.io_loop)
+      start = time.time()
+      self.assertEqual(400, ps.ProcessNumberOfEntries)
+      by_counting = time.time() - start
+      print '400 processes: %.4fs building them all, %.4fs counting pids' % (
+          by_iterating, by_counting)
+    finally:
+      device_info.SLASH_PROC = old_slash_proc
+      shutil.rmtree(tmpdir)
+
   def testProcessExited(self):
     device_info.SLASH_PROC = 'testdata/device_info/processes'
     ps = device_info.ProcessStatusLinux26(self.io_loop)
@@ -28,11 +28,12 @@ import datetime
 import errno
 import os
 import struct
-import subprocess
 import time
 import dhcp
 import tr.basemodel
+import tr.core
 import tr.helpers
+import tr.mainloop
 import tr.session
 import tr.basemodel
 import tr.cwmptypes
@@ -58,12 +59,19 @@ CATA181HOST = CATA181HOSTS.Host
 
 # Unit tests can override these
 IP6NEIGH = ['ip', '-6', 'neigh']
+# Seconds to keep 'ip -6 neigh' output.  Past that, the next look starts it
+# again, and on the ioloop uses the old output meanwhile.
+IP6NEIGH_MAX_AGE = 10
 PROC_NET_ARP = '/proc/net/arp'
 SYS_CLASS_NET_PATH = '/sys/class/net'
 TIMENOW = time.time
 
 # Client identification files
 ANONID = ['anonid']
+# Seconds to keep an anonid.  It only depends on the MAC address, so it
+# can be kept for a long time; until the first lookup for a MAC finishes,
+# its Host reports the failure value.
+ANONID_MAX_AGE = 24 * 60 * 60
 DHCP_TAXONOMY_FILE = '/fiber/config/dhcp.fingerprints'
 DNSSD_HOSTNAMES = '/tmp/dnssd_hostnames'
 NETBIOS_HOSTNAMES = '/tmp/netbios_hostnames'
@@ -276,11 +284,10 @@ class Hosts(BASE181HOSTS):
         [('f8:8f:ca:00:00:01', '1001::0001', 'eth0', True),
          ('f8:8f:ca:00:00:02', '1001::0001', 'eth1', False)]
     """
-    ip6neigh = subprocess.Popen(IP6NEIGH, stdout=subprocess.PIPE)
-    out, _ = ip6neigh.communicate(None)
+    ip6neigh = tr.mainloop.LatestOutput(IP6NEIGH, max_age=IP6NEIGH_MAX_AGE)
     result = []
 
-    for line in out.splitlines():
+    for line in ip6neigh.splitlines():
       fields = line.split()
       if len(fields) < 5:
         continue
@@ -604,10 +611,11 @@ class Hosts(BASE181HOSTS):
     self._PopulateDhcpTaxonomy(hosts=hosts)
     self._PopulateDiscoveredHostnames(hosts=hosts)
     self._PopulateWifiTaxonomy(hosts=hosts)
-    host_list = dict()
-    for idx, host in enumerate(hosts.values(), start=1):
-      host_list[str(idx)] = Host(**host)
-    return host_list
+    # Building a Host is expensive (it runs the anonid helper, among other
+    # things), so only do it for entries somebody actually looks at.
+    return tr.core.LazyDict(
+        lambda host: Host(**host),
+        ((str(idx), host) for idx, host in enumerate(hosts.values(), start=1)))
 
   @property
   def HostList(self):
@@ -618,6 +626,7 @@ class Hosts(BASE181HOSTS):
     return len(self.HostList)
 
 
+@tr.core.Unexports(params=['Alias'])
 class Host(CATA181HOST):
   """A single network entity; a host system on the network.
 
@@ -645,8 +654,6 @@ class Host(CATA181HOST):
                DnsSdName='', NetbiosName='',
                WifiDeviceModel='', WifiTaxonomy=''):
     super(Host, self).__init__()
-    self.Unexport(['Alias'])
-
     type(self).Active.Set(self, Active)
     type(self).AssociatedDevice.Set(self, AssociatedDevice)
     type(self).AddressSource.Set(self, AddressSource)
@@ -708,15 +715,12 @@ class Host(CATA181HOST):
   def _GetAnonIdForPhysAddress(self, macaddr):
     """Get the anonid for a MAC, XXXXXX if it fails."""
     cmd = ANONID + ['--addr', macaddr]
-    try:
-      anonid = subprocess.check_output(cmd)
-    except (OSError, subprocess.CalledProcessError):
-      # The anonid algorithm uses hard and soft letters,
-      # HARD-SOFT-HARD-HARD-SOFT-HARD. 'XXXXXX' is not
-      # possible as a valid anonid, it is safe to use as
-      # a default for failure cases.
-      return 'XXXXXX'
-    return anonid.strip()
+    anonid = tr.mainloop.LatestOutput(cmd, max_age=ANONID_MAX_AGE).strip()
+    # The anonid algorithm uses hard and soft letters,
+    # HARD-SOFT-HARD-HARD-SOFT-HARD. 'XXXXXX' is not
+    # possible as a valid anonid, it is safe to use as
+    # a default for failure cases.
+    return anonid or 'XXXXXX'
 
 
 class HostIPv4Address(BASE181HOST.IPv4Address):
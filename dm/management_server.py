@@ -46,7 +46,9 @@ class ManagementServer181(BASEMGMT181):
       'ConnectionRequestUsername', 'DefaultActiveNotificationThrottle',
       'EnableCWMP', 'ParameterKey', 'Password', 'PeriodicInformEnable',
       'PeriodicInformInterval', 'PeriodicInformTime', 'STUNEnable',
-      'UpgradesManaged', 'URL', 'Username'])
+      'UpgradesManaged', 'URL', 'Username',
+      'X_CATAWAMPUS_ORG_CompressRequests',
+      'X_CATAWAMPUS_ORG_CompressRequestsMinSize'])
 
   def __init__(self, mgmt):
     """Proxy object for tr-181 ManagementServer support.
@@ -116,7 +118,9 @@ class ManagementServer98(BASEMGMT98):
       'ConnectionRequestUsername', 'DefaultActiveNotificationThrottle',
       'EnableCWMP', 'ParameterKey', 'Password', 'PeriodicInformEnable',
       'PeriodicInformInterval', 'PeriodicInformTime', 'STUNEnable',
-      'UpgradesManaged', 'URL', 'Username'])
+      'UpgradesManaged', 'URL', 'Username',
+      'X_CATAWAMPUS_ORG_CompressRequests',
+      'X_CATAWAMPUS_ORG_CompressRequestsMinSize'])
 
   def __init__(self, mgmt):
     """Proxy object for tr-98 ManagementServer support.
@@ -102,6 +102,9 @@ class ManagementServerTest(unittest.TestCase):
     self.assertEqual(mgmt181.CWMPRetryIntervalMultiplier, 2)
     self.assertRaises(AttributeError, setattr, mgmt181,
                       'ManageableDeviceNumberOfEntries', 1)
+    self.assertFalse(mgmt181.X_CATAWAMPUS_ORG_CompressRequests)
+    mgmt181.X_CATAWAMPUS_ORG_CompressRequests = 'true'
+    self.assertTrue(mgmt.X_CATAWAMPUS_ORG_CompressRequests)
 
   def testSetMgmt98(self):
     mgmt = MakeCpeManagementServer()
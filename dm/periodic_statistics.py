@@ -66,12 +66,12 @@ def _EnableFlush():
 
 
 def _FlushIfNewStatsSession(loop):
-  """Flush the tr.session cache, but max once per ioloop iteration.
+  """Expire the tr.session cache, but max once per ioloop iteration.
 
   This takes advantage of the fact that all add_callback() calls are run
   together, separately from timeouts.  So each SampleSet has its own timeout,
   and (if multiple ones trigger in a single iteration) this function gets
-  called more than once, but only flushes once.  After all those timeouts
+  called more than once, but only expires once.  After all those timeouts
   run, _EnableFlush() might get called one or many times, which just sets
   a bool (so there's no point deduplicating the calls) that allows another
   cache flush when more timeouts occur.
@@ -82,7 +82,7 @@ def _FlushIfNewStatsSession(loop):
   global _needs_flush
   if _needs_flush:
     loop.add_callback(_EnableFlush)
-    tr.session.cache.flush()
+    tr.session.cache.expire()
     _needs_flush = False
 
 
@@ -410,6 +410,10 @@ class SampleSet(BASE157PS.SampleSet):
         tr.cwmpbool.parse(attrs['AccessListChange'])):
       self._attributes['AccessList'] = str(attrs['AccessList'])
 
+  def GetAttributes(self):
+    """Returns a dict of the attributes set by SetAttributes."""
+    return dict(self._attributes)
+
 
 class ParamConfig(object):
   Enable = 0
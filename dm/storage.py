@@ -27,6 +27,7 @@ import os.path
 import re
 import subprocess
 import tr.core
+import tr.mainloop
 import tr.session
 import tr.cwmptypes
 import tr.basemodel
@@ -36,6 +37,11 @@ CATASTORAGE = tr.basemodel.Storage
 BASESTORAGE = CATASTORAGE.StorageService
 PHYSICALMEDIUM = BASESTORAGE.PhysicalMedium
 DISKSTAT = '/sys/block/'
+# Seconds to keep smartctl --info --health output.  The identity fields
+# never change, and the drive's health verdict is derived from attributes
+# which drift over hours, so there is no point waking the disk for it in
+# every session.  Runs which fail or time out aren't kept.
+SMARTCTL_MAX_AGE = 300
 
 # Example: 0x0001  2            0  Command failed due to ICRC error
 SATAPHY = re.compile(r'^(?P<reg>\S+)\s+\d+\s+(?P<val>\d+)\s+')
@@ -265,14 +271,11 @@ class PhysicalMediumDiskLinux26(BASESTORAGE.PhysicalMedium):
       return self.X_CATAWAMPUS_ORG_SmartAttributes.PowerOnHours
     return 0
 
-  @tr.session.cache
   def _GetSmartctlOutput(self):
     """Return smartctl info and health output."""
     dev = SLASHDEV + self.dev
-    smart = subprocess.Popen([SMARTCTL, '--info', '--health', dev],
-                             stdout=subprocess.PIPE)
-    out, _ = smart.communicate(None)
-    return out
+    return tr.mainloop.LatestOutput([SMARTCTL, '--info', '--health', dev],
+                                    max_age=SMARTCTL_MAX_AGE)
 
   @property
   def Vendor(self):
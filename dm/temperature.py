@@ -27,11 +27,11 @@ __author__ = 'dgentry@google.com (Denton Gentry)'
 import copy
 import datetime
 import re
-import subprocess
 import tornado.ioloop
 import tr.basemodel
 import tr.cwmpbool
 import tr.cwmpdate
+import tr.mainloop
 
 BASE181 = tr.basemodel
 BASE181TEMPERATURE = BASE181.Device.DeviceInfo.TemperatureStatus
@@ -43,6 +43,11 @@ BADCELSIUS = -274
 
 # Unit tests can override these with fake data
 HDDTEMPERATURE = 'hdd-temperature'
+
+# Seconds to keep hdd-temperature output.  Samples come at least this far
+# apart (see TemperatureSensor.DEFAULTPOLL), so each one starts a new read,
+# and on the ioloop reports the one the previous sample started.
+HDDTEMPERATURE_MAX_AGE = 60
 PERIODICCALL = tornado.ioloop.PeriodicCallback
 TIMENOW = datetime.datetime.now
 
@@ -235,6 +240,8 @@ class TemperatureSensor(BASE181TEMPERATURE.TemperatureSensor):
   def SampleTemperature(self):
     t = self._sensor.GetTemperature()
     self._value = t
+    if t == BADCELSIUS:
+      return  # no reading (yet); not a new minimum, nor a low alarm
     now = tr.cwmpdate.format(TIMENOW())
     self._last_update = now
     if self._min_value is None or t < self._min_value:
@@ -284,8 +291,8 @@ class SensorHdparm(object):
     self._dev = dev if dev[0] == '/' else '/dev/' + dev
 
   def GetTemperature(self):
-    hd = subprocess.Popen([HDDTEMPERATURE, self._dev], stdout=subprocess.PIPE)
-    out, _ = hd.communicate(None)
+    out = tr.mainloop.LatestOutput([HDDTEMPERATURE, self._dev],
+                                   max_age=HDDTEMPERATURE_MAX_AGE)
     try:
       return int(out)
     except ValueError:
@@ -173,6 +173,14 @@ class TemperatureTest(unittest.TestCase):
     self.assertEqual(t.MinValue, 80)
     self.assertEqual(t.Value, 80)
 
+    # No reading isn't a new minimum.
+    sensor.temperature = TR181_BAD_TEMPERATURE
+    MockTime.TIME = 1341359848
+    t.SampleTemperature()
+    self.assertEqual(t.MinTime, '2012-07-03T23:57:27Z')
+    self.assertEqual(t.MinValue, 80)
+    self.assertEqual(t.Value, TR181_BAD_TEMPERATURE)
+
     t.Reset = True
     self.assertEqual(t.MaxTime, '0001-01-01T00:00:00Z')
     self.assertEqual(t.MaxValue, TR181_BAD_TEMPERATURE)
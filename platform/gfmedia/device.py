@@ -73,6 +73,11 @@ PYNETIFCONF = pynetlinux.ifconfig.Interface
 # tr-69 error codes
 INTERNAL_ERROR = 9002
 
+# Seconds to keep values read with hnvram.  NVRAM holds factory data
+# (serial number, hardware version...) which is only written during
+# manufacturing.
+NVRAM_MAX_AGE = 24 * 60 * 60
+
 # Unit tests can override these with fake data
 ACTIVEWAN = 'activewan'
 AUXTEMP = '/tmp/gpio/aux1_temperature'
@@ -154,6 +159,7 @@ class DeviceId(dm.device_info.DeviceIdMeta):
     except IOError:
       return default
 
+  @tr.session.cache(max_age=NVRAM_MAX_AGE)
   def _GetNvramParam(self, param, default=''):
     """Return a parameter from NVRAM, like the serial number.
 
@@ -162,7 +162,8 @@ class IGMP(BASE135STB.Components.FrontEnd.IP.IGMP):
 
     self.ClientGroupList = tr.core.AutoDict(
         'ClientGroupList', iteritems=self.IterClientGroups,
-        getitem=self.GetClientGroupByIndex)
+        getitem=self.GetClientGroupByIndex, len=self._CountClientGroups,
+        keys=self._ClientGroupKeys, contains=self._HasClientGroup)
 
   @property
   def ClientGroupNumberOfEntries(self):
@@ -226,6 +227,21 @@ class IGMP(BASE135STB.Components.FrontEnd.IP.IGMP):
 
     self._ClientGroups = new_igmps
 
+  def _CountClientGroups(self):
+    self._UpdateClientGroups()
+    return len(self._ClientGroups)
+
+  def _ClientGroupKeys(self):
+    self._UpdateClientGroups()
+    return [str(key) for key in self._ClientGroups]
+
+  def _HasClientGroup(self, index):
+    self._UpdateClientGroups()
+    try:
+      return int(index) in self._ClientGroups
+    except (TypeError, ValueError):
+      return False
+
   def GetClientGroup(self, ipaddr):
     return ClientGroup(ipaddr)
 
@@ -242,13 +258,13 @@ class IGMP(BASE135STB.Components.FrontEnd.IP.IGMP):
     return self.GetClientGroup(self._ClientGroups[index])
 
 
+@tr.core.Unexports(params=['Alias', 'UpTime'])
 class ClientGroup(BASE135STB.Components.FrontEnd.IP.IGMP.ClientGroup):
   """STBService.{i}.Components.FrontEnd.{i}.IP.IGMP.ClientGroup.{i}."""
   GroupAddress = tr.cwmptypes.ReadOnlyString('')
 
   def __init__(self, ipaddr):
     super(ClientGroup, self).__init__()
-    self.Unexport(['Alias', 'UpTime'])
     type(self).GroupAddress.Set(self, ipaddr)
 
 
@@ -290,12 +306,12 @@ class HDMI(BASE135STB.Components.HDMI):
     return self.data.get('ResolutionValue', '')
 
 
+@tr.core.Unexports(params=['CECSupport'])
 class HDMIDisplayDevice(CATA135STB.Components.HDMI.DisplayDevice):
   """STBService.{i}.Components.HDMI.{i}.DisplayDevice."""
 
   def __init__(self):
     super(HDMIDisplayDevice, self).__init__()
-    self.Unexport(['CECSupport'])
     self.data = self._UpdateStats()
 
   @tr.session.cache
@@ -449,27 +465,27 @@ class ServiceMonitoring(CATA135STB.ServiceMonitoring):
       'X_CATAWAMPUS_ORG_StallAlarmTime')
 
 
+@tr.core.Unexports(params=['AVStream', 'Enable', 'Gmin', 'ServiceType',
+                           'SevereLossMinDistance', 'SevereLossMinLength',
+                           'Status', 'ChannelChangeFailureTimeout', 'Alias'],
+                   objects=['Sample'])
 class MainStream(BASE135STB.ServiceMonitoring.MainStream):
   """STBService.{i}.ServiceMonitoring.MainStream."""
 
   def __init__(self, idx):
     super(MainStream, self).__init__()
-    self.Unexport(['AVStream', 'Enable', 'Gmin', 'ServiceType',
-                   'SevereLossMinDistance', 'SevereLossMinLength', 'Status',
-                   'ChannelChangeFailureTimeout', 'Alias'])
-    self.Unexport(objects=['Sample'])
     self.Total = Total(idx)
 
 
+@tr.core.Unexports(params=['Reset', 'ResetTime', 'TotalSeconds'],
+                   objects=['AudioDecoderStats', 'RTPStats',
+                            'VideoDecoderStats', 'VideoResponseStats'])
 class Total(CATA135STBTOTAL):
   """STBService.{i}.ServiceMonitoring.MainStream.{i}.Total."""
 
   def __init__(self, idx):
     super(Total, self).__init__()
     self.idx = idx
-    self.Unexport(['Reset', 'ResetTime', 'TotalSeconds'])
-    self.Unexport(objects=['AudioDecoderStats', 'RTPStats',
-                           'VideoDecoderStats', 'VideoResponseStats'])
     self.data = {}
     self.udp = {}
 
@@ -550,6 +566,7 @@ class Total(CATA135STBTOTAL):
     self._UpdateProcNetUDP(self.udp)
 
 
+@tr.core.Unexports(params=['TotalSeconds'])
 class DejitteringStats(BASE135STB.ServiceMonitoring.MainStream.Total.
                        DejitteringStats):
   """STBService.{i}.ServiceMonitoring.MainStream.{i}.Total.DejitteringStats."""
@@ -557,7 +574,6 @@ class DejitteringStats(BASE135STB.ServiceMonitoring.MainStream.Total.
   def __init__(self, data):
     super(DejitteringStats, self).__init__()
     self.data = data
-    self.Unexport(['TotalSeconds'])
 
   @property
   def EmptyBufferTime(self):
@@ -576,14 +592,15 @@ class DejitteringStats(BASE135STB.ServiceMonitoring.MainStream.Total.
     return int(self.data.get('SessionId', 0))
 
 
+@tr.core.Unexports(params=['PacketDiscontinuityCounterBeforeCA',
+                           'TSSyncByteErrorCount', 'TSSyncLossCount',
+                           'TotalSeconds'])
 class MPEG2TSStats(CATA135STB.ServiceMonitoring.MainStream.Total.MPEG2TSStats):
   """STBService.{i}.ServiceMonitoring.MainStream.{i}.Total.MPEG2TSStats."""
 
   def __init__(self, data):
     super(MPEG2TSStats, self).__init__()
     self.data = data
-    self.Unexport(['PacketDiscontinuityCounterBeforeCA',
-                   'TSSyncByteErrorCount', 'TSSyncLossCount', 'TotalSeconds'])
 
   @property
   def PacketDiscontinuityCounter(self):
@@ -606,13 +623,13 @@ class MPEG2TSStats(CATA135STB.ServiceMonitoring.MainStream.Total.MPEG2TSStats):
     return int(self.data.get('PacketErrorCount', 0))
 
 
+@tr.core.Unexports(params=['TotalSeconds'])
 class TCPStats(CATA135STB.ServiceMonitoring.MainStream.Total.TCPStats):
   """STBService.{i}.ServiceMonitoring.MainStream.{i}.Total.TCPStats."""
 
   def __init__(self, data):
     super(TCPStats, self).__init__()
     self.data = data
-    self.Unexport(['TotalSeconds'])
 
   @property
   def BytesReceived(self):
@@ -95,6 +95,21 @@ class STBServiceTest(unittest.TestCase):
       actual.add(igmp.ClientGroupList[i].GroupAddress)
     self.assertEqual(expected, actual)
 
+  def testClientGroupCountDoesNotBuildGroups(self):
+    stb = stbservice.STBService()
+    igmp = stb.Components.FrontEndList['1'].IP.IGMP
+    built = []
+    igmp.GetClientGroup = built.append
+    self.assertEqual(12, igmp.ClientGroupNumberOfEntries)
+    self.assertEqual(sorted(str(i) for i in range(1, 13)),
+                     sorted(igmp.ClientGroupList.keys()))
+    self.assertTrue(12 in igmp.ClientGroupList)
+    self.assertTrue('12' in igmp.ClientGroupList)
+    self.assertFalse(13 in igmp.ClientGroupList)
+    self.assertFalse(None in igmp.ClientGroupList)
+    self.assertFalse('x' in igmp.ClientGroupList)
+    self.assertEqual([], built)
+
   def testClientGroupsStable(self):
     stbservice.PROCNETIGMP = 'testdata/stbservice/igmp_stable1'
     stbservice.PROCNETIGMP6 = 'testdata/stbservice/igmp6_stable1'
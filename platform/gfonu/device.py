@@ -46,6 +46,7 @@ import tr.basemodel
 import tr.core
 import tr.download
 import tr.handle
+import tr.session
 
 
 PYNETIFCONF = pynetlinux.ifconfig.Interface
@@ -56,6 +57,11 @@ PLATFORM_FILE = '/etc/platform'
 # tr-69 error codes
 INTERNAL_ERROR = 9002
 
+# Seconds to keep values read with hnvram.  NVRAM holds factory data
+# (serial number, hardware version...) which is only written during
+# manufacturing.
+NVRAM_MAX_AGE = 24 * 60 * 60
+
 # Unit tests can override these with fake data
 CONFIGDIR = '/fiber/config/tr69'
 DOWNLOADDIR = '/tmp'
@@ -106,6 +112,7 @@ class DeviceId(dm.device_info.DeviceIdMeta):
     except IOError:
       return default
 
+  @tr.session.cache(max_age=NVRAM_MAX_AGE)
   def _GetNvramParam(self, param, default=''):
     """Return a parameter from NVRAM, like the serial number.
 
@@ -735,6 +735,19 @@ class GetParamsRpcTest(unittest.TestCase):
     self.assertTrue(
         detail.find('FaultString').text.find('Item.2.Foo.1'))
 
+  def testGetBadParamAfterPartialPath(self):
+    cpe = getCpe()
+    # SubObject. generates some values before NopeNotHere fails; none of
+    # them should end up in the fault response.
+    soapxml = (
+        r"""<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/" xmlns:cwmp="urn:dslforum-org:cwmp-1-2" xmlns:soapenc="http://schemas.xmlsoap.org/soap/encoding/" xmlns:xsd="http://www.w3.org/2001/XMLSchema" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"><soapenv:Header><cwmp:ID soapenv:mustUnderstand="1">TestCwmpId</cwmp:ID><cwmp:HoldRequests>0</cwmp:HoldRequests></soapenv:Header><soapenv:Body><cwmp:GetParameterValues><ParameterNames soapenc:arrayType="{urn:dslforum-org:cwmp-1-2}string[2]"><ns3:string xmlns="urn:dslforum-org:cwmp-1-2" xmlns:ns3="urn:dslforum-org:cwmp-1-2">SubObject.</ns3:string><ns3:string xmlns="urn:dslforum-org:cwmp-1-2" xmlns:ns3="urn:dslforum-org:cwmp-1-2">NopeNotHere</ns3:string></ParameterNames></cwmp:GetParameterValues></soapenv:Body></soapenv:Envelope>""")
+    responseXml = cpe.cpe_soap.Handle(soapxml)
+    root = ET.fromstring(str(responseXml))
+    self.assertTrue(root.find(SOAPNS + 'Body/' + CWMPNS +
+                              'GetParameterValuesResponse') is None)
+    self.assertFalse('ParameterValueStruct' in str(responseXml))
+    self._AssertCwmpFaultNopeNotHere(root)
+
   def testGetBadParamName(self):
     cpe = getCpe()
     soapxml = (
@@ -998,7 +1011,8 @@ class GetParamsRpcTest(unittest.TestCase):
                 'GetParameterValues', 'GetQueuedTransfers', 'GetRPCMethods',
                 'Reboot', 'ScheduleDownload', 'ScheduleInform',
                 'SetParameterAttributes', 'SetParameterValues', 'SetVouchers',
-                'Upload', 'X_CATAWAMPUS_ORG_AddObjects']
+                'Upload', 'X_CATAWAMPUS_ORG_AddObjects',
+                'X_CATAWAMPUS_ORG_GetParameterValuesDelta']
     self.assertEqual(rpcnames, expected)
 
   def testSetParameterAttributes(self):
@@ -1042,6 +1056,30 @@ class GetParamsRpcTest(unittest.TestCase):
             'SubObject.Foo',
             'Notification'))
 
+  def testGetParameterAttributes(self):
+    cpe = getCpe()
+    cpe.cpe.SetParameterAttributes({
+        'Name': 'SubObject.', 'Notification': '1', 'NotificationChange': 'true',
+        'AccessList': 'Subscriber', 'AccessListChange': 'true'})
+    cpe.cpe.SetParameterAttributes({
+        'Name': 'SubObject.Foo', 'Notification': '2',
+        'NotificationChange': 'true'})
+    soapxml = r"""<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/" xmlns:cwmp="urn:dslforum-org:cwmp-1-2" xmlns:soapenc="http://schemas.xmlsoap.org/soap/encoding/" xmlns:xsd="http://www.w3.org/2001/XMLSchema" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"><soapenv:Header><cwmp:ID soapenv:mustUnderstand="1">TestCwmpId</cwmp:ID></soapenv:Header><soapenv:Body><cwmp:GetParameterAttributes><ParameterNames soapenc:arrayType="xsd:string[2]"><string>SubObject.</string><string>ReadOnlyParameter</string></ParameterNames></cwmp:GetParameterAttributes></soapenv:Body></soapenv:Envelope>"""
+    responseXml = cpe.cpe_soap.Handle(soapxml)
+    root = ET.fromstring(str(responseXml))
+    plist = root.find(SOAPNS + 'Body/' + CWMPNS +
+                      'GetParameterAttributesResponse/ParameterList')
+    self.assertTrue(plist is not None)
+    self.assertEqual(3, len(plist.findall('ParameterAttributeStruct')))
+    result = {}
+    for struct in plist.findall('ParameterAttributeStruct'):
+      result[struct.find('Name').text] = (
+          struct.find('Notification').text,
+          [s.text for s in struct.findall('AccessList/string')])
+    self.assertEqual({'SubObject.Foo': ('2', ['Subscriber']),
+                      'SubObject.X_CATAWAMPUS-ORG_Bar': ('1', ['Subscriber']),
+                      'ReadOnlyParameter': ('0', [])}, result)
+
   def testInternalError(self):
     cpe = getCpe()
     # RaiseSystemError simulates an unexpected problem which should
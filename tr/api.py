@@ -26,18 +26,42 @@ API calls; it's just a python version of the API.
 
 __author__ = 'apenwarr@google.com (Avery Pennarun)'
 
+import collections
 import datetime
+import heapq
+import Queue
+import random
+import sys
+import threading
+import weakref
 
 import tornado.ioloop
 import tr.core
 import tr.cwmpbool
 import tr.cwmptypes
+import tr.latency
 import tr.monohelper
+import tr.pathtrie
 import download
 
 # Time in seconds to refetch the values that are being watched
-# for notifications.
+# for notifications.  See ParameterAttributes.
 REFRESH_TIMEOUT = 60
+MAX_REFRESH_TIMEOUT = 4 * REFRESH_TIMEOUT
+
+# With CPE.gpv_threads, GetParameterValues groups parameter names by this
+# many leading components (eg. Device.WiFi) and evaluates each group as one
+# job in its pool of threads.
+GPV_GROUP_DEPTH = 2
+
+# Memory budget, in approximate bytes, for the value snapshots kept for
+# X_CATAWAMPUS_ORG_GetParameterValuesDelta.  When it is exceeded, the least
+# recently used snapshots are thrown away.
+DELTA_SNAPSHOT_BYTES = 2 * 1024 * 1024
+
+# Rough per-value bookkeeping cost of a snapshot (dict slot, tuple, objects),
+# in addition to the length of the name and of the value's xsitype and text.
+_SNAPSHOT_ENTRY_BYTES = 64
 
 # TR69 constants for which notification method to use.
 PASSIVE_NOTIFY = 1
@@ -185,41 +209,73 @@ class ParameterAttributes(object):
   AccessList is kept in the value dict just for tr69 compatibility, the
   only allowed value in the spec is "Subscriber".
 
-  There is also one timer that fires every minute to check for attributes
-  that have triggered.
+  Parameters with notifications turned on are watched for changes in one of
+  two ways:
+   - if the parameter is a tr.cwmptypes attribute we can observe (see
+     tr.cwmptypes.Observable), we ask to be called back when it changes,
+     and check it on the next mainloop iteration.  In case the object
+     holding them has been replaced, we look them up again every
+     MAX_REFRESH_TIMEOUT seconds, or within REFRESH_TIMEOUT seconds of
+     objects being added to or removed from the tree.
+   - anything else is polled.  Active notifications are polled every
+     REFRESH_TIMEOUT seconds.  Passive notifications start off the same,
+     but each poll that finds the value unchanged doubles the interval, up
+     to MAX_REFRESH_TIMEOUT.
+
+  Partial paths are expanded again every REFRESH_TIMEOUT seconds, on every
+  CheckForTriggers(), and whenever objects are added to or removed from
+  the tree, so that entries of tables like Device.Hosts.Host are picked up
+  as they come and go.
   """
 
   class Attributes(object):
     """Helper class to hold tr69 parameter attributes."""
 
-    def __init__(self):
+    def __init__(self, notification=0, access_list=None):
       self.current_value = None
-      self.notification = 0
-      self.access_list = None
+      self.notification = notification
+      self.access_list = access_list
+      self.inherited = False  # True if only created for a partial path
+      self.observed = None  # (class, attrname) if observed, else None
+      self.observed_ref = None  # weakref to the observed object
+      self.interval = REFRESH_TIMEOUT
+      self.next_check = None  # monotime of next poll, None if not watched
 
   def __init__(self, root, ioloop):
     self.ioloop = ioloop
-    self.params = dict()
+    # Attributes, keyed by parameter name or partial path.  Parameters
+    # without an entry of their own inherit from the nearest partial path
+    # above them that has one.
+    self.params = tr.pathtrie.PathTrie()
+    self.partials = set()  # partial paths with notifications turned on
     self.root = root
     self.set_notification_cb = None
     self.new_value_change_session_cb = None
-    self.timeout = self.ioloop.add_timeout(
-        datetime.timedelta(0, REFRESH_TIMEOUT), self.CheckForTriggers)
+    self.observers = {}  # (class, attrname) -> (callback, set of names)
+    self.changed = set()
+    self.changed_scheduled = False
+    self.generation = tr.core.StructureGeneration()
+    self.schedule = []  # heap of (next_check, name)
+    self.timeout = None
+    self.timeout_at = None
 
   def ClearParameterAttributes(self, name):
     """Clear the attributes for a parameter.
 
     Args:
-      name: The parameter having its attributes removed.
+      name: The parameter having its attributes removed.  If it ends in
+        '.', the attributes of everything under it are removed too.
     """
     if name.endswith('.'):
-      # delete all the child objects that have this name as prefix.
-      children = [x for x in self.params.keys() if x.startswith(name)]
-      for child in children:
-        del self.params[child]
-      name = name[:-1]  # clear the '.' off the end.
-    if name in self.params:
+      removed = self.params.DeleteSubtree(name)
+    elif name in self.params:
+      removed = [(name, self.params[name])]
       del self.params[name]
+    else:
+      removed = []
+    for child, attrs in removed:
+      self._Unwatch(child, attrs)
+      self.partials.discard(child)
 
   def SetParameterAttributes(self, attrs):
     """Set Attributes for a parameter.
@@ -228,6 +284,9 @@ class ParameterAttributes(object):
       Notification
       AccessList.
 
+    If the name is a partial path (ending in '.'), the attributes are also
+    applied to everything underneath it.
+
     Args:
       attrs: key/value pairs of attribute names and their values.
     Returns:
@@ -240,36 +299,300 @@ class ParameterAttributes(object):
       raise ValueError('SetParameterAttributes must have a "Name" attribute.')
     name = attrs['Name']
 
-    if name not in self.params:
-      self.params[name] = ParameterAttributes.Attributes()
-
+    changes = {}
     if ('Notification' in attrs and
         'NotificationChange' in attrs and
         tr.cwmpbool.parse(attrs['NotificationChange'])):
-      self.params[name].notification = int(attrs['Notification'])
+      changes['notification'] = int(attrs['Notification'])
 
     if ('AccessList' in attrs and
         'AccessListChange' in attrs and
         tr.cwmpbool.parse(attrs['AccessListChange'])):
-      self.params[name].access_list = str(attrs['AccessList'])
+      changes['access_list'] = str(attrs['AccessList'])
+
+    if _IsPartialPath(name):
+      self._SetPartialAttributes(name, changes)
+      return
+
+    entry = self.params.get(name)
+    if entry is None:
+      entry = self.params[name] = self._NewAttributes(name)
+    entry.inherited = False
+    for k, v in changes.iteritems():
+      setattr(entry, k, v)
 
     # Finally store the initial value so changes can be watched for.
-    self.params[name].current_value = self.root.GetExport(name)
+    entry.current_value = self.root.GetExport(name)
+    self._Watch(name)
+
+  def _NewAttributes(self, name):
+    """Returns Attributes for name, starting with what it inherits."""
+    ancestors = self.params.Ancestors(name)
+    if ancestors:
+      _, parent = ancestors[-1]
+      return ParameterAttributes.Attributes(parent.notification,
+                                            parent.access_list)
+    return ParameterAttributes.Attributes()
+
+  def _SetPartialAttributes(self, name, changes):
+    """SetParameterAttributes for a partial path."""
+    if name:
+      # Raises KeyError if the object doesn't exist.
+      self.root.GetExport(name[:-1])
+    entry = self.params.get(name)
+    if entry is None:
+      entry = self.params[name] = self._NewAttributes(name)
+    entry.inherited = False
+    rewatch = []
+    for child, attrs in self.params.IterSubtree(name):
+      for k, v in changes.iteritems():
+        setattr(attrs, k, v)
+      if 'notification' in changes and not _IsPartialPath(child):
+        rewatch.append(child)
+    for child in rewatch:
+      self._Watch(child)
+    if entry.notification in (PASSIVE_NOTIFY, ACTIVE_NOTIFY):
+      self.partials.add(name)
+      self._ExpandPartial(name)
+      if entry.next_check is None:
+        self._SetNextCheck(name, entry,
+                           tr.monohelper.monotime() + REFRESH_TIMEOUT)
+    else:
+      self.partials.discard(name)
+      entry.next_check = None
+
+  def _ExpandPartial(self, name):
+    """Watch every parameter under partial path name that should be.
+
+    Parameters that don't have Attributes of their own get inherited
+    ones, so we have somewhere to keep track of them.  Inherited entries
+    for parameters that have gone away are dropped.
+
+    Args:
+      name: a partial path, ending in '.'.
+    """
+    parent = self.params[name]
+    old = set(child for child, attrs in self.params.IterSubtree(name)
+              if attrs.inherited)
+    try:
+      exports = list(self.root.ListExports(name[:-1] or None, recursive=True))
+    except (KeyError, IndexError):
+      exports = []
+    for subname in exports:
+      if subname.endswith('.'):
+        continue
+      child = name + subname
+      old.discard(child)
+      attrs = self.params.get(child)
+      if attrs is None:
+        attrs = self.params[child] = ParameterAttributes.Attributes(
+            parent.notification, parent.access_list)
+        attrs.inherited = True
+      if attrs.next_check is not None:
+        continue  # already being watched
+      if attrs.notification not in (PASSIVE_NOTIFY, ACTIVE_NOTIFY):
+        continue
+      try:
+        attrs.current_value = self.root.GetExport(child)
+      except (KeyError, IndexError):
+        continue
+      self._Watch(child)
+    for child in old:
+      self._Unwatch(child, self.params[child])
+      del self.params[child]
+
+  def GetAttributes(self, name):
+    """Returns (notification, access_list) for parameter name.
+
+    If name has no attributes of its own, they come from the nearest partial
+    path above it that does.
+    """
+    ancestors = self.params.Ancestors(name)
+    if not ancestors:
+      return 0, None
+    _, attrs = ancestors[-1]
+    return attrs.notification, attrs.access_list
 
   def GetParameterAttribute(self, name, attr):
     """Retrieve the given attribute for the parameter name."""
-    if name not in self.params:
-      self.params[name] = ParameterAttributes.Attributes()
-
+    notification, access_list = self.GetAttributes(name)
     if attr == 'Notification':
-      return self.params[name].notification
+      return notification
     if attr == 'AccessList':
-      return self.params[name].access_list
+      return access_list
     raise ValueError('Attribute %s is not supported.' % attr)
 
-  def CheckForTriggers(self):
-    """Checks if a notification needs to be sent to the ACS."""
-    for paramname in self.params:
+  def _Watch(self, name):
+    """Start (or restart) watching parameter name for changes."""
+    attrs = self.params[name]
+    self._Unwatch(name, attrs)
+    if attrs.notification not in (PASSIVE_NOTIFY, ACTIVE_NOTIFY):
+      return
+    now = tr.monohelper.monotime()
+    target = self._Observable(name)
+    if target and self._Observe(name, attrs, target):
+      self._SetNextCheck(name, attrs, now + MAX_REFRESH_TIMEOUT)
+    else:
+      # Start polls at random times, so that parameters which were all
+      # set at once don't all get polled at once.
+      attrs.interval = REFRESH_TIMEOUT
+      self._SetNextCheck(
+          name, attrs, now + random.uniform(0.5, 1.0) * REFRESH_TIMEOUT)
+
+  def _Unwatch(self, name, attrs):
+    """Stop watching parameter name, whose Attributes are attrs."""
+    attrs.next_check = None
+    key = attrs.observed
+    if key is None:
+      return
+    attrs.observed = attrs.observed_ref = None
+    callback, names = self.observers[key]
+    names.discard(name)
+    if not names:
+      cls, attrname = key
+      tr.cwmptypes.DelObserver(cls, attrname, callback)
+      del self.observers[key]
+
+  def _Observable(self, name):
+    """Returns (obj, attrname) holding parameter name, if we can observe it."""
+    try:
+      target = self.root.FindObservable(name)
+    except (KeyError, IndexError):
+      return None
+    if target is None or not tr.cwmptypes.Observable(*target):
+      return None
+    return target
+
+  def _Observe(self, name, attrs, target):
+    """Ask to be called back when parameter name, found in target, changes.
+
+    Args:
+      name: the parameter name.
+      attrs: the parameter's Attributes.
+      target: (obj, attrname), as returned by _Observable.
+    Returns:
+      True if we are now observing the parameter.
+    """
+    obj, attrname = target
+    try:
+      attrs.observed_ref = weakref.ref(obj)
+    except TypeError:
+      return False
+    key = attrs.observed = (type(obj), attrname)
+    if key not in self.observers:
+      callback = _ObserverCallback(weakref.ref(self), key)
+      tr.cwmptypes.AddObserver(type(obj), attrname, callback)
+      self.observers[key] = (callback, set())
+    self.observers[key][1].add(name)
+    return True
+
+  def _Changed(self, key, obj):
+    """Called back when the attribute key of obj might have changed."""
+    for name in self.observers[key][1]:
+      if self.params[name].observed_ref() is obj:
+        self.changed.add(name)
+    if self.changed and not self.changed_scheduled:
+      self.changed_scheduled = True
+      self.ioloop.add_callback(self._CheckChanged)
+
+  def _CheckChanged(self):
+    self.changed_scheduled = False
+    changed = self.changed
+    self.changed = set()
+    self._Check(name for name in changed if name in self.params)
+
+  def _SetNextCheck(self, name, attrs, when):
+    attrs.next_check = when
+    heapq.heappush(self.schedule, (when, name))
+    self._ScheduleCheck(when)
+
+  def _ScheduleCheck(self, when):
+    """Make sure _CheckDue runs no later than monotime when."""
+    if self.timeout is not None:
+      if self.timeout_at <= when:
+        return
+      self.ioloop.remove_timeout(self.timeout)
+    delay = max(0, when - tr.monohelper.monotime())
+    self.timeout_at = when
+    self.timeout = self.ioloop.add_timeout(
+        datetime.timedelta(0, delay), self._CheckDue)
+
+  def _PopSchedule(self, until):
+    """Remove and return the names of all parameters due by until."""
+    due = []
+    while self.schedule and self.schedule[0][0] <= until:
+      when, name = heapq.heappop(self.schedule)
+      attrs = self.params.get(name)
+      # Skip entries that have since been rescheduled or removed.
+      if attrs is not None and attrs.next_check == when:
+        due.append(name)
+    return due
+
+  def _CheckDue(self):
+    """Poll or re-check whichever parameters are due."""
+    self.timeout = self.timeout_at = None
+    now = tr.monohelper.monotime()
+    due = self._PopSchedule(now + 1)
+    generation = tr.core.StructureGeneration()
+    if generation != self.generation:
+      self.generation = generation
+      for _, names in self.observers.values():
+        due.extend(names)
+      for name in list(self.partials):
+        self._ExpandPartial(name)
+    for name in set(due):
+      attrs = self.params.get(name)
+      if attrs is None or attrs.next_check is None:
+        continue
+      if name in self.partials:
+        # Ephemeral tables like Device.Hosts.Host come and go without
+        # changing the structure generation, so re-expand on a schedule.
+        self._ExpandPartial(name)
+        self._SetNextCheck(name, attrs, now + REFRESH_TIMEOUT)
+        continue
+      target = self._Observable(name)
+      if target and attrs.observed and attrs.observed_ref() is target[0]:
+        # Still observing the right object, so we already know if it changed.
+        self._SetNextCheck(name, attrs, now + MAX_REFRESH_TIMEOUT)
+        continue
+      self._Unwatch(name, attrs)
+      if target and self._Observe(name, attrs, target):
+        self._SetNextCheck(name, attrs, now + MAX_REFRESH_TIMEOUT)
+        self._Check([name])  # it might have changed while we weren't looking
+        continue
+      if self._Check([name]) or attrs.notification == ACTIVE_NOTIFY:
+        attrs.interval = REFRESH_TIMEOUT
+      else:
+        attrs.interval = min(attrs.interval * 2, MAX_REFRESH_TIMEOUT)
+      self._SetNextCheck(name, attrs, now + attrs.interval)
+    self._ScheduleAll()
+
+  def _ScheduleAll(self):
+    self._PopSchedule(-1)  # not due yet, but throws away stale entries
+    times = []
+    while self.schedule:
+      when, name = self.schedule[0]
+      attrs = self.params.get(name)
+      if attrs is not None and attrs.next_check == when:
+        times.append(when)
+        break
+      heapq.heappop(self.schedule)
+    if self.observers or self.partials:
+      # Look for changes to the tree structure now and then.
+      times.append(tr.monohelper.monotime() + REFRESH_TIMEOUT)
+    if times:
+      self._ScheduleCheck(min(times))
+
+  def _Check(self, names):
+    """Check whether any of the given parameters have changed.
+
+    Args:
+      names: an iterable of parameter names.
+    Returns:
+      True if any of them changed.
+    """
+    any_changed = False
+    for paramname in names:
       try:
         start = tr.monohelper.monotime()
         value = self.root.GetExport(paramname)
@@ -292,18 +615,113 @@ class ParameterAttributes(object):
       # It is okay to call the set_notification_parameters_cb multiple
       # times, the caller will build up a list of all the parameters to
       # inform with.
-      if ((attrs.notification == PASSIVE_NOTIFY or
-           attrs.notification == ACTIVE_NOTIFY) and
-          value != attrs.current_value and
-          self.set_notification_parameters_cb):
-        self.set_notification_parameters_cb([(paramname, value)])
-        if (self.new_value_change_session_cb and
-            attrs.notification == ACTIVE_NOTIFY):
-          self.new_value_change_session_cb()
+      if value != attrs.current_value:
+        any_changed = True
+        if ((attrs.notification == PASSIVE_NOTIFY or
+             attrs.notification == ACTIVE_NOTIFY) and
+            self.set_notification_parameters_cb):
+          self.set_notification_parameters_cb([(paramname, value)])
+          if (self.new_value_change_session_cb and
+              attrs.notification == ACTIVE_NOTIFY):
+            self.new_value_change_session_cb()
       attrs.current_value = value
-    self.ioloop.remove_timeout(self.timeout)
-    self.timeout = self.ioloop.add_timeout(
-        datetime.timedelta(0, REFRESH_TIMEOUT), self.CheckForTriggers)
+    return any_changed
+
+  def CheckForTriggers(self):
+    """Checks all parameters now to see if the ACS needs to be notified."""
+    for name in list(self.partials):
+      self._ExpandPartial(name)
+    self._Check(name for name in self.params.keys()
+                if not _IsPartialPath(name))
+
+
+def _IsPartialPath(name):
+  return not name or name.endswith('.')
+
+
+def _ObserverCallback(attrs_ref, key):
+  """Returns a tr.cwmptypes observer that calls attrs_ref()._Changed(key)."""
+
+  def Observer(obj):
+    parameter_attrs = attrs_ref()
+    if parameter_attrs is not None:
+      # pylint:disable=protected-access
+      parameter_attrs._Changed(key, obj)
+  return Observer
+
+
+class ValueSnapshots(object):
+  """Parameter values from earlier GetParameterValuesDelta calls, by token.
+
+  Snapshots outlive the session they were taken in, since the ACS normally
+  asks for a delta against what it saw at the previous periodic Inform.
+  Tokens include a random prefix chosen at startup, so a token from before
+  cwmpd restarted is never mistaken for one of ours.
+  """
+
+  def __init__(self, max_bytes):
+    self.max_bytes = max_bytes
+    self.bytes = 0
+    self.snapshots = collections.OrderedDict()
+    self.prefix = '%08x' % random.getrandbits(32)
+    self.serial = 0
+
+  def Get(self, token):
+    """Returns (parameter_names, {name: (xsitype, text)}) for token, or None."""
+    entry = self.snapshots.pop(token, None)
+    if entry is None:
+      return None
+    self.snapshots[token] = entry  # most recently used
+    return entry[0], entry[1]
+
+  def Add(self, parameter_names, values):
+    """Remember values ({name: (xsitype, text)}), return a new token for them.
+
+    The values are what api_soap.Soapify() makes of each parameter, ie.
+    what the ACS was sent.  Comparing those, rather than the parameters
+    themselves, catches type changes (1 and True are equal in Python), and
+    isn't fooled by objects which were changed in place.
+    """
+    self.serial += 1
+    token = '%s.%d' % (self.prefix, self.serial)
+    size = _SnapshotSize(values)
+    if size > self.max_bytes:
+      return token  # too big to keep; asking for its delta gets everything
+    self.snapshots[token] = (tuple(parameter_names), values, size)
+    self.bytes += size
+    while self.bytes > self.max_bytes:
+      _, (_, _, oldsize) = self.snapshots.popitem(last=False)
+      self.bytes -= oldsize
+    return token
+
+
+def _SnapshotSize(values):
+  size = 0
+  for name, (xsitype, text) in values.iteritems():
+    size += _SNAPSHOT_ENTRY_BYTES + len(name) + len(xsitype) + len(text)
+  return size
+
+
+class _WorkerPool(object):
+  """Up to size daemon threads, started as needed, running queued jobs."""
+
+  def __init__(self, size):
+    self.size = size
+    self.jobs = Queue.Queue()
+    self.threads = []
+
+  def Run(self, job):
+    """Call job() on one of the threads.  It must not raise."""
+    self.jobs.put(job)
+    if len(self.threads) < self.size:
+      t = threading.Thread(target=self._Worker, name='GetParameterValues')
+      t.daemon = True
+      t.start()
+      self.threads.append(t)
+
+  def _Worker(self):
+    while True:
+      self.jobs.get()()
 
 
 class CPE(TR069Service):
@@ -318,6 +736,10 @@ class CPE(TR069Service):
     self.inform_response_received_cb = None
     self.parameter_attrs = ParameterAttributes(
         root, tornado.ioloop.IOLoop.instance())
+    # If nonzero, GetParameterValues may use up to this many threads.
+    self.gpv_threads = 0
+    self.gpv_pool = None
+    self.delta_snapshots = ValueSnapshots(DELTA_SNAPSHOT_BYTES)
 
   # There's some magic here, functions that start with a capital letter
   # are assumed to be ACS invokable, for example 'SetParameterAttributes'
@@ -488,27 +910,166 @@ class CPE(TR069Service):
   def GetParameterValues(self, parameter_names):
     """Gets parameters from some objects.
 
+    Partial paths (ending in '.') include every parameter in the subtree
+    underneath them.  Values are generated one at a time, so a big subtree
+    never has to be held in memory all at once.
+
+    If self.gpv_threads is set, parameters from different parts of the
+    tree (see GPV_GROUP_DEPTH) are fetched in parallel, by a pool of that
+    many threads, so getters which wait on slow sources (forking wl,
+    mocactl, smartctl...) wait at the same time instead of one after
+    another.  Each parameter's values are collected into a list before
+    they are generated.
+
+    Getters then run outside the main thread, while the ioloop waits for
+    them, so they must not wait for the ioloop either.  The shared
+    bookkeeping they reach through tr (session.cache, Handle path caches,
+    the core parent index, FileBacked watches and counters, latency
+    sampling, tr.mainloop.RunCommand) is locked, and Command.Wait() reads
+    the subprocess's output itself; but getters with state of their own
+    must be thread safe too.  Only turn this on for data models where
+    that's known to be the case.
+
     Args:
       parameter_names: a list of parameter name strings.
     Returns:
-      A list of (name, value) tuples.
+      A generator of (name, value) tuples, in the order requested.
+    Raises:
+      ParameterNameError: if one of the parameters doesn't exist.  This
+        can happen after some values have already been generated.
     """
-    result = []
+    if self.gpv_threads > 0 and len(parameter_names) > 1:
+      return self._GetParameterValuesParallel(parameter_names)
+    return self._GetParameterValuesInOrder(parameter_names)
+
+  def _GetParameterValuesInOrder(self, parameter_names):
     for param in parameter_names:
-      if not param:
-        # tr69 A.3.2.2: empty string indicates top of the name hierarchy.
-        paramlist = self.root.ListExports(None, recursive=False)
-        parameter_names.extend(paramlist)
-      elif param.endswith('.'):
-        paramlist = self.root.ListExports(param[:-1], False)
-        for p in paramlist:
-          parameter_names.append(param + p)
-      else:
+      for item in self._GetValues(param):
+        yield item
+
+  def _GetValues(self, param):
+    """Yields (name, value) for parameter or partial path param."""
+    if not param or param.endswith('.'):
+      # tr69 A.3.2.2: empty string indicates top of the name hierarchy.
+      for item in self._GetSubtreeValues(param):
+        yield item
+    else:
+      try:
+        if tr.latency.Enable:
+          value = tr.latency.parameters.Get(param, self._GetParameterValue,
+                                            param)
+        else:
+          value = self._GetParameterValue(param)
+      except KeyError:
+        raise ParameterNameError(parameter=param, msg=param)
+      yield param, value
+
+  def _GetParameterValuesParallel(self, parameter_names):
+    """Like _GetParameterValuesInOrder, with a thread per group of names."""
+    groups = collections.OrderedDict()
+    for i, param in enumerate(parameter_names):
+      group = tuple(param.split('.', GPV_GROUP_DEPTH)[:GPV_GROUP_DEPTH])
+      groups.setdefault(group, []).append(i)
+    if len(groups) < 2:
+      return self._GetParameterValuesInOrder(parameter_names)
+
+    # results[i] is ([(name, value)...], None) or (None, sys.exc_info())
+    results = [None] * len(parameter_names)
+    done = [threading.Event() for _ in parameter_names]
+
+    def Job(indexes):
+      for i in indexes:
+        try:
+          result = (list(self._GetValues(parameter_names[i])), None)
+        except Exception:  # pylint:disable=broad-except
+          # Re-raised in order, by the generator below.  Nobody will
+          # ask for the rest of this group after that.
+          result = (None, sys.exc_info())
+        # Once done[i] is set, the generator may take results[i] away.
+        results[i] = result
+        done[i].set()
+        if result[1]:
+          break
+
+    if self.gpv_pool is None:
+      self.gpv_pool = _WorkerPool(self.gpv_threads)
+    self.gpv_pool.size = self.gpv_threads
+    for indexes in groups.itervalues():
+      self.gpv_pool.Run(lambda indexes=indexes: Job(indexes))
+    return self._CollectInOrder(results, done)
+
+  def _CollectInOrder(self, results, done):
+    for i in xrange(len(results)):
+      done[i].wait()
+      values, exc_info = results[i]
+      results[i] = None
+      if exc_info:
+        raise exc_info[0], exc_info[1], exc_info[2]
+      for item in values:
+        yield item
+
+  def X_CATAWAMPUS_ORG_GetParameterValuesDelta(self, parameter_names, token):
+    """Gets the parameters which changed since an earlier call.
+
+    This is not a standard method in TR-069, it's an extension we added.
+    It's for ACSes which poll big subtrees, most of which stays the same
+    from one poll to the next.
+
+    Args:
+      parameter_names: a list of parameter name strings, like
+        GetParameterValues.
+      token: the token returned by an earlier call with the same
+        parameter_names, or '' to get everything.
+    Returns:
+      A tuple of (new_token, complete, changed, deleted).
+      new_token: the token to pass next time.
+      complete: True if changed contains every parameter, because token
+        was empty, unknown, expired or for different parameter_names.
+      changed: a list of (name, value) which are new or different since
+        token, in the order GetParameterValues would return them.
+      deleted: a sorted list of names which existed at token, but don't now.
+    Raises:
+      ParameterNameError: if one of the parameters doesn't exist.
+    """
+    # api_soap imports this module.
+    import api_soap  # pylint:disable=g-import-not-at-top
+    changed = []
+    values = {}
+    for name, value in self.GetParameterValues(parameter_names):
+      changed.append((name, value))
+      values[name] = api_soap.Soapify(value)
+    old = self.delta_snapshots.Get(token) if token else None
+    new_token = self.delta_snapshots.Add(parameter_names, values)
+    if old is None or old[0] != tuple(parameter_names):
+      return new_token, True, changed, []
+    old_values = old[1]
+    changed = [(name, value) for name, value in changed
+               if old_values.get(name) != values[name]]
+    deleted = sorted(name for name in old_values if name not in values)
+    return new_token, False, changed, deleted
+
+  def _GetSubtreeValues(self, path):
+    """Yields (name, value) for every parameter under partial path path."""
+    try:
+      exports = self.root.ListExportsEx(path[:-1] or None, recursive=True)
+      for name, h, subname in exports:
+        if name.endswith('.'):
+          continue  # an object, not a parameter
+        fullname = path + name
         try:
-          result.append((param, self._GetParameterValue(param)))
+          # h is the handle of the parameter's own object, so this doesn't
+          # have to walk all the way down from the root again.
+          if tr.latency.Enable:
+            value = tr.latency.parameters.Get(fullname, h.GetExport, subname)
+          else:
+            value = h.GetExport(subname)
         except KeyError:
-          raise ParameterNameError(parameter=param, msg=param)
-    return result
+          raise ParameterNameError(parameter=fullname, msg=fullname)
+        yield fullname, value
+    except ParameterNameError:
+      raise
+    except KeyError:
+      raise ParameterNameError(parameter=path, msg=path)
 
   def _JoinParamPath(self, parameter_path, param):
     if parameter_path:
@@ -559,13 +1120,47 @@ class CPE(TR069Service):
       attrs: A dict of parameters to set.
     """
     param = attrs['Name']
-    if not self.root.SetExportAttrs(param, attrs):
-      # TODO(jnewlin): Handle the case with the partial path.
+    try:
+      handled = self.root.SetExportAttrs(param, attrs)
+    except KeyError:
+      raise ParameterNameError(parameter=param, msg=param)
+    if not handled:
       self.parameter_attrs.SetParameterAttributes(attrs)
 
   def GetParameterAttributes(self, parameter_names):
-    """Get attributes (access control, notifications) on some parameters."""
-    raise NotImplementedError()
+    """Get attributes (access control, notifications) on some parameters.
+
+    Args:
+      parameter_names: a list of parameter names or partial paths.  A
+        partial path returns the attributes of every parameter under it.
+    Returns:
+      A list of (name, notification, access_list) tuples, where access_list
+      is a (possibly empty) list of strings.
+    """
+    result = []
+    for param in parameter_names:
+      try:
+        if param.endswith('.') or not param:
+          names = [param + p for p in
+                   self.root.ListExports(param[:-1] or None, recursive=True)
+                   if not p.endswith('.')]
+        else:
+          self.root.GetExport(param)
+          names = [param]
+        for name in names:
+          result.append((name,) + self._GetAttributes(name))
+      except KeyError:
+        raise ParameterNameError(parameter=param, msg=param)
+    return result
+
+  def _GetAttributes(self, name):
+    attrs = self.root.GetExportAttrs(name)
+    if attrs is not None:
+      notification = attrs.get('Notification', 0)
+      access_list = attrs.get('AccessList')
+    else:
+      notification, access_list = self.parameter_attrs.GetAttributes(name)
+    return notification, [access_list] if access_list else []
 
   def AddObject(self, object_name, parameter_key):
     """Create a new object with default parameters."""
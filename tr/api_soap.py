@@ -30,6 +30,8 @@ import api
 import core
 import cwmpbool
 import cwmpdate
+import latency
+import monohelper
 import soap
 
 
@@ -119,6 +121,15 @@ class Encode(object):
             xml.string(name)
     return xml
 
+  def X_CATAWAMPUS_ORG_GetParameterValuesDelta(self, parameter_names, token):
+    with self._Envelope() as xml:
+      with xml['cwmp:X_CATAWAMPUS_ORG_GetParameterValuesDelta']:
+        with xml.ParameterNames:
+          for name in parameter_names:
+            xml.string(name)
+        xml.Token(unicode(token))
+    return xml
+
   def SetParameterValues(self, parameter_list, parameter_key):
     """Encode a SetParameterValues command."""
     with self._Envelope() as xml:
@@ -211,19 +222,34 @@ class SoapHandler(object):
       faults.append((parameter, code, unicode(error)))
     return faults
 
-  def Handle(self, body):
+  def Handle(self, body, root=None):
     """Dispatch the given XML request to the implementation.
 
     Args:
       body: the xml string of the request.
+      root: if not None, the ElementTree root of body, if it has already
+        been parsed for logging.
     Returns:
       an xml string for the response, or None if no response is expected.
     """
+    xml = self.Respond(body, root=root)
+    if xml is not None:
+      return bytes(xml)   # the utf-8 encoded XML response (pass or fail)
+    else:
+      return None  # no response generated
+
+  def Respond(self, body, root=None):
+    """Like Handle(), but returns the response as a soap.Writer (or None).
+
+    The Writer still has the response's terse log (see cwmplog.TerseLog).
+    """
+    start = monohelper.monotime()
     # Data arriving from tornado web server should be non-decoded utf-8
     body = bytes(body)
-    obj = soap.Parse(body)  # decodes as utf-8, via ElementTree
-    request_id = obj.Header.get('ID', None)
-    req = obj.Body[0]
+    # This only parses as far as the start of the RPC method; the rest is
+    # parsed as the responder asks for it.
+    header, req = soap.ParseRequest(body, root=root)
+    request_id = header.get('ID', None)
     method = req.name
     with soap.Envelope(request_id, None) as xml:
       try:
@@ -257,10 +283,9 @@ class SoapHandler(object):
             faultstring=traceback.format_exc())
         traceback.print_exc()
 
-    if result is not None:
-      return bytes(xml)   # the utf-8 encoded XML response (pass or fail)
-    else:
-      return None  # no response generated
+    if latency.Enable:
+      latency.rpcs.Add(method, monohelper.monotime() - start)
+    return xml if result is not None else None
 
   def _GetResponder(self, method):
     try:
@@ -311,36 +336,82 @@ class CPE(SoapHandler):
       return soap.SimpleFault(
           xml, soap.CpeFault.INVALID_ARGUMENTS,
           faultstring='No such parameter: %s' % unicode(path))
-    names = list(self.impl.GetParameterNames(path, nextlevel))
-
-    soaptype = 'ParameterInfoStruct[{0}]'.format(len(names))
-    parameter_list_attrs = {'soap-enc:arrayType': soaptype}
-    with xml['cwmp:GetParameterNamesResponse']:
-      with xml.ParameterList(**parameter_list_attrs):
-        for name in names:
-          with xml['ParameterInfoStruct']:
-            xml.Name(name)
-            xml.Writable('1')  # TODO(apenwarr): detect true writability here
+    with xml.AllOrNothing():
+      xml.StartTag('cwmp:GetParameterNamesResponse')
+      slot = xml.ReserveStartTag('ParameterList')
+      count = 0
+      for name in self.impl.GetParameterNames(path, nextlevel):
+        xml.StartTag('ParameterInfoStruct')
+        xml.TextElement('Name', name)
+        xml.TextElement('Writable', '1')  # TODO(apenwarr): detect writability
+        xml.EndTag('ParameterInfoStruct')
+        count += 1
+      soaptype = 'ParameterInfoStruct[{0}]'.format(count)
+      xml.FillStartTag(slot, {'soap-enc:arrayType': soaptype})
+      xml.EndTag('ParameterList')
+      xml.EndTag('cwmp:GetParameterNamesResponse')
     return xml
 
   def GetParameterValues(self, xml, req):
-    """Process a GetParameterValues request."""
-    names = [unicode(i) for i in req.ParameterNames]
-    values = self.impl.GetParameterValues(names)
-    soaptype = 'cwmp:ParameterValueStruct[{0}]'.format(len(values))
-    parameter_list_attrs = {'soap-enc:arrayType': soaptype}
-    with xml['cwmp:GetParameterValuesResponse']:
-      with xml.ParameterList(**parameter_list_attrs):
-        for name, value in values:
-          with xml.ParameterValueStruct:
-            xml.Name(name)
-            soapyvalue = Soapify(value)
-            xml.Value(soapyvalue[1], xsi__type=soapyvalue[0])
+    """Process a GetParameterValues request.
+
+    Each value is encoded straight into the response as soon as it is
+    generated.  The ParameterList start tag needs the count, so it gets
+    filled in at the end.
+    """
+    names = [unicode(i) for i in req.Stream('ParameterNames')]
+    with xml.AllOrNothing():
+      xml.StartTag('cwmp:GetParameterValuesResponse')
+      slot = xml.ReserveStartTag('ParameterList')
+      count = 0
+      for name, value in self.impl.GetParameterValues(names):
+        xsitype, text = Soapify(value)
+        xml.StartTag('ParameterValueStruct')
+        xml.TextElement('Name', name)
+        xml.TextElement('Value', text, {'xsi:type': xsitype})
+        xml.EndTag('ParameterValueStruct')
+        count += 1
+      soaptype = 'cwmp:ParameterValueStruct[{0}]'.format(count)
+      xml.FillStartTag(slot, {'soap-enc:arrayType': soaptype})
+      xml.EndTag('ParameterList')
+      xml.EndTag('cwmp:GetParameterValuesResponse')
+    return xml
+
+  def X_CATAWAMPUS_ORG_GetParameterValuesDelta(self, xml, req):
+    """Process a GetParameterValuesDelta request (a vendor extension).
+
+    Like GetParameterValues, but only returns the parameters which changed
+    since Token, and the names of the ones which were deleted.
+    """
+    names = [unicode(i) for i in req.Stream('ParameterNames')]
+    token = unicode(req.get('Token', ''))
+    new_token, complete, changed, deleted = (
+        self.impl.X_CATAWAMPUS_ORG_GetParameterValuesDelta(names, token))
+    with xml.AllOrNothing():
+      xml.StartTag('cwmp:X_CATAWAMPUS_ORG_GetParameterValuesDeltaResponse')
+      soaptype = 'cwmp:ParameterValueStruct[{0}]'.format(len(changed))
+      xml.StartTag('ParameterList', {'soap-enc:arrayType': soaptype})
+      for name, value in changed:
+        xsitype, text = Soapify(value)
+        xml.StartTag('ParameterValueStruct')
+        xml.TextElement('Name', name)
+        xml.TextElement('Value', text, {'xsi:type': xsitype})
+        xml.EndTag('ParameterValueStruct')
+      xml.EndTag('ParameterList')
+      soaptype = 'xsd:string[{0}]'.format(len(deleted))
+      xml.StartTag('DeletedParameterNames', {'soap-enc:arrayType': soaptype})
+      for name in deleted:
+        xml.TextElement('string', name)
+      xml.EndTag('DeletedParameterNames')
+      xml.TextElement('Complete', cwmpbool.format(complete))
+      xml.TextElement('Token', new_token)
+      xml.EndTag('cwmp:X_CATAWAMPUS_ORG_GetParameterValuesDeltaResponse')
     return xml
 
   def SetParameterValues(self, xml, req):
     # p[0] and p[1] are soap.NodeWrapper.  Coerce them into strings.
-    names = [(unicode(p[0]), unicode(p[1])) for p in req.ParameterList]
+    names = [(unicode(p[0]), unicode(p[1]))
+             for p in req.Stream('ParameterList')]
     code = self.impl.SetParameterValues(names, req.ParameterKey)
     with xml['cwmp:SetParameterValuesResponse']:
       xml.Status(unicode(int(code)))
@@ -389,11 +460,34 @@ class CPE(SoapHandler):
     # (Name, InternetGatewayDevice.PeriodicStatistics.SampleSet.0.Status)
     # (Notification, true)
     # (NotificationChange, true)
-    for spas in req.ParameterList:
-      self.impl.SetParameterAttributes(dict(spas.iteritems()))
+    # Read them all before setting any, in case the request turns out to
+    # be malformed partway through.
+    spa_list = [dict(spas.iteritems()) for spas in req.Stream('ParameterList')]
+    for spas in spa_list:
+      self.impl.SetParameterAttributes(spas)
     xml['cwmp:SetParameterAttributesResponse'](None)
     return xml
 
+  def GetParameterAttributes(self, xml, req):
+    """Process a GetParameterAttributes request."""
+    names = [unicode(i) for i in req.Stream('ParameterNames')]
+    attrs = self.impl.GetParameterAttributes(names)
+    soaptype = 'cwmp:ParameterAttributeStruct[{0}]'.format(len(attrs))
+    parameter_list_attrs = {'soap-enc:arrayType': soaptype}
+    with xml['cwmp:GetParameterAttributesResponse']:
+      with xml.ParameterList(**parameter_list_attrs):
+        for name, notification, access_list in attrs:
+          with xml.ParameterAttributeStruct:
+            xml.Name(name)
+            xml.Notification(unicode(notification))
+            access_list_attrs = {
+                'soap-enc:arrayType': 'xsd:string[{0}]'.format(
+                    len(access_list))}
+            with xml.AccessList(**access_list_attrs):
+              for entity in access_list:
+                xml.string(entity)
+    return xml
+
   def Download(self, xml, req):
     """Start a Download request (returns before download is done)."""
     username = getattr(req, 'Username', None)
@@ -21,11 +21,14 @@
 __author__ = 'dgentry@google.com (Denton Gentry)'
 
 import datetime
+import time
 import xml.etree.cElementTree as ET
 import google3
 import api
 import api_soap
 import garbage
+import soap
+import xmlwitch
 from wvtest import unittest
 
 
@@ -52,6 +55,62 @@ class RpcMessageTest(unittest.TestCase):
     self.assertTrue(xfer.find('CompleteTime').text)
 
 
+class FakeGpvCpe(object):
+  """Just enough of api.CPE to return lots of parameters."""
+
+  def __init__(self, count):
+    self.count = count
+
+  def GetParameterValues(self, unused_names):
+    when = datetime.datetime(2017, 1, 2, 3, 4, 5)
+    for i in xrange(self.count):
+      prefix = 'Device.Hosts.Host.%d.' % i
+      yield prefix + 'Active', bool(i % 2)
+      yield prefix + 'HostName', u'host<%d> & caf\xe9' % i
+      yield prefix + 'LeaseTimeRemaining', i
+      yield prefix + 'X_CATAWAMPUS-ORG_LastSeen', when
+
+
+class FakeDeltaCpe(object):
+  """Just enough of api.CPE for X_CATAWAMPUS_ORG_GetParameterValuesDelta."""
+
+  def __init__(self):
+    self.args = None
+
+  def X_CATAWAMPUS_ORG_GetParameterValuesDelta(self, names, token):
+    self.args = (names, token)
+    return ('abc.2', False, [('Device.Hosts.Host.1.Active', True)],
+            ['Device.Hosts.Host.2.Active', 'Device.Hosts.Host.2.HostName'])
+
+
+GPV_REQUEST = """<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/" xmlns:cwmp="urn:dslforum-org:cwmp-1-2"><soapenv:Header><cwmp:ID soapenv:mustUnderstand="1">TestCwmpId</cwmp:ID></soapenv:Header><soapenv:Body><cwmp:GetParameterValues><ParameterNames><string>Device.Hosts.</string></ParameterNames></cwmp:GetParameterValues></soapenv:Body></soapenv:Envelope>"""
+
+
+def GpvRequest():
+  return soap.ParseRequest(GPV_REQUEST)[1]
+
+
+def XmlwitchBuilder(listener=None, **kwargs):
+  """xmlwitch.Builder, taking the same arguments as soap.Writer."""
+  _ = listener
+  return xmlwitch.Builder(**kwargs)
+
+
+def XmlwitchGetParameterValues(impl, req):
+  """How GetParameterValues responses used to be encoded, for comparison."""
+  values = list(impl.GetParameterValues(req.ParameterNames))
+  with soap.Envelope('TestCwmpId', None) as xml:
+    with xml['cwmp:GetParameterValuesResponse']:
+      soaptype = 'cwmp:ParameterValueStruct[{0}]'.format(len(values))
+      with xml.ParameterList(**{'soap-enc:arrayType': soaptype}):
+        for name, value in values:
+          with xml.ParameterValueStruct:
+            xml.Name(name)
+            soapyvalue = api_soap.Soapify(value)
+            xml.Value(soapyvalue[1], xsi__type=soapyvalue[0])
+  return str(xml)
+
+
 class ApiSoapTest(unittest.TestCase):
   """Tests for methods in api_soap.py."""
 
@@ -107,6 +166,51 @@ class ApiSoapTest(unittest.TestCase):
       self.assertEqual(expected[0], fault[1])
       expected = expected[1:]
 
+  def testGetParameterValuesDelta(self):
+    encode = api_soap.Encode()
+    req = str(encode.X_CATAWAMPUS_ORG_GetParameterValuesDelta(
+        ['Device.Hosts.', 'Device.WiFi.'], 'abc.1'))
+    impl = FakeDeltaCpe()
+    resp = api_soap.CPE(impl).Handle(req)
+    self.assertEqual((['Device.Hosts.', 'Device.WiFi.'], 'abc.1'), impl.args)
+    root = ET.fromstring(resp)
+    delta = root.find(SOAPNS + 'Body/' + CWMPNS +
+                      'X_CATAWAMPUS_ORG_GetParameterValuesDeltaResponse')
+    values = delta.findall('ParameterList/ParameterValueStruct')
+    self.assertEqual(1, len(values))
+    self.assertEqual('Device.Hosts.Host.1.Active', values[0].find('Name').text)
+    self.assertEqual('1', values[0].find('Value').text)
+    self.assertEqual('xsd:string[2]',
+                     delta.find('DeletedParameterNames').get(
+                         '{http://schemas.xmlsoap.org/soap/encoding/}'
+                         'arrayType'))
+    self.assertEqual(['Device.Hosts.Host.2.Active',
+                      'Device.Hosts.Host.2.HostName'],
+                     [e.text for e in delta.findall(
+                         'DeletedParameterNames/string')])
+    self.assertEqual('0', delta.find('Complete').text)
+    self.assertEqual('abc.2', delta.find('Token').text)
+
+  def testGetParameterValuesBenchmark(self):
+    for count in [1000, 10000, 50000]:
+      impl = FakeGpvCpe(count / 4)
+      old_envelope = soap.Writer
+      soap.Writer = XmlwitchBuilder
+      try:
+        start = time.time()
+        expected = XmlwitchGetParameterValues(impl, GpvRequest())
+        before = time.time() - start
+      finally:
+        soap.Writer = old_envelope
+      start = time.time()
+      with soap.Envelope('TestCwmpId', None) as xml:
+        api_soap.CPE(impl).GetParameterValues(xml, GpvRequest())
+      result = str(xml)
+      after = time.time() - start
+      print '%d parameters: %.3fs with xmlwitch, %.3fs with soap.Writer' % (
+          count, before, after)
+      self.assertTrue(expected == result)  # too big to print if it fails
+
 
 if __name__ == '__main__':
   unittest.main()
@@ -20,11 +20,13 @@
 
 __author__ = 'apenwarr@google.com (Avery Pennarun)'
 
+import time
 import google3
 import tr.cwmptypes
 import api
 import core
 import handle
+import mainloop
 from wvtest import unittest
 
 
@@ -94,6 +96,19 @@ class TestObject(core.Exporter):
     return rc
 
 
+class EphemeralRoot(core.Exporter):
+  """Like Device.Hosts: the list is rebuilt on every access."""
+
+  def __init__(self):
+    core.Exporter.__init__(self)
+    self.Export(lists=['Host'])
+    self.hosts = {}
+
+  @property
+  def HostList(self):
+    return dict(self.hosts)
+
+
 class TestSimpleRoot(core.Exporter):
 
   def __init__(self):
@@ -102,6 +117,88 @@ class TestSimpleRoot(core.Exporter):
     self.SomeParam = 'SomeParamValue'
 
 
+class ObservedRoot(core.Exporter):
+  Watched = tr.cwmptypes.String('one')
+  ReadOnlyWatched = tr.cwmptypes.ReadOnlyInt(1)
+
+  def __init__(self):
+    core.Exporter.__init__(self)
+    self.Export(params=['Watched', 'ReadOnlyWatched', 'Polled'])
+    self.polled = 'one'
+
+  @property
+  def Polled(self):
+    return self.polled
+
+
+class SlowSource(core.Exporter):
+  """Parameters which take a while to read, like forking wl or mocactl."""
+
+  def __init__(self, name):
+    core.Exporter.__init__(self)
+    self.Export(params=['Status', 'Stats'])
+    self.name = name
+
+  @property
+  def Status(self):
+    time.sleep(0.1)
+    return self.name + '-status'
+
+  @property
+  def Stats(self):
+    time.sleep(0.1)
+    return self.name + '-stats'
+
+
+class CommandSource(core.Exporter):
+  """A parameter read with tr.mainloop.RunCommand, like smartctl."""
+
+  def __init__(self, name):
+    core.Exporter.__init__(self)
+    self.Export(params=['Status'])
+    self.name = name
+
+  @property
+  def Status(self):
+    cmd = mainloop.RunCommand(['echo', self.name])
+    cmd.Wait()
+    return cmd.out.strip()
+
+
+class SlowDevice(core.Exporter):
+
+  def __init__(self):
+    core.Exporter.__init__(self)
+    self.Export(objects=['WiFi', 'MoCA', 'Storage'])
+    self.WiFi = SlowSource('wifi')
+    self.MoCA = SlowSource('moca')
+    self.Storage = SlowSource('storage')
+
+
+class FakeIOLoop(object):
+  """Just enough of tornado.ioloop.IOLoop for ParameterAttributes."""
+
+  def __init__(self):
+    self.callbacks = []
+    self.timeouts = []
+
+  def add_callback(self, callback):
+    self.callbacks.append(callback)
+
+  def add_timeout(self, deadline, callback):
+    self.timeouts.append((deadline, callback))
+    return len(self.timeouts)
+
+  def remove_timeout(self, unused_timeout):
+    pass
+
+  def RunCallbacks(self):
+    callbacks = self.callbacks
+    self.callbacks = []
+    for callback in callbacks:
+      callback()
+
+
 class ApiTest(unittest.TestCase):
 
   def testObject(self):
@@ -117,7 +214,7 @@ class ApiTest(unittest.TestCase):
     self.assertEqual(h.GetExport(name).word, 'word1')
     self.assertRaises(KeyError, cpe._SetParameterValue,
                       '%s.not_exist' % name, 'word1')
-    result = cpe.GetParameterValues(['%s.word' % name])
+    result = list(cpe.GetParameterValues(['%s.word' % name]))
     self.assertEqual(result, [('%s.word' % name, 'word1')])
     self.assertEqual(changes, 1)
     self.assertRaises(api.SetParameterErrors,
@@ -162,17 +259,192 @@ class ApiTest(unittest.TestCase):
     self.assertEqual(len(objidx_list), 2)
     idxlist = objidx_list[0][1] + objidx_list[1][1]
     self.assertEqual(len(set(idxlist)), 7)
-    result = cpe.GetParameterValues([('Test.Thingy.%d' % int(idx))
-                                     for idx in idxlist])
+    result = list(cpe.GetParameterValues([('Test.Thingy.%d' % int(idx))
+                                          for idx in idxlist]))
     self.assertEqual([i.word for idx, i in result],
                      [None] * 7)
 
   def testGetParameterValuesEmpty(self):
     cpe = api.CPE(handle.Handle(TestSimpleRoot()))
-    result = cpe.GetParameterValues([''])
+    result = list(cpe.GetParameterValues(['']))
     self.assertTrue(result)
     self.assertEqual(result[0], ('SomeParam', 'SomeParamValue'))
 
+  def testGetParameterValuesPartial(self):
+    root = core.Exporter()
+    root.Export(objects=['Test'])
+    root.Test = TestObject()
+    cpe = api.CPE(handle.Handle(root))
+    cpe.X_CATAWAMPUS_ORG_AddObjects([('Test.Thingy.', 2)], 0)
+    cpe.root.GetExport('Test.Thingy.1')._word = 'one'
+    # The whole subtree, not just the next level.
+    self.assertEqual(
+        [('Test.Thingy.1.readonlyword', 'cant-write-me!'),
+         ('Test.Thingy.1.word', 'one'),
+         ('Test.Thingy.2.readonlyword', 'cant-write-me!'),
+         ('Test.Thingy.2.word', None)],
+        sorted(cpe.GetParameterValues(['Test.Thingy.'])))
+    self.assertEqual(18, len(list(cpe.GetParameterValues(['Test.']))))
+    self.assertEqual(18, len(list(cpe.GetParameterValues(['']))))
+
+    # Values are only looked up as they are needed.
+    values = cpe.GetParameterValues(['Test.Thingy.1.word', 'Test.Nonexist.'])
+    self.assertEqual(('Test.Thingy.1.word', 'one'), next(values))
+    self.assertRaises(api.ParameterNameError, next, values)
+    values = cpe.GetParameterValues(['Test.Thingy.1.nonexist'])
+    self.assertRaises(api.ParameterNameError, list, values)
+
+  def testGetParameterValuesParallel(self):
+    root = core.Exporter()
+    root.Export(objects=['Device'])
+    root.Device = SlowDevice()
+    cpe = api.CPE(handle.Handle(root))
+    names = ['Device.WiFi.Status', 'Device.MoCA.Status',
+             'Device.Storage.Status', 'Device.WiFi.Stats',
+             'Device.MoCA.Stats', 'Device.Storage.Stats']
+    start = time.time()
+    expected = list(cpe.GetParameterValues(names))
+    in_order = time.time() - start
+    cpe.gpv_threads = 4
+    start = time.time()
+    result = list(cpe.GetParameterValues(names))
+    parallel = time.time() - start
+    print 'GetParameterValues: %.3fs in order, %.3fs in parallel' % (
+        in_order, parallel)
+    self.assertEqual(expected, result)
+    self.assertEqual(('Device.WiFi.Status', 'wifi-status'), result[0])
+    # As long as the slowest source (0.2s), not all of them (0.6s)
+    self.assertLess(parallel, in_order * 0.6)
+
+    self.assertEqual(
+        [('Device.MoCA.Stats', 'moca-stats'),
+         ('Device.MoCA.Status', 'moca-status'),
+         ('Device.WiFi.Status', 'wifi-status')],
+        list(cpe.GetParameterValues(['Device.MoCA.', 'Device.WiFi.Status'])))
+    values = cpe.GetParameterValues(['Device.WiFi.Status', 'Device.Nonexist',
+                                     'Device.MoCA.Status'])
+    self.assertEqual(('Device.WiFi.Status', 'wifi-status'), next(values))
+    self.assertRaises(api.ParameterNameError, next, values)
+    # Every call above shared the same threads.
+    self.assertEqual(4, len(cpe.gpv_pool.threads))
+
+  def testGetParameterValuesParallelCommands(self):
+    root = core.Exporter()
+    root.Export(objects=['WiFi', 'MoCA'])
+    root.WiFi = CommandSource('wifi')
+    root.MoCA = CommandSource('moca')
+    cpe = api.CPE(handle.Handle(root))
+    cpe.gpv_threads = 2
+    loop = mainloop.MainLoop()
+    result = []
+
+    def Run():
+      # The ioloop is stuck here until the workers are done, so they have
+      # to run their subprocesses without its help.
+      result.extend(cpe.GetParameterValues(['WiFi.Status', 'MoCA.Status']))
+      loop.ioloop.stop()
+    loop.ioloop.add_callback(Run)
+    loop.Start(timeout=10)
+    self.assertEqual([('WiFi.Status', 'wifi'), ('MoCA.Status', 'moca')],
+                     result)
+
+  def testGetParameterValuesDelta(self):
+    root = core.Exporter()
+    root.Export(objects=['Test'])
+    root.Test = TestObject()
+    cpe = api.CPE(handle.Handle(root))
+    cpe.X_CATAWAMPUS_ORG_AddObjects([('Test.Thingy.', 2)], 0)
+    names = ['Test.Thingy.']
+    token1, complete, changed, deleted = (
+        cpe.X_CATAWAMPUS_ORG_GetParameterValuesDelta(names, ''))
+    self.assertTrue(complete)
+    self.assertEqual(4, len(changed))
+    self.assertEqual([], deleted)
+
+    token2, complete, changed, deleted = (
+        cpe.X_CATAWAMPUS_ORG_GetParameterValuesDelta(names, token1))
+    self.assertNotEqual(token1, token2)
+    self.assertFalse(complete)
+    self.assertEqual([], changed)
+    self.assertEqual([], deleted)
+
+    cpe.root.GetExport('Test.Thingy.1')._word = 'one'
+    cpe.DeleteObject('Test.Thingy.2.', 0)
+    cpe.AddObject('Test.Thingy.', 0)
+    token3, complete, changed, deleted = (
+        cpe.X_CATAWAMPUS_ORG_GetParameterValuesDelta(names, token2))
+    self.assertFalse(complete)
+    self.assertEqual([('Test.Thingy.1.word', 'one'),
+                      ('Test.Thingy.3.readonlyword', 'cant-write-me!'),
+                      ('Test.Thingy.3.word', None)], sorted(changed))
+    self.assertEqual(['Test.Thingy.2.readonlyword', 'Test.Thingy.2.word'],
+                     deleted)
+
+    # An older token still works, as long as it fits in the budget.
+    _, complete, changed, _ = (
+        cpe.X_CATAWAMPUS_ORG_GetParameterValuesDelta(names, token1))
+    self.assertFalse(complete)
+    self.assertEqual(3, len(changed))
+
+    # Unknown tokens, or different parameter names, get everything.
+    _, complete, changed, _ = (
+        cpe.X_CATAWAMPUS_ORG_GetParameterValuesDelta(names, 'bogus.1'))
+    self.assertTrue(complete)
+    self.assertEqual(4, len(changed))
+    _, complete, changed, _ = cpe.X_CATAWAMPUS_ORG_GetParameterValuesDelta(
+        ['Test.Thingy.1.'], token3)
+    self.assertTrue(complete)
+    self.assertEqual(2, len(changed))
+    self.assertRaises(api.ParameterNameError,
+                      cpe.X_CATAWAMPUS_ORG_GetParameterValuesDelta,
+                      ['Test.Nonexist.'], token3)
+
+  def testGetParameterValuesDeltaSoapified(self):
+    root = core.Exporter()
+    root.Export(objects=['Test'])
+    root.Test = TestObject()
+    cpe = api.CPE(handle.Handle(root))
+    cpe.AddObject('Test.Thingy.', 0)
+    word = cpe.root.GetExport('Test.Thingy.1')
+    names = ['Test.Thingy.1.word']
+    word._word = 1
+    token, _, _, _ = cpe.X_CATAWAMPUS_ORG_GetParameterValuesDelta(names, '')
+    # 1 == True, but the ACS sees a different type.
+    word._word = True
+    token, _, changed, _ = (
+        cpe.X_CATAWAMPUS_ORG_GetParameterValuesDelta(names, token))
+    self.assertEqual([('Test.Thingy.1.word', True)], changed)
+    # A value changed in place is still noticed.
+    word._word = ['a']
+    token, _, _, _ = cpe.X_CATAWAMPUS_ORG_GetParameterValuesDelta(names, token)
+    word._word.append('b')
+    token, _, changed, _ = (
+        cpe.X_CATAWAMPUS_ORG_GetParameterValuesDelta(names, token))
+    self.assertEqual([('Test.Thingy.1.word', ['a', 'b'])], changed)
+    _, _, changed, _ = (
+        cpe.X_CATAWAMPUS_ORG_GetParameterValuesDelta(names, token))
+    self.assertEqual([], changed)
+
+  def testValueSnapshotsBudget(self):
+    snapshots = api.ValueSnapshots(1000)
+    values = {'Device.Foo': ('xsd:string', 'x' * 100)}
+    tokens = [snapshots.Add(['Device.'], values) for _ in xrange(10)]
+    self.assertEqual(len(set(tokens)), 10)
+    self.assertTrue(snapshots.bytes <= 1000)
+    self.assertEqual(None, snapshots.Get(tokens[0]))
+    self.assertEqual((('Device.',), values), snapshots.Get(tokens[-1]))
+    # Using a snapshot makes it the last to be evicted.
+    kept = [t for t in tokens if snapshots.Get(t)]
+    snapshots.Get(kept[0])
+    snapshots.Add(['Device.'], values)
+    self.assertTrue(snapshots.Get(kept[0]))
+    self.assertEqual(None, snapshots.Get(kept[1]))
+    # Too big to keep at all.
+    token = snapshots.Add(['Device.'], {'Device.Foo': ('xsd:string',
+                                                      'x' * 1000)})
+    self.assertEqual(None, snapshots.Get(token))
+    self.assertTrue(snapshots.Get(kept[0]))
+
 
 class FakeAttrs(dict):
   """Helper class used for testing Attributes."""
@@ -255,6 +527,95 @@ class ParameterAttrsTest(unittest.TestCase):
     self.assertEqual(root.SomeParam, set_notification_arg[0][0][1])
     self.assertEqual(1, new_session_called[0])
 
+  def testPartialPath(self):
+    root = TestObject()
+    cpe = api.CPE(handle.Handle(root))
+    pa = cpe.parameter_attrs
+    pa.set_notification_parameters_cb = SetNotification
+    pa.new_value_change_session_cb = NewSession
+    cpe.AddObject('Thingy.', '1')
+    cpe.AddObject('Thingy.', '1')
+    f = FakeAttrs()
+    f.Name = 'Thingy.'
+    f.Notification = 1
+    f.NotificationChange = 'true'
+    cpe.SetParameterAttributes(f)
+    # The partial path itself, plus word and readonlyword for each Thingy.
+    self.assertEqual(5, len(pa.params))
+    self.assertFalse(pa.params['Thingy.'].inherited)
+    self.assertTrue(pa.params['Thingy.1.word'].inherited)
+    self.assertEqual(1, pa.GetParameterAttribute('Thingy.2.word',
+                                                 'Notification'))
+    self.assertEqual(0, pa.GetParameterAttribute('IndexErrorThingy.1.word',
+                                                 'Notification'))
+
+    # Parameters can still have attributes of their own.
+    f = FakeAttrs()
+    f.Name = 'Thingy.2.word'
+    f.Notification = 0
+    f.NotificationChange = 'true'
+    cpe.SetParameterAttributes(f)
+    self.assertEqual(
+        [('Thingy.1.readonlyword', 1, []), ('Thingy.1.word', 1, []),
+         ('Thingy.2.readonlyword', 1, []), ('Thingy.2.word', 0, [])],
+        sorted(cpe.GetParameterAttributes(['Thingy.'])))
+    self.assertEqual([('Thingy.2.word', 0, [])],
+                     cpe.GetParameterAttributes(['Thingy.2.word']))
+    self.assertRaises(api.ParameterNameError,
+                      cpe.GetParameterAttributes, ['Thingy.3.word'])
+
+    cpe.root.GetExport('Thingy.1').word = 'one'
+    cpe.root.GetExport('Thingy.2').word = 'two'
+    pa.CheckForTriggers()
+    self.assertEqual([('Thingy.1.word', 'one')], set_notification_arg[0])
+
+    # New objects are picked up by the next check.
+    cpe.AddObject('Thingy.', '1')
+    pa.CheckForTriggers()
+    self.assertEqual(7, len(pa.params))
+    self.assertEqual(1, pa.GetParameterAttribute('Thingy.3.word',
+                                                 'Notification'))
+
+    pa.ClearParameterAttributes('Thingy.')
+    self.assertEqual(0, len(pa.params))
+    self.assertEqual(set(), pa.partials)
+    self.assertEqual(0, pa.GetParameterAttribute('Thingy.1.word',
+                                                 'Notification'))
+
+  def testPartialPathEphemeral(self):
+    root = EphemeralRoot()
+    root.hosts['1'] = Word()
+    cpe = api.CPE(handle.Handle(root))
+    pa = cpe.parameter_attrs
+    pa.set_notification_parameters_cb = SetNotification
+    f = FakeAttrs()
+    f.Name = 'Host.'
+    f.Notification = 1
+    f.NotificationChange = 'true'
+    cpe.SetParameterAttributes(f)
+    pa.CheckForTriggers()
+    self.assertTrue('Host.1.word' in pa.params)
+    self.assertEqual([], set_notification_arg[0])
+
+    # Hosts come and go without the tree structure officially changing.
+    generation = core.StructureGeneration()
+    root.hosts['2'] = Word()
+    del root.hosts['1']
+    pa.CheckForTriggers()
+    self.assertEqual(generation, core.StructureGeneration())
+    self.assertFalse('Host.1.word' in pa.params)
+    root.hosts['2'].word = 'two'
+    pa.CheckForTriggers()
+    self.assertEqual([('Host.2.word', 'two')], set_notification_arg[0])
+
+    # The partial path is also re-expanded on its own poll schedule.
+    root.hosts['3'] = Word()
+    pa._SetNextCheck('Host.', pa.params['Host.'], 0)
+    pa._CheckDue()
+    self.assertTrue('Host.3.word' in pa.params)
+    self.assertTrue(pa.params['Host.'].next_check > 0)
+    pa.ClearParameterAttributes('Host.')
+
   def testDeleteParam(self):
     root = TestObject()
     cpe = api.CPE(handle.Handle(root))
@@ -313,6 +674,91 @@ class ParameterAttrsTest(unittest.TestCase):
     cpe.parameter_attrs.CheckForTriggers()
     self.assertEqual(0, len(set_notification_arg[0]))
 
+  def _ObservedAttrs(self, root, loop, notification):
+    pa = api.ParameterAttributes(handle.Handle(root), loop)
+    pa.set_notification_parameters_cb = SetNotification
+    pa.new_value_change_session_cb = NewSession
+    for name in ['Watched', 'ReadOnlyWatched', 'Polled']:
+      f = FakeAttrs()
+      f.Name = name
+      f.Notification = notification
+      f.NotificationChange = 'true'
+      pa.SetParameterAttributes(f)
+    return pa
+
+  def testObservedNotifications(self):
+    root = ObservedRoot()
+    loop = FakeIOLoop()
+    pa = self._ObservedAttrs(root, loop, api.ACTIVE_NOTIFY)
+    self.assertEqual((ObservedRoot, 'Watched'), pa.params['Watched'].observed)
+    self.assertEqual((ObservedRoot, 'ReadOnlyWatched'),
+                     pa.params['ReadOnlyWatched'].observed)
+    self.assertEqual(None, pa.params['Polled'].observed)
+
+    # Setting a value to what it already was costs a check, but doesn't
+    # notify anyone.
+    root.Watched = 'one'
+    self.assertEqual(1, len(loop.callbacks))
+    loop.RunCallbacks()
+    self.assertEqual([], set_notification_arg[0])
+
+    root.Watched = 'two'
+    ObservedRoot.ReadOnlyWatched.Set(root, 2)
+    self.assertEqual(1, len(loop.callbacks))
+    loop.RunCallbacks()
+    self.assertEqual([('ReadOnlyWatched', 2), ('Watched', 'two')],
+                     sorted(set_notification_arg[0]))
+    self.assertEqual(2, new_session_called[0])
+
+    # Other instances of the same class aren't being watched.
+    other = ObservedRoot()
+    other.Watched = 'three'
+    self.assertEqual([], loop.callbacks)
+
+    # Nobody is watching the property, so that has to wait for a poll.
+    root.polled = 'two'
+    self.assertEqual([], loop.callbacks)
+    pa.CheckForTriggers()
+    self.assertEqual(('Polled', 'two'), set_notification_arg[0][-1])
+
+    pa.ClearParameterAttributes('Watched')
+    pa.ClearParameterAttributes('ReadOnlyWatched')
+    self.assertEqual({}, pa.observers)
+    self.assertEqual([], ObservedRoot.Watched.callbacklist)
+    self.assertEqual([], ObservedRoot.ReadOnlyWatched.callbacklist)
+
+  def testPollBackoff(self):
+    root = ObservedRoot()
+    loop = FakeIOLoop()
+    pa = self._ObservedAttrs(root, loop, api.PASSIVE_NOTIFY)
+    attrs = pa.params['Polled']
+    intervals = []
+    for _ in range(4):
+      pa._SetNextCheck('Polled', attrs, 0)
+      pa._CheckDue()
+      intervals.append(attrs.interval)
+    self.assertEqual([120, 240, 240, 240], intervals)
+    self.assertEqual([], set_notification_arg[0])
+    root.polled = 'two'
+    pa._SetNextCheck('Polled', attrs, 0)
+    pa._CheckDue()
+    self.assertEqual(60, attrs.interval)
+    self.assertEqual([('Polled', 'two')], set_notification_arg[0])
+    self.assertEqual(0, new_session_called[0])
+    for name in pa.params.keys():
+      pa.ClearParameterAttributes(name)
+
+    # Active notifications are always polled at the same rate.
+    pa = self._ObservedAttrs(root, loop, api.ACTIVE_NOTIFY)
+    attrs = pa.params['Polled']
+    for _ in range(3):
+      pa._SetNextCheck('Polled', attrs, 0)
+      pa._CheckDue()
+      self.assertEqual(60, attrs.interval)
+    for name in pa.params.keys():
+      pa.ClearParameterAttributes(name)
+    self.assertEqual([], ObservedRoot.Watched.callbacklist)
+
   def testSetAttrErrors(self):
     root = TestSimpleRoot()
     cpe = api.CPE(handle.Handle(root))
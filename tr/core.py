@@ -28,6 +28,7 @@ For navigating the tree, look at handle.Handle().
 
 __author__ = 'apenwarr@google.com (Avery Pennarun)'
 
+import threading
 import weakref
 
 
@@ -70,12 +71,22 @@ class AutoDict(object):
   Use this class by either deriving from it or by just passing your own
   iteritems, getitems, etc to the constructor.  The choice depends on how
   you want to do your namespacing.
+
+  By default, len(), 'in', and keys() are implemented using iteritems or
+  getitem, which construct every value (or at least one) just to throw it
+  away.  If you can answer them more cheaply, pass len, keys, and/or
+  contains functions as well.
   """
 
+  # pylint:disable=redefined-builtin
   def __init__(self, name, iteritems=None,
-               getitem=None, setitem=None, delitem=None):
+               getitem=None, setitem=None, delitem=None,
+               len=None, keys=None, contains=None):
     self.__name = name
     self.__iteritems = _WeakFunc(iteritems or self._Bad('iteritems'))
+    self.__len = _WeakFunc(len) if len else None
+    self.__keys = _WeakFunc(keys) if keys else None
+    self.__contains = _WeakFunc(contains) if contains else None
     if getitem:
       self.__getitem = _WeakFunc(getitem)
     elif iteritems:
@@ -112,6 +123,10 @@ class AutoDict(object):
     return self.__delitem(key)
 
   def __contains__(self, key):
+    if self.__contains:
+      return bool(self.__contains(key))
+    if self.__keys:
+      return key in self.__keys()
     try:
       self[key]
     except KeyError:
@@ -119,6 +134,10 @@ class AutoDict(object):
     return True
 
   def iterkeys(self):
+    if self.__keys:
+      for k in self.__keys():
+        yield k
+      return
     for (k, _) in self.iteritems():
       yield k
 
@@ -130,6 +149,10 @@ class AutoDict(object):
     return self.iterkeys()
 
   def __len__(self):
+    if self.__len:
+      return self.__len()
+    if self.__keys:
+      return len(self.__keys())
     count = 0
     for _ in self:
       count += 1
@@ -145,9 +168,117 @@ class AutoDict(object):
     return list(self.iteritems())
 
 
+class LazyDict(object):
+  """A dict of objects which are only constructed when someone looks at them.
+
+  Ephemeral object lists like Device.Hosts.Host are regenerated from some
+  data source every session, but the ACS often only asks for the
+  NumberOfEntries.  A LazyDict holds a lightweight record (a dict, a tuple,
+  whatever) per key and calls builder(record) to make the real object the
+  first time its value is needed, via [], get(), or iterating over values or
+  items.  len(), 'in', and iterating over keys never build anything.
+
+  Each object is built at most once and then remembered.  Iteration is in
+  the order the records were given.
+  """
+
+  def __init__(self, builder, records=()):
+    """Initialize a LazyDict.
+
+    Args:
+      builder: a function taking a record and returning an object.  Like
+        the functions passed to AutoDict, it is only weakly bound to its
+        instance, if any.
+      records: a dict or iterable of (key, record) pairs.
+    """
+    self._builder = _WeakFunc(builder)
+    self._keys = []
+    self._records = {}
+    self._objects = {}
+    if hasattr(records, 'iteritems'):
+      records = records.iteritems()
+    for key, record in records:
+      if key not in self._records:
+        self._keys.append(key)
+      self._records[key] = record
+
+  def __len__(self):
+    return len(self._records)
+
+  def __contains__(self, key):
+    return key in self._records
+
+  has_key = __contains__
+
+  def __iter__(self):
+    return iter(self._keys)
+
+  iterkeys = __iter__
+
+  def keys(self):
+    return list(self._keys)
+
+  def __getitem__(self, key):
+    try:
+      return self._objects[key]
+    except KeyError:
+      record = self._records[key]
+    obj = self._objects[key] = self._builder(record)
+    return obj
+
+  def get(self, key, default=None):
+    if key not in self._records:
+      return default
+    return self[key]
+
+  def __setitem__(self, key, obj):
+    if key not in self._records:
+      self._keys.append(key)
+    self._records[key] = None
+    self._objects[key] = obj
+
+  def __delitem__(self, key):
+    del self._records[key]
+    self._objects.pop(key, None)
+    self._keys.remove(key)
+
+  def iteritems(self):
+    for key in list(self._keys):
+      yield key, self[key]
+
+  def itervalues(self):
+    for key in list(self._keys):
+      yield self[key]
+
+  def values(self):
+    return list(self.itervalues())
+
+  def items(self):
+    return list(self.iteritems())
+
+
+class _ExporterMeta(type):
+  """Metaclass that tells descriptors their names when a class is created.
+
+  Python 3.6 and later call __set_name__(owner, name) on every descriptor in
+  a newly created class; python 2 doesn't, so we do it here.  cwmptypes.Attr
+  uses this to learn which attribute it lives in, rather than searching the
+  class for itself the first time it is used.
+  """
+
+  def __init__(cls, name, bases, namespace):
+    super(_ExporterMeta, cls).__init__(name, bases, namespace)
+    for key, value in namespace.iteritems():
+      set_name = getattr(type(value), '__set_name__', None)
+      if set_name is not None:
+        set_name(value, cls, key)
+
+
 class AbstractExporter(object):
   """A basic data model.  Most implementations derive from Exporter."""
 
+  __metaclass__ = _ExporterMeta
+
   # No per-instance variables.  Define a subclass if you need some.
   __slots__ = ()
 
@@ -217,11 +348,19 @@ class FastExporter(AbstractExporter):
 
   def Export(self, params=None, objects=None, lists=None):
     """Deprecated.  Use @tr.core.Exports() on the class instead."""
-    Exports(params, objects, lists)(self)
+    _Reshape(self, True, params, objects, lists)
+    if (objects or lists) and _InLiveTree(self):
+      StructureChanged()
+    for child, name in _ExportedChildren(self, objects, lists):
+      IndexParent(child, self, name)
 
   def Unexport(self, params=None, objects=None, lists=None):
     """Deprecated.  Use @tr.core.Unexports() on the class instead."""
-    Unexports(params, objects, lists)(self)
+    _Reshape(self, False, params, objects, lists)
+    if (objects or lists) and _InLiveTree(self):
+      StructureChanged()
+    for child, unused_name in _ExportedChildren(self, objects, lists):
+      UnindexParent(child)
 
 
 class Exporter(FastExporter):
@@ -277,6 +416,8 @@ def Exports(params=None, objects=None, lists=None):
       obj.export_objects = tuple(set(obj.export_objects) | set(objects))
     if lists:
       obj.export_object_lists = tuple(set(obj.export_object_lists) | set(lists))
+    if isinstance(obj, type):
+      _CompileExportInfo(obj)
     return obj
   return Wrapper
 
@@ -314,10 +455,292 @@ def Unexports(params=None, objects=None, lists=None):
     if lists:
       assert not isinstance(lists, basestring)
       obj.export_object_lists = tuple(set(obj.export_object_lists) - set(lists))
+    if isinstance(obj, type):
+      _CompileExportInfo(obj)
     return obj
   return Wrapper
 
 
+# Export tuples set by runtime Export()/Unexport(), interned so that all
+# instances with the same shape share one tuple (and one ExportInfo) rather
+# than each building its own sets and tuples.  The tuples are never modified
+# in place; reshaping an object just points it at a different tuple.
+#
+# _reshaped maps (id(old), add, names) -> (old, new).  Keeping a reference
+# to old means its id can't be reused by some other tuple.
+_reshaped = {}
+_shapes = {}  # frozenset -> the one tuple with those contents
+_MAX_SHAPES = 10000
+
+
+def _ReshapedTuple(old, add, names):
+  """Return the interned tuple containing old plus (or minus) names."""
+  names = tuple(names)
+  key = (id(old), add, names)
+  entry = _reshaped.get(key)
+  if entry is not None:
+    return entry[1]
+  if add:
+    newset = frozenset(old) | frozenset(names)
+  else:
+    newset = frozenset(old) - frozenset(names)
+  if len(_shapes) >= _MAX_SHAPES:
+    _shapes.clear()
+  new = _shapes.setdefault(newset, tuple(newset))
+  if type(old) is tuple:
+    if len(_reshaped) >= _MAX_SHAPES:
+      _reshaped.clear()
+    _reshaped[key] = (old, new)
+  return new
+
+
+def _Reshape(obj, add, params, objects, lists):
+  """Implementation of Exporter.Export() and Exporter.Unexport()."""
+  assert not isinstance(params, basestring)
+  assert not isinstance(objects, basestring)
+  assert not isinstance(lists, basestring)
+  if params:
+    obj.export_params = _ReshapedTuple(obj.export_params, add, params)
+  if objects:
+    obj.export_objects = _ReshapedTuple(obj.export_objects, add, objects)
+  if lists:
+    obj.export_object_lists = _ReshapedTuple(obj.export_object_lists,
+                                             add, lists)
+
+
+# Bits in ExportInfo.kinds.  A name can (rarely) be more than one kind.
+EXPORT_PARAM = 1
+EXPORT_OBJECT = 2
+EXPORT_LIST = 4
+
+
+class ExportInfo(object):
+  """Precomputed facts about an object's exports, for handle.Handle.
+
+  Compiled once per class by @Exports/@Unexports (or on first use, for
+  classes like the auto-generated ones that just declare export_* tuples)
+  and never modified afterwards.
+
+  Attributes:
+    params, objects, lists: the export_* tuples this was compiled from.
+    names: a sorted tuple of all the exported names.
+    kinds: a dict of name -> EXPORT_* bits.
+    attrs: a dict of name -> the python attribute holding that export,
+      eg. 'X_CATAWAMPUS-ORG_Foo' -> 'X_CATAWAMPUS_ORG_Foo', 'Bar' -> 'BarList'.
+  """
+  __slots__ = ('params', 'objects', 'lists', 'names', 'kinds', 'attrs')
+
+  def __init__(self, params, objects, lists):
+    self.params = params
+    self.objects = objects
+    self.lists = lists
+    kinds = {}
+    for names, kind in ((params, EXPORT_PARAM),
+                        (objects, EXPORT_OBJECT),
+                        (lists, EXPORT_LIST)):
+      for name in names:
+        kinds[name] = kinds.get(name, 0) | kind
+    self.names = tuple(sorted(kinds))
+    self.kinds = kinds
+    self.attrs = {}
+    for name, kind in kinds.iteritems():
+      attr = name.replace('-', '_')
+      if kind & EXPORT_LIST:
+        attr += 'List'
+      self.attrs[name] = attr
+
+
+def _CompileExportInfo(cls):
+  """Store an ExportInfo for cls in cls._export_info, or False if we can't."""
+  params = cls.export_params
+  objects = cls.export_objects
+  lists = cls.export_object_lists
+  if (type(params) is tuple and type(objects) is tuple and
+      type(lists) is tuple):
+    info = ExportInfo(params, objects, lists)
+  else:
+    # eg. export_* are properties that compute the answer on the fly
+    info = None
+  cls._export_info = info or False
+  return info
+
+
+# ExportInfo for instances reshaped by runtime Export()/Unexport(), keyed
+# by (id(params), id(objects), id(lists)).  Thanks to _shapes, there is
+# usually one entry per distinct shape, not one per instance.
+_shape_infos = {}
+
+
+def _ShapeExportInfo(params, objects, lists):
+  """Return a shared ExportInfo for an instance with these export_* tuples."""
+  key = (id(params), id(objects), id(lists))
+  info = _shape_infos.get(key)
+  if (info is not None and info.params is params and
+      info.objects is objects and info.lists is lists):
+    return info
+  if (type(params) is not tuple or type(objects) is not tuple or
+      type(lists) is not tuple):
+    return None
+  if len(_shape_infos) >= _MAX_SHAPES:
+    _shape_infos.clear()
+  info = _shape_infos[key] = ExportInfo(params, objects, lists)
+  return info
+
+
+def GetExportInfo(obj):
+  """Return the ExportInfo for obj, or None if there isn't a trustworthy one.
+
+  Instances that called self.Export() or self.Unexport() at runtime share
+  an ExportInfo with other instances of the same shape.  There isn't one
+  when the class computes export_* dynamically, or an instance assigns
+  something other than tuples to them; callers have to look at obj.export_*
+  directly in that case.
+
+  Args:
+    obj: an Exporter.
+  Returns:
+    an ExportInfo or None.
+  """
+  info = getattr(type(obj), '_export_info', None)
+  if (info and info.params is obj.export_params and
+      info.objects is obj.export_objects and
+      info.lists is obj.export_object_lists):
+    return info
+  d = getattr(obj, '__dict__', None)
+  if d and ('export_params' in d or 'export_objects' in d or
+            'export_object_lists' in d):
+    return _ShapeExportInfo(obj.export_params, obj.export_objects,
+                            obj.export_object_lists)
+  cls = type(obj)
+  if cls.__dict__.get('_export_info') is False:
+    return None
+  return _CompileExportInfo(cls)
+
+
+# Reverse index from an exported object to its place in the tree, so that
+# handle.Handle.GetCanonicalName() can walk upwards in O(depth) instead of
+# searching the whole tree.  Maps obj -> (weakref to parent, name), where
+# name is relative to parent: 'Foo' for a sub-object, or 'Foo.5' for entry 5
+# of parent.FooList.  Entries vanish when obj is garbage collected.
+# GetParameterValues can walk the tree from several threads (see
+# api.CPE.gpv_threads), so all access goes through _parent_index_lock.
+_parent_index = weakref.WeakKeyDictionary()
+_parent_index_lock = threading.Lock()
+
+
+def IndexParent(child, parent, name):
+  """Remember that child is exported as 'name' directly underneath parent.
+
+  Objects which can't be weakly referenced (eg. ones with __slots__, or
+  plain parameter values) are silently skipped; anyone looking for them
+  will have to search the tree instead.
+
+  Args:
+    child: the exported object.
+    parent: the Exporter that exports child.
+    name: the name of child relative to parent, eg. 'Foo' or 'Foo.5'.
+  """
+  try:
+    with _parent_index_lock:
+      _parent_index[child] = (weakref.ref(parent), name)
+  except TypeError:
+    pass
+
+
+def UnindexParent(child):
+  """Forget anything IndexParent() remembered about child."""
+  try:
+    with _parent_index_lock:
+      del _parent_index[child]
+  except (KeyError, TypeError):
+    pass
+
+
+def IndexedParent(child):
+  """Return (parent, name) as recorded by IndexParent, or (None, None).
+
+  The answer might be stale if the tree was modified without going through
+  Handle or Export/Unexport, so callers should check that parent still
+  exports child as name.
+
+  Args:
+    child: the exported object to look up.
+  Returns:
+    (parent, name) if child was indexed and its parent still exists.
+  """
+  try:
+    with _parent_index_lock:
+      parentref, name = _parent_index[child]
+  except (KeyError, TypeError):
+    return None, None
+  parent = parentref()
+  if parent is None:
+    return None, None
+  return parent, name
+
+
+# Bumped whenever the shape of the live tree changes: objects added to or
+# removed from an object list via Handle, or Export/Unexport of objects or
+# lists on an object that is already in the tree (ie. indexed above).  Newly
+# constructed objects Unexport things in __init__ all the time, and that
+# doesn't count.  handle.Handle uses this to invalidate its path cache.
+_structure_generation = [0]
+
+
+def StructureChanged():
+  """Note that objects were added to, or removed from, the live tree."""
+  _structure_generation[0] += 1
+
+
+def StructureGeneration():
+  """Return a number that changes every time StructureChanged() is called."""
+  return _structure_generation[0]
+
+
+# Tree roots aren't in _parent_index (they have no parent), but changing
+# their exports still changes the tree.  See WatchRoot().
+_roots = weakref.WeakKeyDictionary()
+
+
+def WatchRoot(root):
+  """Count Export/Unexport of objects or lists on root as structure changes."""
+  try:
+    _roots[root] = True
+  except TypeError:
+    pass
+
+
+def _InLiveTree(obj):
+  with _parent_index_lock:
+    if obj in _parent_index:
+      return True
+  return obj in _roots
+
+
+def _ExportedChildren(obj, objects, lists):
+  """Yield (child, name) for stable children among the given export names.
+
+  Only children stored directly in the instance dict count; a @property or
+  AutoDict could hand out a new object on every access, so there's no point
+  in remembering where the current one lives.
+
+  Args:
+    obj: the parent Exporter.
+    objects: a list of sub-object names, or None.
+    lists: a list of object-list names, or None.
+  """
+  d = getattr(obj, '__dict__', {})
+  for name in objects or ():
+    child = d.get(name.replace('-', '_'))
+    if child is not None:
+      yield child, name
+  for name in lists or ():
+    objlist = d.get(name.replace('-', '_') + 'List')
+    if isinstance(objlist, dict):
+      for idx, child in objlist.iteritems():
+        yield child, '%s.%s' % (name, idx)
+
+
 def Extensible(cls):
   """Returns a subclass of cls that has no __slots__ member.
 
@@ -16,6 +16,7 @@
 # TR-069 has mandatory attribute names that don't comply with policy
 # pylint:disable=invalid-name
 # pylint:disable=unused-argument
+# pylint:disable=protected-access
 #
 """Tests for core.py."""
 
@@ -55,6 +56,16 @@ class TestObject(core.Exporter):
       self.Count = self.gcount[0]
 
 
+class NestedObject(core.Exporter):
+
+  def __init__(self):
+    core.Exporter.__init__(self)
+    self.Export(objects=['Inner'], lists=['Outer'])
+    self.Inner = TestObject()
+    self.OuterList = {}
+    self.Outer = TestObject
+
+
 class AutoObject(core.Exporter):
 
   def __init__(self):
@@ -81,6 +92,32 @@ class AutoObject(core.Exporter):
       self.Count = self.gcount[0]
 
 
+class CountedAutoObject(AutoObject):
+
+  def __init__(self):
+    AutoObject.__init__(self)
+    self.SubList = core.AutoDict('SubList',
+                                 iteritems=self._itersubs,
+                                 getitem=self._getsub,
+                                 len=lambda: 3,
+                                 keys=lambda: [0, 1, 2],
+                                 contains=lambda key: key in (0, 1, 2))
+
+
+class LazyObject(core.Exporter):
+
+  def __init__(self):
+    core.Exporter.__init__(self)
+    self.built = []
+    self.SubList = core.LazyDict(self._BuildSub,
+                                 [('1', 10), ('2', 20), ('3', 30)])
+    self.Export(lists=['Sub'])
+
+  def _BuildSub(self, record):
+    self.built.append(record)
+    return TestObject.SubObj()
+
+
 class IndexErrorAutoObject(core.Exporter):
 
   def __init__(self):
@@ -101,12 +138,31 @@ class IndexErrorAutoObject(core.Exporter):
       return int(key)
 
 
+@core.Exports(params=['X_Y-Z_Param'], lists=['Thing'])
+class Decorated(core.Exporter):
+  X_Y_Z_Param = 1
+  ThingList = {}
+
+
+@core.Unexports(params=['X_Y-Z_Param'])
+class Undecorated(Decorated):
+  pass
+
+
+class Declared(core.FastExporter):
+  __slots__ = ()
+  export_params = ('A',)
+  export_objects = ('B',)
+  export_object_lists = ('B',)
+
+
 class CoreTest(unittest.TestCase):
 
   def setUp(self):
     self.gccheck = garbage.GcChecker()
     # Reset the global gcount
     TestObject.SubObj.gcount = [0]
+    AutoObject.Sub.gcount = [0]
 
   def tearDown(self):
     self.gccheck.Done()
@@ -180,6 +236,223 @@ class CoreTest(unittest.TestCase):
     name = handle.Handle.GetCanonicalName(o, obj3)
     self.assertEqual('Counter.3', name)
 
+  def testCanonicalNameIndex(self):
+    o = TestObject()
+    h = handle.Handle(o)
+    (unused_idx, obj1) = h.AddExportObject('Counter')
+    (unused_idx, obj2) = h.AddExportObject('Counter')
+    searches = []
+    old_search = handle.Handle._SearchCanonicalName
+
+    def CountingSearch(root, obj_to_find, budget):
+      searches.append(obj_to_find)
+      return old_search(root, obj_to_find, budget)
+
+    handle.Handle._SearchCanonicalName = staticmethod(CountingSearch)
+    try:
+      # AddExportObject indexes new objects, so no search is needed.
+      self.assertEqual('Counter.1', handle.Handle.GetCanonicalName(o, obj1))
+      self.assertEqual('Counter.2', handle.Handle.GetCanonicalName(o, obj2))
+      self.assertEqual([], searches)
+
+      # SubObj was assigned after Export(), so the first lookup has to
+      # search, but that fills in the index for next time.
+      self.assertEqual('SubObj', handle.Handle.GetCanonicalName(o, o.SubObj))
+      self.assertEqual(1, len(searches))
+      self.assertEqual('SubObj', handle.Handle.GetCanonicalName(o, o.SubObj))
+      self.assertEqual(1, len(searches))
+
+      # Deleted objects must not be found through a stale index entry.
+      h.DeleteExportObject('Counter', 1)
+      self.assertEqual(None, handle.Handle.GetCanonicalName(o, obj1))
+      self.assertEqual('Counter.2', handle.Handle.GetCanonicalName(o, obj2))
+
+      # Neither must objects moved around behind the index's back.
+      o.CounterList[7] = o.CounterList.pop(2)
+      self.assertEqual('Counter.7', handle.Handle.GetCanonicalName(o, obj2))
+
+      # Unexport forgets sub-objects.
+      o.Unexport(objects=['SubObj'])
+      self.assertEqual(None, handle.Handle.GetCanonicalName(o, o.SubObj))
+    finally:
+      handle.Handle._SearchCanonicalName = staticmethod(old_search)
+
+  def testCanonicalNameNested(self):
+    o = NestedObject()
+    h = handle.Handle(o)
+    (unused_idx, outer) = h.AddExportObject('Outer')
+    for name, parent in [('Inner.Counter', o.Inner),
+                         ('Outer.1.Counter', outer)]:
+      (idx, obj) = h.AddExportObject(name)
+      self.assertEqual((parent, 'Counter.' + idx), core.IndexedParent(obj))
+      self.assertEqual('%s.%s' % (name, idx),
+                       handle.Handle.GetCanonicalName(o, obj))
+    self.assertEqual((o, 'Outer.1'), core.IndexedParent(outer))
+
+  def testCanonicalNameEphemeral(self):
+    root = AutoObject()
+    # AutoObject makes new children on every access, so there is no way
+    # to find an old one.
+    s0 = root.SubList[0]
+    self.assertEqual(None, handle.Handle.GetCanonicalName(root, s0))
+    del s0
+    self.gccheck.Check()
+
+  def testPathCache(self):
+    o = TestObject()
+    h = handle.Handle(o)
+    h.AddExportObject('Counter')
+    h.AddExportObject('Counter')
+    handle.session_path_cache.Reset()
+    self.assertEqual(2, h.GetExport('Counter.1.Count'))
+    self.assertEqual(2, h.GetExport('Counter.1.Count'))
+    self.assertEqual(1, h.GetExport('SubObj.Count'))
+    self.assertEqual(1, h.GetExport('SubObj.Count'))
+    self.assertEqual(2, h.path_cache_counters.hits)
+    self.assertEqual(2, h.path_cache_counters.misses)
+    self.assertEqual(2, handle.session_path_cache.hits)
+    self.assertEqual(2, handle.session_path_cache.misses)
+    self.assertEqual(None, h.Sub('SubObj').path_cache)
+
+    # Deleting an object flushes the cache.
+    h.DeleteExportObject('Counter', 1)
+    self.assertRaises(KeyError, h.GetExport, 'Counter.1.Count')
+    self.assertEqual(3, h.GetExport('Counter.2.Count'))
+
+    # Replacing an object behind the Handle's back is noticed too.
+    o.SubObj = TestObject.SubObj()
+    self.assertEqual(4, h.GetExport('SubObj.Count'))
+    o.CounterList[2] = TestObject.SubObj()
+    self.assertEqual(5, h.GetExport('Counter.2.Count'))
+
+    # So is unexporting something from the root object.
+    self.assertEqual(4, h.GetExport('SubObj.Count'))
+    o.Unexport(objects=['SubObj'])
+    self.assertRaises(KeyError, h.GetExport, 'SubObj.Count')
+
+    # AutoDict entries are new objects on every access; never cache them.
+    a = AutoObject()
+    ah = handle.Handle(a)
+    self.assertEqual(1, ah.GetExport('Sub.1.Count'))
+    self.assertEqual(2, ah.GetExport('Sub.1.Count'))
+    self.assertEqual(0, ah.path_cache_counters.hits)
+
+  def testPathCacheSize(self):
+    old_max = handle.MAX_PATH_CACHE
+    handle.MAX_PATH_CACHE = 4
+    try:
+      o = TestObject()
+      h = handle.Handle(o)
+      for unused_i in range(10):
+        h.AddExportObject('Counter')
+      for i in range(1, 11):
+        self.assertEqual(i + 1, h.GetExport('Counter.%d.Count' % i))
+      self.assertTrue(len(h.path_cache[0]) + len(h.path_cache[1]) <= 4)
+      self.assertEqual(11, h.GetExport('Counter.10.Count'))
+      self.assertEqual(1, h.path_cache_counters.hits)
+    finally:
+      handle.MAX_PATH_CACHE = old_max
+
+  def testPathCacheStaleOlder(self):
+    old_max = handle.MAX_PATH_CACHE
+    handle.MAX_PATH_CACHE = 4
+    try:
+      o = NestedObject()
+      h = handle.Handle(o)
+      for unused_i in range(2):
+        h.AddExportObject('Outer')
+      for i in range(1, 3):
+        self.assertEqual(5, h.GetExport('Outer.%d.TestParam' % i))
+      self.assertEqual(5, h.GetExport('Inner.TestParam'))
+      # Outer.1 has been rotated into the older generation, and recent is
+      # full, so promoting it would rotate again.
+      self.assertTrue('Outer.1' in h.path_cache[1])
+      self.assertEqual(2, len(h.path_cache[0]))
+      o.OuterList[1] = TestObject()
+      o.OuterList[1].TestParam = 6
+      self.assertEqual(6, h.GetExport('Outer.1.TestParam'))
+    finally:
+      handle.MAX_PATH_CACHE = old_max
+
+  def testExportInfo(self):
+    info = core.GetExportInfo(Decorated())
+    self.assertTrue(info is Decorated.__dict__['_export_info'])
+    self.assertEqual(('Thing', 'X_Y-Z_Param'), info.names)
+    self.assertEqual(core.EXPORT_LIST, info.kinds['Thing'])
+    self.assertEqual('ThingList', info.attrs['Thing'])
+    self.assertEqual('X_Y_Z_Param', info.attrs['X_Y-Z_Param'])
+    self.assertEqual(('Thing',), core.GetExportInfo(Undecorated()).names)
+
+    # Plain export_* tuples are compiled on first use.
+    info = core.GetExportInfo(Declared())
+    self.assertEqual(('A', 'B'), info.names)
+    self.assertEqual(core.EXPORT_OBJECT | core.EXPORT_LIST, info.kinds['B'])
+    self.assertEqual('BList', info.attrs['B'])
+    self.assertTrue(info is core.GetExportInfo(Declared()))
+
+    # Instances reshaped at runtime share their tuples and ExportInfo.
+    o = Decorated()
+    o.Unexport(lists=['Thing'])
+    o2 = Decorated()
+    o2.Unexport(lists=['Thing'])
+    self.assertTrue(o.export_object_lists is o2.export_object_lists)
+    self.assertTrue(core.GetExportInfo(o) is core.GetExportInfo(o2))
+    self.assertEqual(('X_Y-Z_Param',), core.GetExportInfo(o).names)
+    self.assertFalse(handle.Handle.IsValidExport(o, 'Thing'))
+    self.assertTrue(handle.Handle.IsValidExport(o, 'X_Y-Z_Param'))
+    self.assertTrue(handle.Handle.IsValidExport(Decorated(), 'Thing'))
+    o2.Export(lists=['Thing'])
+    self.assertEqual(sorted(Decorated.export_object_lists),
+                     sorted(o2.export_object_lists))
+    self.assertTrue(handle.Handle.IsValidExport(o2, 'Thing'))
+
+    # Anything other than tuples has to be inspected directly.
+    o.export_params = ['Foo']
+    self.assertEqual(None, core.GetExportInfo(o))
+    self.assertTrue(handle.Handle.IsValidExport(o, 'Foo'))
+
+  def testAutoDictHooks(self):
+    a = AutoObject()
+    self.assertEqual(3, len(a.SubList))
+    self.assertTrue(1 in a.SubList)
+    self.assertEqual(4, AutoObject.Sub.gcount[0])
+
+    c = CountedAutoObject()
+    self.assertEqual(3, len(c.SubList))
+    self.assertEqual([0, 1, 2], c.SubList.keys())
+    self.assertTrue(1 in c.SubList)
+    self.assertFalse(3 in c.SubList)
+    self.assertEqual(4, AutoObject.Sub.gcount[0])
+    self.assertEqual(5, c.SubList[2].Count)
+
+  def testLazyDict(self):
+    o = LazyObject()
+    l = o.SubList
+    self.assertEqual(3, len(l))
+    self.assertEqual(['1', '2', '3'], l.keys())
+    self.assertTrue('2' in l)
+    self.assertFalse('4' in l)
+    self.assertEqual(None, l.get('4'))
+    self.assertEqual([], o.built)
+
+    h = handle.Handle(o)
+    self.assertEqual(1, h.GetExport('Sub.2.Count'))
+    self.assertEqual(1, h.GetExport('Sub.2.Count'))
+    self.assertEqual([20], o.built)
+    self.assertRaises(KeyError, h.GetExport, 'Sub.4.Count')
+
+    h.ValidateExports()
+    self.assertEqual(['Sub.', 'Sub.1.', 'Sub.1.Count', 'Sub.2.',
+                      'Sub.2.Count', 'Sub.3.', 'Sub.3.Count'],
+                     list(h.ListExports(recursive=True)))
+    self.assertEqual([20, 10, 30], o.built)
+
+    del l['1']
+    l['7'] = TestObject.SubObj()
+    self.assertEqual(['2', '3', '7'], l.keys())
+    self.assertEqual([1, 3, 4], [v.Count for v in l.values()])
+    self.assertEqual([20, 10, 30], o.built)
+
   def testLifecycle0(self):
     core.AutoDict('whatever')
 
@@ -60,6 +60,8 @@ class CpeManagementServer(object):
   STUNEnable = cwmptypes.ReadOnlyBool(False)
   UpgradesManaged = cwmptypes.ReadOnlyBool(True)
   Username = cwmptypes.TriggerString('')
+  X_CATAWAMPUS_ORG_CompressRequests = cwmptypes.Bool(False)
+  X_CATAWAMPUS_ORG_CompressRequestsMinSize = cwmptypes.Unsigned(4096)
 
   def __init__(self, acs_config, port, ping_path,
                acs_url=None, get_parameter_key=None,
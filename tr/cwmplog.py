@@ -33,7 +33,9 @@ PRUNELIST = frozenset(['MaxEnvelopes', 'ParameterKey', 'CommandKey',
 TRUNCATELIST = frozenset(['GetParameterValues', 'GetParameterValuesResponse',
                           'GetParameterNamesResponse', 'SetParameterAttributes',
                           'X_CATAWAMPUS_ORG_AddObjects',
-                          'X_CATAWAMPUS_ORG_AddObjectsResponse'])
+                          'X_CATAWAMPUS_ORG_AddObjectsResponse',
+                          'X_CATAWAMPUS_ORG_GetParameterValuesDelta',
+                          'X_CATAWAMPUS_ORG_GetParameterValuesDeltaResponse'])
 
 
 def _Shorten(s, prefixofs, suffixofs, maxlen):
@@ -67,6 +69,7 @@ def _StripNamespace(tag):
 
   ElementTree retains namespaces in the tag, like:
   {urn:dslforum-org:cwmp-1-2}GetParameterNames
+  and when we're encoding, it looks like cwmp:GetParameterNames.
   The namespace is not useful; suppress it.
 
   Args:
@@ -78,7 +81,7 @@ def _StripNamespace(tag):
     e = tag.find('}')
     return tag[e + 1:]
   else:
-    return tag
+    return tag[tag.find(':') + 1:]
 
 
 def _SuppressSensitiveParams(name, value):
@@ -143,6 +146,141 @@ def _LogSoapETree(et, prefix=''):
   return out
 
 
+class _TerseElement(object):
+  """What TerseLog needs to remember about an element it is inside of."""
+
+  __slots__ = ('prefix', 'count', 'first', 'out', 'skip')
+
+  def __init__(self, prefix):
+    self.prefix = prefix
+    self.count = 0  # number of children so far
+    self.first = []  # (tag, text) of the first two children
+    self.out = []
+    self.skip = False
+
+
+class TerseLog(object):
+  """Builds the same log as _LogSoapETree, an element at a time.
+
+  Call Start(tag) and End(tag, text) for each element, in document order,
+  as a parser (see ParseEvent) or encoder comes across them.  Only strings
+  are kept, so elements can be thrown away once they have been seen.  Once
+  the whole message has been seen, Summary() is what Logger.LogTerse would
+  have returned for it; pass it to Logger.LogSoapXML.
+  """
+
+  def __init__(self):
+    self.stack = []
+    self.result = None
+    self.valid = True
+
+  def Invalidate(self):
+    """Give up; the message will get parsed for logging after all."""
+    self.valid = False
+    self.stack = []
+
+  def Mark(self):
+    """Returns a token for Rewind() to get back to the current position."""
+    if not self.stack:
+      return None
+    top = self.stack[-1]
+    return (len(self.stack), top.count, len(top.first), len(top.out), top.skip)
+
+  def Rewind(self, mark):
+    """Forget any elements started since Mark() returned mark."""
+    if mark is None:
+      self.Invalidate()
+      return
+    depth, count, nfirst, nout, skip = mark
+    if len(self.stack) < depth:
+      self.Invalidate()
+      return
+    del self.stack[depth:]
+    top = self.stack[-1]
+    top.count = count
+    del top.first[nfirst:]
+    del top.out[nout:]
+    top.skip = skip
+
+  def ParseEvent(self, event, elem):
+    """Handle an ('start' or 'end', element) event from ET.iterparse."""
+    if event == 'start':
+      self.Start(elem.tag)
+    else:
+      self.End(elem.tag, elem.text)
+
+  def Start(self, tag):
+    if not self.valid:
+      return
+    if not self.stack:
+      prefix = ''
+    elif _StripNamespace(tag) in SUPPRESSLIST:
+      prefix = self.stack[-1].prefix
+    else:
+      prefix = self.stack[-1].prefix + '  '
+    self.stack.append(_TerseElement(prefix))
+
+  def End(self, tag, text):
+    if not self.valid:
+      return
+    try:
+      self._End(tag, text)
+    except:  # Never, ever kill catawampus for this. pylint:disable=bare-except
+      self.Invalidate()
+
+  def _Log(self, node, text):
+    """The equivalent of _LogSoapETree(elem, node.prefix)."""
+    if (node.count == 2 and node.first[0][0] == 'Name' and
+        node.first[1][0] == 'Value'):
+      text0 = node.first[0][1] and node.first[0][1].strip()
+      name = _Shorten(text0, 8, 32, 64)
+      text1 = node.first[1][1] and node.first[1][1].strip()
+      value = _Shorten(text1, 16, 64, 192)
+      (name, value) = _SuppressSensitiveParams(name, value)
+      return '%s%s = %s\n' % (node.prefix, name, value)
+    if text and text.strip():
+      return '%s%s\n' % (node.prefix, text.strip())
+    return ''.join(node.out)
+
+  def _End(self, tag, text):
+    node = self.stack.pop()
+    if not self.stack:
+      self.result = self._Log(node, text)
+      return
+    parent = self.stack[-1]
+    parent.count += 1
+    if parent.count <= 2:
+      parent.first.append((tag, text))
+    if parent.skip:
+      # _LogSoapETree removes pruned elements from the list it is iterating
+      # over, which skips the element right after them.  The logs have
+      # always looked like that, so keep doing it.
+      parent.skip = False
+      return
+    tag = _StripNamespace(tag)
+    prefix = parent.prefix
+    if tag in PRUNELIST:
+      parent.skip = True
+    elif tag in SUPPRESSLIST:
+      parent.out.append(self._Log(node, text))
+    elif text and text.strip():
+      parent.out.append('%s%s: %s\n' % (prefix, tag, text.strip()))
+    else:
+      body = self._Log(node, text)
+      if tag in TRUNCATELIST:
+        lines = body.splitlines()
+        numlines = len(lines)
+        if numlines > 8:
+          lines = lines[0:3]
+          lines.append('%s...%d more lines...' % (prefix + '  ', numlines - 3))
+          body = '\n'.join(lines)
+      parent.out.append('%s%s:\n%s' % (prefix, tag, body))
+
+  def Summary(self):
+    """Returns the log, or None if we didn't see all of the message."""
+    return self.result if self.valid else None
+
+
 class Logger(object):
   """CWMP-specific logging support.
 
@@ -155,20 +293,49 @@ class Logger(object):
   def __init__(self, full_logs=10):
     self.num_full_logs = full_logs
 
-  def LogSoapXML(self, xml):
+  def LogSoapXML(self, xml, terse=None):
+    """Returns the log for xml.
+
+    Args:
+      xml: the message.
+      terse: if not None, the terse log of xml (see TerseLog.Summary), so
+        it doesn't have to be parsed to make one.
+    Returns:
+      the log, as a string.
+    """
+    return self._Log(xml, terse)[0]
+
+  def LogRequest(self, xml):
+    """Like LogSoapXML, for a message that is about to be parsed anyway.
+
+    Args:
+      xml: the message.
+    Returns:
+      (log, root): the log, and the ElementTree root of xml if it had to be
+      parsed to make the log (else None), so it doesn't get parsed again.
+    """
+    return self._Log(xml, None)
+
+  def _Log(self, xml, terse):
     if not xml or not xml.strip():
       # An empty message is valid, means connection is closing.
-      return ''
+      return '', None
 
     # Developers can ask for full XML logs.
     if os.environ.get('DONT_SHORTEN'):
-      return str(xml)
+      return str(xml), None
 
     if self.num_full_logs > 0:
       self.num_full_logs -= 1
-      return self.LogXML(xml)
-    else:
-      return self.LogTerse(xml)
+      return self.LogXML(xml), None
+    elif terse is not None:
+      return terse, None
+    try:
+      root = ET.fromstring(xml)
+    except:  # Never, ever kill catawampus for this. pylint:disable=bare-except
+      print 'Unable to parse XML for logging.'
+      return str(xml), None
+    return _LogSoapETree(root), root
 
   def LogXML(self, xml):
     return _Shorten(str(xml), 1024, 512, 3072)
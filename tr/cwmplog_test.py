@@ -20,6 +20,7 @@
 
 __author__ = 'dgentry@google.com (Denton Gentry)'
 
+import io
 import os
 import xml.etree.cElementTree as ET
 import google3
@@ -134,6 +135,44 @@ class CwmpLogTest(unittest.TestCase):
     log = logger.LogSoapXML(GPVResponseManyLinesXML)
     self.assertLessThan(len(log.splitlines()), 10)
 
+  def testTerseLog(self):
+    for xml in (InformXML, InformResponseXML, SetParameterValuesXML,
+                SetParameterValuesResponseSuccessXML, GetParameterNamesXML,
+                AddObjectXML, AddObjectResponseXML, CwmpFaultXML,
+                GetParameterValuesXML, GetParameterValuesResponseXML,
+                GetParameterValuesResponseLongXML, KeyPassphraseXML,
+                GPVResponseManyLinesXML):
+      tl = cwmplog.TerseLog()
+      for event, elem in ET.iterparse(io.BytesIO(xml),
+                                      events=('start', 'end')):
+        tl.ParseEvent(event, elem)
+      logger = cwmplog.Logger(full_logs=0)
+      self.assertEqual(logger.LogTerse(xml), tl.result)
+
+  def testLogRequest(self):
+    logger = cwmplog.Logger(full_logs=1)
+    log, root = logger.LogRequest(InformXML)
+    self.assertEqual(InformXML, log)
+    self.assertEqual(None, root)
+    log, root = logger.LogRequest(InformXML)
+    self.assertEqual(InformLog, log)
+    self.assertTrue(root.tag.endswith('Envelope'))
+    self.assertEqual(('', None), logger.LogRequest(''))
+    self.assertEqual(('this is <not> XML', None),
+                     logger.LogRequest('this is <not> XML'))
+
+  def testTerse(self):
+    logger = cwmplog.Logger(full_logs=1)
+    tl = cwmplog.TerseLog()
+    tl.Start('Envelope')
+    tl.End('Envelope', 'terse')
+    self.assertEqual(logger.LogSoapXML(InformXML, tl.Summary()), InformXML)
+    self.assertEqual(logger.LogSoapXML(InformXML, tl.Summary()), 'terse\n')
+    self.assertEqual(logger.LogSoapXML(InformXML), InformLog)
+    tl.Invalidate()
+    self.assertEqual(None, tl.Summary())
+    self.assertEqual(logger.LogSoapXML(InformXML, tl.Summary()), InformLog)
+
 
 InformXML = """<?xml version="1.0" encoding="utf-8"?>
 <soap:Envelope xmlns:cwmp="urn:dslforum-org:cwmp-1-2" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/" xmlns:soap-enc="http://schemas.xmlsoap.org/soap/encoding/" xmlns:xsd="http://www.w3.org/2001/XMLSchema">
@@ -25,6 +25,7 @@ import errno
 import os
 import re
 import socket
+import threading
 import weakref
 import cwmpdate
 import helpers
@@ -76,8 +77,9 @@ class Attr(object):
   the class *containing* the Attr is expensive.)
 
   So instead, we now have to do an extra layer of magic:
-   - discover the name of this Attr by looking at the class it's declared
-     in (see _MyAttrName)
+   - discover the name of this Attr, either when the class it's declared in
+     is created (see __set_name__) or, failing that, by looking at the class
+     the first time it's used (see _MyAttrName)
    - store the value itself in a second property named _Name, where Name
      is the name discovered above.  (There's no need to ever access _Name
      directly; access it through the Attr instead.)
@@ -107,6 +109,28 @@ class Attr(object):
     """Tell this Attr that another is wrapping it, eg. Trigger or ReadOnly."""
     self._outermost = wrapattr
 
+  def __set_name__(self, owner, name):
+    """Called with our name when the class containing us is created.
+
+    Python 2 doesn't do this by itself, but tr.core.Exporter's metaclass
+    does, so Attrs in Exporters never need to search for their name.  Other
+    classes fall back to _MyAttrName's search.
+
+    If this Attr is also in the class under a name of its own, as in
+      f = FileBacked(...)
+      Exported = ReadOnly(f)
+    then that is only an alias: our value belongs under the name of the
+    member that wraps us, which tells us its name itself.
+
+    Args:
+      owner: the class being created.
+      name: the name of the class member that is (or wraps) this Attr.
+    """
+    if owner.__dict__.get(name) is self and self._outermost is not self:
+      return
+    if not self._attrname:
+      self._attrname = '_' + name
+
   def _MyAttrName(self, obj):
     """Return the attr name we'll store this property's value in.
 
@@ -244,6 +268,10 @@ class Attr(object):
     for i in self.callbacklist:
       i(obj)
 
+  def _Observable(self, unused_obj):
+    """True if every change to our value in obj will call CallCallbacks."""
+    return True
+
 
 class Bool(Attr):
   """An attribute that is always either 0 or 1.
@@ -416,20 +444,121 @@ class IP6Addr(Attr):
     return value
 
 
+def _SetInnerName(attr, owner, name):
+  """Pass __set_name__ on to a wrapped descriptor, if it wants it."""
+  set_name = getattr(type(attr), '__set_name__', None)
+  if set_name is not None:
+    set_name(attr, owner, name)
+
+
 _FileBacked_Notifier = None
 
+# Held while deciding whether a FileBacked needs a Watch and creating it,
+# since the first gets of an object can happen on several threads at once.
+_register_lock = threading.RLock()
+
 
 def SetFileBackedNotifier(notifier):
   global _FileBacked_Notifier
   _FileBacked_Notifier = notifier
 
 
+class FileReadCounters(object):
+  """Counts FileBacked gets that did and didn't have to read their file."""
+
+  def __init__(self):
+    self.lock = threading.Lock()  # gets can happen on several threads
+    self.reads = 0
+    self.avoided = 0
+
+  def Reset(self):
+    self.reads = 0
+    self.avoided = 0
+
+  def Count(self, avoided):
+    with self.lock:
+      if avoided:
+        self.avoided += 1
+      else:
+        self.reads += 1
+
+  def __str__(self):
+    return 'FileBacked: %d file reads, %d avoided' % (self.reads,
+                                                      self.avoided)
+
+
+file_reads = FileReadCounters()
+
+
+# FileBacked changes that haven't reached the disk yet, as {filename: True}
+# to rename filename.tmp (already written) over it, or {filename: False} to
+# delete it.
+_pending_writes = {}
+
+
+def _SyncDir(dirname):
+  """fsync() a directory, so that renames and unlinks in it are durable."""
+  try:
+    fd = os.open(dirname, os.O_RDONLY)
+  except OSError:
+    return
+  try:
+    os.fsync(fd)
+  except OSError:
+    pass
+  finally:
+    os.close(fd)
+
+
+def FlushFileBackedWrites():
+  """Write out all pending FileBacked changes now.
+
+  This normally happens by itself once the mainloop is idle, so that all the
+  changes made by a transaction (or anything else in one loop iteration)
+  are committed in a single pass.  The new contents are already in .tmp
+  files by then.  Changes are grouped by directory: each file is renamed
+  into place or deleted, then each directory is fsync'd once.
+  """
+  pending = _pending_writes.copy()
+  _pending_writes.clear()
+  bydir = {}
+  for filename, change in pending.iteritems():
+    dirname = os.path.dirname(filename) or '.'
+    bydir.setdefault(dirname, []).append((filename, change))
+  for dirname, changes in sorted(bydir.iteritems()):
+    for filename, replace in sorted(changes):
+      try:
+        if replace:
+          os.rename(filename + '.tmp', filename)
+        else:
+          helpers.Unlink(filename)
+      except OSError as e:
+        # Not fatal; the other files still deserve to be written.
+        print 'FileBacked: writing %r: %r' % (filename, e)
+    _SyncDir(dirname)
+
+
+# Note: don't pass this function any parameters.  WaitUntilIdle schedules
+# one call per distinct set of parameters.
+@mainloop.WaitUntilIdle
+def _FlushFileBackedWritesLater():
+  FlushFileBackedWrites()
+
+
 class FileBacked(Attr):
   """An attribute that is actually a string stored in a file.
 
   If delete_if_empty is True and the string is set to empty or None,
   deletes the file.
   If the file doesn't exist, the value is the empty string.
+
+  Sets are queued and written out when the mainloop is next idle; see
+  FlushFileBackedWrites.
+
+  Once the file is being watched by the FileBacked notifier (see
+  SetFileBackedNotifier), the value read from it is cached until the
+  notifier tells us the file has changed.  Without a notifier, every get
+  reads the file.
   """
 
   def __init__(self, filename_ptr, attr, delete_if_empty=True,
@@ -457,33 +586,56 @@ class FileBacked(Attr):
     if hasattr(self.attr, 'SetWrapper'):
       self.attr.SetWrapper(self)
 
+  def __set_name__(self, owner, name):
+    super(FileBacked, self).__set_name__(owner, name)
+    _SetInnerName(self.attr, owner, name)
+
   def _GetData(self, obj):
-    """Returns a tuple (val, filename, watch) corresponding to this object."""
+    """Returns a tuple (val, filename, watch, cached) for this object.
+
+    cached is a 1-tuple holding the value last read from the file, or None
+    if the file has to be read again.  It is only ever set while watch is.
+    """
     try:
       return self._GetInstanceAttr(obj)
     except AttributeError:
-      return None, None, None
+      return None, None, None, None
 
   def GetFileName(self, obj):
-    _, filename, _ = self._GetData(obj)
+    _, filename, _, _ = self._GetData(obj)
     if not filename:
       return self.filename_ptr[0]
     return filename
 
   def SetFileName(self, obj, filename):
-    val, _, _ = self._GetData(obj)
-    self._SetInstanceAttr(obj, (val, filename, None))
+    val, _, _, _ = self._GetData(obj)
+    self._SetInstanceAttr(obj, (val, filename, None, None))
     self._RegisterNotifier(obj)
 
+  def _Observable(self, obj):
+    # We only find out about changes made behind our back if the file is
+    # being watched.
+    _, _, watch, _ = self._GetData(obj)
+    return bool(watch)
+
   def _CallRefCallbacks(self, obj_ref):
     """CallCallbacks using a weakref, only if the weakref is still valid."""
     obj = obj_ref()
     if obj:
+      val, filename, watch, _ = self._GetData(obj)
+      self._SetInstanceAttr(obj, (val, filename, watch, None))
       self.CallCallbacks(obj)
 
   def _RegisterNotifier(self, obj):
     if not obj: return
-    val, filename, watch = self._GetData(obj)
+    _, _, watch, _ = self._GetData(obj)
+    if watch or not _FileBacked_Notifier:
+      return
+    with _register_lock:
+      self._RegisterNotifierLocked(obj)
+
+  def _RegisterNotifierLocked(self, obj):
+    val, filename, watch, _ = self._GetData(obj)
     if not watch and _FileBacked_Notifier:
       # This is a little tricky.  You might think we'd just register the
       # notifier in the FileBacked constructor, but that doesn't work for
@@ -521,75 +673,81 @@ class FileBacked(Attr):
         # Not fatal, but will retry registering next time
         print repr(e)
       else:
-        self._SetInstanceAttr(obj, (val, filename, watch))
+        self._SetInstanceAttr(obj, (val, filename, watch, None))
 
   def __get__(self, obj, _):
     if obj is None:
       return self
     self._RegisterNotifier(obj)
+    try:
+      old_v, filename, watch, cached = self._GetInstanceAttr(obj)
+    except AttributeError:
+      old_v, filename, watch, cached = '', None, None, None
+    if cached is not None:
+      file_reads.Count(avoided=True)
+      return cached[0]
+    file_reads.Count(avoided=False)
     try:
       content = open(self.GetFileName(obj)).read().rstrip()
     except IOError as e:
       # If file doesn't exist, then use None.  Unless overridden, validate()
       # will convert this to ''.
       if e.errno == errno.ENOENT:
-        return self.validate(obj, None)
+        v = self.validate(obj, None)
+        if watch:
+          self._SetInstanceAttr(obj, (old_v, filename, watch, (v,)))
+        return v
       raise
     try:
       v = self.validate(obj, content)
     except ValueError:
       v = ''
-    try:
-      old_v, filename, watch = self._GetInstanceAttr(obj)
-    except AttributeError:
-      old_v, filename, watch = '', None, None
-    if v != old_v and (old_v, v) not in [(None, ''), ('', None)]:
-      self._SetInstanceAttr(obj, (v, filename, watch))
+    changed = v != old_v and (old_v, v) not in [(None, ''), ('', None)]
+    if changed or watch:
+      self._SetInstanceAttr(obj, (v if changed else old_v, filename, watch,
+                                  (v,) if watch else None))
+    if changed:
       self.CallCallbacks(obj)
     return v
 
-  # Note: don't pass this function any special parameters.  WaitUntilIdle
-  # will schedule up to 1 call of this function with *each* combination
-  # of parameters it is passed, which is probably not what you want.
-  @mainloop.WaitUntilIdle
-  def _ReallyWriteFile(self, obj):
+  def _WriteFile(self, obj, value):
+    """Writes the data to a .tmp file, to be renamed into place at idle time.
+
+    See FlushFileBackedWrites.  A later write to the same file before then
+    replaces this one.
+
+    Raises:
+      IOError: if the file's directory doesn't exist or isn't writable.
+      KeyError: if file_owner or file_group doesn't exist.
+    """
     filename = self.GetFileName(obj)
-    try:
-      os.rename(filename + '.tmp', filename)
-    except OSError as e:
-      if e.errno == errno.ENOENT:
-        helpers.Unlink(filename)
-      else:
-        raise
 
-  def _WriteFile(self, obj, value):
-    """Writes the data out the file. The file is updated at idle time."""
-
-    # First write a .tmp file.  We do this to catch exceptions where the
-    # directory doesn't exist or permission issues etc.  Once we write a
-    # tmp file, _ReallyWriteFile will schedule to rename the tmp file to the
-    # real file.  This can still fail if we don't have permission to the actual
-    # file but we have permission to the directory, but that seems less likely
-    # then the directory just not existing.
-    #
-    tmpname = self.GetFileName(obj) + '.tmp'
-    if value in [None, '']:
-      if self.delete_if_empty:
-        helpers.Unlink(tmpname)
-      else:
-        helpers.WriteFileAtomic(tmpname, '',
-                                owner=self.file_owner, group=self.file_group)
+    # Writing the .tmp file now catches the likely errors, where the
+    # directory doesn't exist or we don't have permission to write in it,
+    # while there's still someone to report them to.  Renaming it can still
+    # fail later if we don't have permission to the actual file, but that
+    # seems less likely than the directory just not existing.
+    tmpname = filename + '.tmp'
+    if value in [None, ''] and self.delete_if_empty:
+      helpers.Unlink(tmpname)
+      _pending_writes[filename] = False
     else:
-      data = unicode(value).rstrip().encode('utf-8') + '\n'
+      if value in [None, '']:
+        data = ''
+      else:
+        data = unicode(value).rstrip().encode('utf-8') + '\n'
       helpers.WriteFileAtomic(tmpname, data,
                               owner=self.file_owner, group=self.file_group)
-    self._ReallyWriteFile(obj)
+      _pending_writes[filename] = True
+    _FlushFileBackedWritesLater()
 
   def _SetWithoutNotify(self, obj, value):
     self._RegisterNotifier(obj)
-    _, filename, watch = self._GetData(obj)
-    self._SetInstanceAttr(obj, (value, filename, watch))  # cache this value
+    _, filename, watch, _ = self._GetData(obj)
     self._WriteFile(obj, value)
+    # Remember this value so we don't call callbacks when the file catches
+    # up, but read the file again next time: it isn't written until idle.
+    self._SetInstanceAttr(obj, (value, filename, watch, None))
 
 
 class _Proxy(Attr):
@@ -611,6 +769,10 @@ class _Proxy(Attr):
     if hasattr(self.attr, 'SetWrapper'):
       self.attr.SetWrapper(wrapattr)
 
+  def __set_name__(self, owner, name):
+    super(_Proxy, self).__set_name__(owner, name)
+    _SetInnerName(self.attr, owner, name)
+
   def validate(self, obj, value):
     f = getattr(self.attr, 'validate', None)
     if f: return f(obj, value)
@@ -629,6 +791,11 @@ class _Proxy(Attr):
     if f: return f(obj, value)
     return self.attr.__set__(obj, value)
 
+  def _Observable(self, obj):
+    # A plain @property can change whenever it likes without telling us.
+    f = getattr(self.attr, '_Observable', None)
+    return bool(f and f(obj))
+
 
 class Trigger(_Proxy):
   """A type descriptor that calls obj.Triggered() whenever its value changes.
@@ -832,6 +999,9 @@ class NumberOf(ReadOnly):
     except TypeError as e:
       raise TypeError('%s: %s' % (self.listname, e))
 
+  def _Observable(self, unused_obj):
+    return False
+
 
 def tryattr(obj, attrname, value):
   """Like setattr(), but validates the value without actually setting it.
@@ -890,3 +1060,73 @@ def AddNotifier(cls, attrname, notifier):
     raise TypeError(t)
   prop = getattr(cls, attrname)
   prop.callbacklist.append(notifier)
+
+
+def Observable(obj, attrname):
+  """Returns true if AddObserver will hear about every change to attrname.
+
+  That's the case for Attrs, which store their own value, and for FileBacked
+  once it is watching its file.  It isn't for an @property (even one wrapped
+  in Trigger or ReadOnly) or NumberOf, which work out their value on every
+  get; you have to poll those.
+
+  Args:
+    obj: the object containing the attribute.
+    attrname: the name of the attribute.
+  """
+  prop = getattr(type(obj), attrname, None)
+  f = getattr(prop, '_Observable', None)
+  return bool(f and f(obj))
+
+
+def _CallbackLists(cls, attrname):
+  """Returns the distinct callbacklists of attrname and everything it wraps.
+
+  A change made through a wrapper (eg. Trigger.__set__) only calls the
+  wrapper's callbacks, while a change noticed by the wrapped Attr (eg.
+  FileBacked's inotify watch, or ReadOnly.Set) only calls the wrapped one's.
+
+  Args:
+    cls: the class containing the attribute.
+    attrname: the name of the attribute.
+  Returns:
+    A list of callbacklists.
+  """
+  lists = []
+  prop = getattr(cls, attrname)
+  while prop is not None:
+    callbacklist = getattr(prop, 'callbacklist', None)
+    if (callbacklist is not None and
+        not any(l is callbacklist for l in lists)):
+      lists.append(callbacklist)
+    prop = getattr(prop, 'attr', None)
+  return lists
+
+
+def AddObserver(cls, attrname, observer):
+  """Like AddNotifier, but hears about changes from anywhere.
+
+  AddNotifier only registers with the outermost descriptor, so it isn't
+  called when, for example, the file behind a Trigger(FileBacked(...))
+  changes.  observer(obj) is called for every change to attrname of any
+  instance of cls, however it happened, and maybe a few times when nothing
+  changed.  See also Observable().
+
+  Args:
+    cls: the class to instrument.
+    attrname: The attribute to monitor.
+    observer: The function to call.
+  Raises:
+    TypeError: if cls is an object and not a class.
+  """
+  if not isinstance(cls, type):
+    raise TypeError('AddObserver can only be registered on a class')
+  for callbacklist in _CallbackLists(cls, attrname):
+    callbacklist.append(observer)
+
+
+def DelObserver(cls, attrname, observer):
+  """Undo AddObserver(cls, attrname, observer)."""
+  for callbacklist in _CallbackLists(cls, attrname):
+    if observer in callbacklist:
+      callbacklist.remove(observer)
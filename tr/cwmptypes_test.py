@@ -27,6 +27,7 @@ import weakref
 import google3
 import mainloop
 from wvtest import unittest
+import tr.core
 import tr.cwmptypes
 import tr.filenotifier
 import tr.garbage
@@ -57,6 +58,8 @@ class TestObject(object):
   file3 = tr.cwmptypes.FileBacked([TEST3_FILE], tr.cwmptypes.String(),
                                   delete_if_empty=True)
   file_bad = tr.cwmptypes.FileBacked([TESTBAD_FILE], tr.cwmptypes.String())
+  file_badowner = tr.cwmptypes.FileBacked(
+      [TEST3_FILE], tr.cwmptypes.String(), file_owner='no-such-user-x')
 
   v = tr.cwmptypes.Unsigned()
 
@@ -153,6 +156,25 @@ class NumberOfObject(object):
     self.TestList = []
 
 
+class NamedObject(tr.core.Exporter):
+  i = tr.cwmptypes.Int(3)
+  t = tr.cwmptypes.TriggerInt(4)
+  r = tr.cwmptypes.ReadOnlyString('foo')
+  f = tr.cwmptypes.ReadOnly(
+      tr.cwmptypes.Trigger(
+          tr.cwmptypes.FileBacked([TEST3_FILE], tr.cwmptypes.String())))
+
+  def Triggered(self):
+    pass
+
+
+class AliasedObject(tr.core.Exporter):
+  a = tr.cwmptypes.FileBacked([TEST3_FILE], tr.cwmptypes.String())
+  Exported = tr.cwmptypes.ReadOnly(a)
+  z = tr.cwmptypes.String('z')
+  AlsoExported = tr.cwmptypes.ReadOnly(z)
+
+
 class TypesTest(unittest.TestCase):
 
   def setUp(self):
@@ -352,6 +374,38 @@ class TypesTest(unittest.TestCase):
     loop.RunOnce()
     self.assertFalse(os.path.exists(TEST3_FILE))
 
+  def testFileBackedBatchedWrites(self):
+    loop = mainloop.MainLoop()
+    synced = []
+    orig_syncdir = tr.cwmptypes._SyncDir
+    tr.cwmptypes._SyncDir = synced.append
+    try:
+      for f in [TEST_FILE, TEST2_FILE, TEST3_FILE]:
+        tr.helpers.Unlink(f)
+      obj = TestObject()
+      obj.file = 1
+      obj.file2 = 0
+      obj.file3 = 'one'
+      obj.file3 = 'two'
+      obj.file = None
+      # Only the .tmp files get written until the mainloop is idle.
+      self.assertFalse(os.path.exists(TEST2_FILE))
+      self.assertFalse(os.path.exists(TEST3_FILE))
+      self.assertEqual(open(TEST3_FILE + '.tmp').read(), 'two\n')
+      self.assertEqual(synced, [])
+      loop.RunOnce()
+      self.assertFalse(os.path.exists(TEST_FILE))
+      self.assertEqual(open(TEST2_FILE).read(), 'False\n')
+      self.assertEqual(open(TEST3_FILE).read(), 'two\n')
+      self.assertFalse(os.path.exists(TEST3_FILE + '.tmp'))
+      self.assertEqual(synced, ['.'])
+      loop.RunOnce()
+      self.assertEqual(synced, ['.'])
+    finally:
+      tr.cwmptypes._SyncDir = orig_syncdir
+    for f in [TEST2_FILE, TEST3_FILE]:
+      os.unlink(f)
+
   def testFileBackedNotExist(self):
     obj = TestObject()
     with self.assertRaises(IOError):
@@ -359,6 +413,15 @@ class TypesTest(unittest.TestCase):
     loop = mainloop.MainLoop()
     loop.RunOnce()
 
+  def testFileBackedBadOwner(self):
+    tr.helpers.Unlink(TEST3_FILE)
+    obj = TestObject()
+    with self.assertRaises(KeyError):
+      obj.file_badowner = 'this should assert!'
+    loop = mainloop.MainLoop()
+    loop.RunOnce()
+    self.assertFalse(os.path.exists(TEST3_FILE))
+
   def testFileBackedNotifier(self):
     loop = mainloop.MainLoop()
     notifier = tr.filenotifier.FileNotifier(loop)
@@ -384,6 +447,83 @@ class TypesTest(unittest.TestCase):
     loop.RunOnce()
     self.assertEqual(count, [2])
 
+  def testFileBackedCache(self):
+    tr.helpers.Unlink(TEST3_FILE)
+    counters = tr.cwmptypes.file_reads
+    counters.Reset()
+    obj = TestObject()
+    # Without a notifier, every get has to read the file.
+    self.assertEqual(obj.file3, None)
+    self.assertEqual(obj.file3, None)
+    self.assertEqual(counters.reads, 2)
+    self.assertEqual(counters.avoided, 0)
+
+    loop = mainloop.MainLoop()
+    notifier = tr.filenotifier.FileNotifier(loop)
+    tr.cwmptypes.SetFileBackedNotifier(notifier)
+    obj = TestObject()
+    count = [0]
+    def CallMe(unused_obj):
+      count[0] += 1
+    tr.cwmptypes.AddNotifier(type(obj), 'file3', CallMe)
+    counters.Reset()
+    for _ in range(10):
+      self.assertEqual(obj.file3, None)
+    self.assertEqual(counters.reads, 1)
+    self.assertEqual(counters.avoided, 9)
+    open(TEST3_FILE, 'w').write('boo')
+    loop.RunOnce()
+    self.assertEqual(count, [1])
+    for _ in range(10):
+      self.assertEqual(obj.file3, 'boo')
+    self.assertEqual(counters.reads, 2)
+    self.assertEqual(counters.avoided, 18)
+    self.assertEqual(count, [2])
+
+    # Our own writes invalidate the cache once they reach the file.
+    obj.file3 = 'doo'
+    loop.RunOnce()
+    self.assertEqual(open(TEST3_FILE).read(), 'doo\n')
+    self.assertEqual(obj.file3, 'doo')
+    self.assertEqual(obj.file3, 'doo')
+    self.assertEqual(counters.reads, 3)
+    self.assertEqual(counters.avoided, 19)
+    TestObject.file3.callbacklist.remove(CallMe)
+    counters.Reset()
+
+  def testObservers(self):
+    obj = TriggerObject()
+    self.assertTrue(tr.cwmptypes.Observable(obj, 'a'))
+    self.assertTrue(tr.cwmptypes.Observable(obj, 'vv'))
+    self.assertFalse(tr.cwmptypes.Observable(obj, 'val'))
+    self.assertFalse(tr.cwmptypes.Observable(obj, 'nonexistent'))
+    self.assertFalse(tr.cwmptypes.Observable(NumberOfObject(),
+                                             'TestDictNumberOfEntries'))
+    # No notifier, so nobody would tell us if the file changed.
+    _ = obj.file3
+    self.assertFalse(tr.cwmptypes.Observable(obj, 'file3'))
+
+    loop = mainloop.MainLoop()
+    notifier = tr.filenotifier.FileNotifier(loop)
+    tr.cwmptypes.SetFileBackedNotifier(notifier)
+    tr.helpers.Unlink(TEST3_FILE)
+    obj = TriggerObject()
+    _ = obj.file4
+    self.assertTrue(tr.cwmptypes.Observable(obj, 'file4'))
+    seen = []
+    tr.cwmptypes.AddObserver(TriggerObject, 'file4', seen.append)
+    open(TEST3_FILE, 'w').write('boo')
+    loop.RunOnce()
+    self.assertEqual([obj], seen)
+    del seen[:]
+    TriggerObject.file4.Set(obj, 'doo')
+    self.assertTrue(seen)
+    tr.cwmptypes.DelObserver(TriggerObject, 'file4', seen.append)
+    del seen[:]
+    TriggerObject.file4.Set(obj, 'boo')
+    loop.RunOnce()
+    self.assertEqual([], seen)
+
   def testFileBackedTrigger(self):
     loop = mainloop.MainLoop()
     notifier = tr.filenotifier.FileNotifier(loop)
@@ -587,6 +727,41 @@ class TypesTest(unittest.TestCase):
     t.s = 'ma\xf1ana'  # ISO8859
     self.assertEqual(u'ma\ufffdana', t.s)
 
+  def testNamesBoundAtClassCreation(self):
+    attrs = NamedObject.__dict__
+    self.assertEqual('_i', attrs['i']._attrname)
+    self.assertEqual('_t', attrs['t']._attrname)
+    self.assertEqual('_t', attrs['t'].attr._attrname)
+    self.assertEqual('_r', attrs['r'].attr._attrname)
+    f = attrs['f']
+    self.assertEqual('_f', f._attrname)
+    self.assertEqual('_f', f.attr._attrname)
+    self.assertEqual('_f', f.attr.attr._attrname)
+    self.assertEqual('_f', f.attr.attr.attr._attrname)
+
+    obj = NamedObject()
+    self.assertEqual(3, obj.i)
+    self.assertEqual(4, obj.t)
+    obj.t = 5
+    self.assertEqual(5, obj.t)
+    self.assertEqual('foo', obj.r)
+    self.assertEqual(5, obj._t)
+    open(TEST3_FILE, 'w').write('bar\n')
+    self.assertEqual('bar', obj.f)
+
+  def testAliasedAttrNamedByWrapper(self):
+    attrs = AliasedObject.__dict__
+    self.assertEqual('_Exported', attrs['a']._attrname)
+    self.assertEqual('_AlsoExported', attrs['z']._attrname)
+    obj = AliasedObject()
+    self.assertEqual('z', obj.AlsoExported)
+    obj.z = 'zz'
+    self.assertEqual('zz', obj.AlsoExported)
+    self.assertEqual('zz', obj._AlsoExported)
+    open(TEST3_FILE, 'w').write('bar\n')
+    self.assertEqual('bar', obj.Exported)
+    os.unlink(TEST3_FILE)
+
   def testDerived(self):
     t = DerivedObject()
     _ = t.file3
@@ -19,6 +19,7 @@
 
 import os
 import os.path
+import threading
 import garbage
 import mainloop
 import pyinotify
@@ -26,6 +27,11 @@ import pyinotify
 
 Error = pyinotify.WatchManagerError
 
+# Watches can be added from any thread that gets a FileBacked value, and
+# removed from any thread that drops the last reference to one.  This also
+# serializes our uses of garbage.GcIgnorer, which changes global gc state.
+_lock = threading.RLock()
+
 
 class FileNotifier(object):
   """A class for managing file notifications in a tornado ioloop."""
@@ -44,7 +50,7 @@ class FileNotifier(object):
         self.wm, self.loop.ioloop)
 
   def __del__(self):
-    with garbage.GcIgnorer():
+    with _lock, garbage.GcIgnorer():
       self.wm = None
       self.loop = None
       if getattr(self, 'tornado_notifier', None):
@@ -66,6 +72,10 @@ class FileNotifier(object):
       pyinotify.WatchManagerError: if the containing directory does
           not exist.
     """
+    with _lock:
+      self._Add(filename, callback)
+
+  def _Add(self, filename, callback):
     path, name = os.path.split(filename)
     pathdata = self.watches.get(path, None)
     if pathdata:
@@ -90,6 +100,10 @@ class FileNotifier(object):
     filecalls.append(callback)
 
   def Del(self, filename, callback):
+    with _lock:
+      self._Del(filename, callback)
+
+  def _Del(self, filename, callback):
     path, name = os.path.split(filename)
     wd, files = self.watches[path]
     filecalls = files[name]
@@ -18,7 +18,48 @@
 #
 """A wrapper for accessing a tree of core.Exporter objects."""
 
+import threading
 import traceback
+import core
+
+
+# Upper bound on the number of objects GetCanonicalName() will visit when
+# the reverse index in core can't answer, ie. for ephemeral objects that
+# are regenerated on every access (entries of an AutoDict or a list built by
+# a @property).  Exceeding it means there is no canonical name.
+MAX_CANONICAL_SEARCH = 20000
+
+# Deeper than any real data model; guards against cycles in a stale index.
+_MAX_DEPTH = 64
+
+# Number of resolved path prefixes (eg. 'Device.Ethernet.Interface.3.Stats')
+# each root Handle remembers for FindExport() and GetExport().
+MAX_PATH_CACHE = 2048
+
+# Held while reading or updating any path cache or its counters, since
+# GetParameterValues can use several threads (see api.CPE.gpv_threads).
+# Never held while calling into the tree itself.
+_path_cache_lock = threading.Lock()
+
+
+class PathCacheCounters(object):
+  """Hit/miss counters for the Handle path cache."""
+
+  def __init__(self):
+    self.hits = 0
+    self.misses = 0
+
+  def Reset(self):
+    self.hits = 0
+    self.misses = 0
+
+  def __str__(self):
+    return 'path cache: %d hits, %d misses' % (self.hits, self.misses)
+
+
+# Totals for all handles; reported and reset by tr.session at the end of
+# each ACS session.
+session_path_cache = PathCacheCounters()
 
 
 class NotAddableError(KeyError):
@@ -60,6 +101,9 @@ class Handle(object):
     self.roothandle = roothandle
     self.basename = basename
     self.obj = obj
+    self.path_cache = None  # allocated by the root handle on first use
+    self.path_cache_counters = None
+    self.path_cache_generation = None
 
   def _Sub(self, name, obj):
     if self.basename:
@@ -73,14 +117,17 @@ class Handle(object):
   def GetCanonicalName(root, obj_to_find):
     """Generate a canonical name for an object.
 
-    Walk through the tree and generate the canonical name for an
-    object.  The tree walk starts with this object.
+    Most objects are found in core's reverse index, by walking from
+    obj_to_find up towards root in O(depth).  The index is maintained by
+    AddExportObject, DeleteExportObject, and Export/Unexport, and also
+    learns about every stable object it passes while searching.
 
-    WARNING: This function is horribly slow! It really does visit every node
-    in the whole tree, even virtual ones, while looking for obj_to_find.
-    It's also possible that the object you're looking for is virtual and
-    is no longer in the tree (or has been replaced) by the time we try to
-    visit it, in which case it won't have a canonical name at all.
+    Ephemeral objects (eg. Hosts or the ProcessList, which are regenerated
+    each time they are visited) can't be indexed, so for those we fall back
+    to walking the tree, visiting at most MAX_CANONICAL_SEARCH objects.  It's
+    possible that such an object is no longer in the tree (or has been
+    replaced) by the time we try to visit it, in which case it won't have a
+    canonical name at all.
 
     Args:
       root: the object to start searching from.
@@ -88,11 +135,64 @@ class Handle(object):
     Returns:
       The canonical path to the object.
     """
+    name = Handle._IndexedCanonicalName(root, obj_to_find)
+    if name:
+      return name
+    return Handle._SearchCanonicalName(root, obj_to_find,
+                                       [MAX_CANONICAL_SEARCH])
+
+  @staticmethod
+  def _IsExportedAs(parent, name, child):
+    """True if parent currently exports child as name ('Foo' or 'Foo.5')."""
+    objname, _, idx = name.partition('.')
+    if not Handle.IsValidExport(parent, objname):
+      return False
+    d = getattr(parent, '__dict__', {})
+    found = d.get(Handle._FixExportName(parent, objname))
+    if not idx:
+      return found is child
+    if not isinstance(found, dict):
+      return False
+    if idx in found:
+      return found[idx] is child
+    return found.get(_Int(idx)) is child
+
+  @staticmethod
+  def _IndexedCanonicalName(root, obj_to_find):
+    """Look up obj_to_find in the reverse index; None if that doesn't work."""
+    parts = []
+    obj = obj_to_find
+    while obj is not root:
+      parent, name = core.IndexedParent(obj)
+      if (parent is None or len(parts) > _MAX_DEPTH or
+          not Handle._IsExportedAs(parent, name, obj)):
+        return None
+      parts.append(name)
+      obj = parent
+    return '.'.join(reversed(parts))
+
+  @staticmethod
+  def _SearchCanonicalName(root, obj_to_find, budget):
+    """Walk the tree looking for obj_to_find, indexing what we pass.
+
+    Args:
+      root: the object to start searching from.
+      obj_to_find: the object to generate the canonical name for.
+      budget: a one-element list with the number of objects we may still
+        visit.  Shared across the recursion, so it bounds the whole search.
+    Returns:
+      The canonical path to the object, or None.
+    """
     for name in root.export_objects:
+      budget[0] -= 1
+      if budget[0] < 0:
+        return None
       exp_obj = Handle._GetExport(root, name)
+      if Handle._IsExportedAs(root, name, exp_obj):
+        core.IndexParent(exp_obj, root, name)
       if exp_obj == obj_to_find:
         return name
-      tmp_path = Handle.GetCanonicalName(exp_obj, obj_to_find)
+      tmp_path = Handle._SearchCanonicalName(exp_obj, obj_to_find, budget)
       if tmp_path:
         return name + '.' + tmp_path
 
@@ -100,12 +200,20 @@ class Handle(object):
       objlist = Handle._GetExport(root, name)
       if objlist == obj_to_find:
         return name
+      stable = (isinstance(objlist, dict) and
+                Handle._IsExportedAs(root, name, objlist))
       for (idx, child_obj) in objlist.iteritems():
+        budget[0] -= 1
+        if budget[0] < 0:
+          return None
+        childname = name + '.' + str(idx)
+        if stable:
+          core.IndexParent(child_obj, root, childname)
         if child_obj == obj_to_find:
-          return name + '.' + str(idx)
-        tmp_path = Handle.GetCanonicalName(child_obj, obj_to_find)
+          return childname
+        tmp_path = Handle._SearchCanonicalName(child_obj, obj_to_find, budget)
         if tmp_path:
-          return name + '.' + str(idx) + '.' + tmp_path
+          return childname + '.' + tmp_path
     return None
 
   @staticmethod
@@ -175,6 +283,9 @@ class Handle(object):
 
   @staticmethod
   def IsValidExport(obj, name):
+    info = core.GetExportInfo(obj)
+    if info is not None:
+      return name in info.kinds
     return (name in obj.export_params or
             name in obj.export_objects or
             name in obj.export_object_lists)
@@ -205,6 +316,11 @@ class Handle(object):
 
   @staticmethod
   def _FixExportName(parent, name):
+    info = core.GetExportInfo(parent)
+    if info is not None:
+      attr = info.attrs.get(name)
+      if attr is not None:
+        return attr
     if name in parent.export_object_lists:
       return name.replace('-', '_') + 'List'
     else:
@@ -215,6 +331,12 @@ class Handle(object):
   def _GetExport(parent, name):
     """Find an export called 'name' that is directly under object 'parent'."""
     if hasattr(parent, 'Export'):
+      info = core.GetExportInfo(parent)
+      if info is not None:
+        attr = info.attrs.get(name)
+        if attr is None:
+          raise KeyError(name)
+        return getattr(parent, attr)
       if not Handle.IsValidExport(parent, name):
         raise KeyError(name)
       else:
@@ -226,30 +348,195 @@ class Handle(object):
       pass
     return parent[name]
 
+  @staticmethod
+  def _StableHop(parent, name, child):
+    """Return a (container, key, child) tuple if child can be cached.
+
+    A cached path is only as good as our ability to notice that it has
+    changed.  Sub-objects stored in parent.__dict__ and entries of a plain
+    dict object list can be checked with container.get(key) is child; an
+    @property or AutoDict might build a new object on every access, so
+    anything underneath one of those isn't cached at all.
+
+    Args:
+      parent: the object we looked up name in.
+      name: the export name, eg. 'Foo' or '5'.
+      child: what Handle._GetExport(parent, name) returned.
+    Returns:
+      (container, key, child), or None if the hop is not stable.
+    """
+    if hasattr(parent, 'Export'):
+      d = getattr(parent, '__dict__', None)
+      key = Handle._FixExportName(parent, name)
+      if d is None or d.get(key) is not child:
+        return None
+      if hasattr(child, 'Export') or type(child) is dict:
+        return d, key, child
+      return None
+    if type(parent) is not dict:
+      return None
+    key = name if name in parent else _Int(name)
+    if parent.get(key) is child and hasattr(child, 'Export'):
+      return parent, key, child
+    return None
+
+  def _PathCache(self):
+    """Return the root handle's path cache, flushing it if it is stale.
+
+    The cache is a pair of dicts [recent, older].  New and recently used
+    entries go in recent; when that fills up, it becomes older and the
+    previous older is thrown away.  That's nearly as good as a real LRU,
+    and unlike collections.OrderedDict it creates no reference cycles.
+
+    Returns:
+      the [recent, older] list.
+    """
+    generation = core.StructureGeneration()
+    if self.path_cache is None or self.path_cache_generation != generation:
+      if self.path_cache is None:
+        self.path_cache_counters = PathCacheCounters()
+        core.WatchRoot(self.obj)
+      self.path_cache = [{}, {}]
+      self.path_cache_generation = generation
+    return self.path_cache
+
+  @staticmethod
+  def _CachedHops(cache, prefix):
+    """Return the cached hops to prefix, or None if missing or out of date."""
+    recent, older = cache
+    hops = recent.get(prefix)
+    promote = hops is None
+    if promote:
+      hops = older.get(prefix)
+      if hops is None:
+        return None
+    for container, key, child in hops:
+      if container.get(key) is not child:
+        cache[0].pop(prefix, None)
+        cache[1].pop(prefix, None)
+        return None
+    if promote:
+      # This can rotate the generations, so do it after checking.
+      del older[prefix]
+      Handle._CacheHops(cache, prefix, hops)
+    return hops
+
+  @staticmethod
+  def _CacheHops(cache, prefix, hops):
+    recent = cache[0]
+    if len(recent) >= MAX_PATH_CACHE / 2:
+      cache[1] = recent
+      cache[0] = recent = {}
+    recent[prefix] = hops
+
+  def _ResolvePrefix(self, parts):
+    """Walk self.obj down through parts, using and filling the path cache."""
+    with _path_cache_lock:
+      cache = self._PathCache()
+      i = len(parts)
+      hops = None
+      while i > 0:
+        hops = self._CachedHops(cache, '.'.join(parts[:i]))
+        if hops is not None:
+          break
+        i -= 1
+      counters = self.path_cache_counters
+      if i == len(parts):
+        counters.hits += 1
+        session_path_cache.hits += 1
+        return hops[-1][2]
+      counters.misses += 1
+      session_path_cache.misses += 1
+    if i:
+      o = hops[-1][2]
+    else:
+      o = self.obj
+      hops = ()
+    grandparent = None
+    for j in xrange(i, len(parts)):
+      p = parts[j]
+      child = self._WalkOne(o, parts, j)
+      if hops is not None:
+        hop = self._StableHop(o, p, child)
+        if hop is None:
+          hops = None
+        else:
+          if hasattr(o, 'Export'):
+            core.IndexParent(child, o, p)
+          elif grandparent is not None:
+            core.IndexParent(child, grandparent, parts[j - 1] + '.' + p)
+          hops += (hop,)
+          with _path_cache_lock:
+            self._CacheHops(cache, '.'.join(parts[:j + 1]), hops)
+      grandparent = o
+      o = child
+    return o
+
+  def _WalkOne(self, o, parts, i):
+    """Return the child named parts[i] of o, with useful exceptions."""
+    try:
+      return self._GetExport(o, parts[i])
+    except KeyError as e:
+      # Fill in the full path to the missing element, rather than just
+      # its basename (which is often something unhelpful like '1').
+      e.args = tuple(['.'.join(tuple(parts[:i]) + tuple(e.args))])
+      raise
+    except Exception as e:
+      raise Exception(repr(e))
+
   def FindExport(self, name):
     """Navigate through the export hierarchy to find the parent of 'name'.
 
+    On a root handle (one not created by Sub()), resolved parents are kept
+    in an LRU cache of up to MAX_PATH_CACHE entries, so looking up many
+    parameters of the same object only walks the tree once.  Each cached
+    hop is re-checked on every hit, and the whole cache is dropped when
+    objects are added to or deleted from the tree.
+
     Args:
       name: the name of the sub-object to find the parent of.
     Returns:
       (parent, subname): the parent handle and the name of the parameter or
          object referred to by 'name', relative to the parent.
     """
-    o = self.obj
     assert not name.endswith('.')
     parts = name.split('.')
-    for i, p in enumerate(parts[:-1]):
-      try:
-        o = self._GetExport(o, p)
-      except KeyError as e:
-        # Fill in the full path to the missing element, rather than just
-        # its basename (which is often something unhelpful like '1').
-        e.args = tuple(['.'.join(tuple(parts[:i]) + tuple(e.args))])
-        raise
-      except Exception as e:
-        raise Exception(repr(e))
+    if self.roothandle is None and len(parts) > 1:
+      o = self._ResolvePrefix(parts[:-1])
+    else:
+      o = self.obj
+      for i in xrange(len(parts) - 1):
+        o = self._WalkOne(o, parts, i)
     return self._Sub('.'.join(parts[:-1]), o), parts[-1]
 
+  def FindObservable(self, name):
+    """Find the object and attribute that hold the parameter 'name'.
+
+    This only works if each step from here to the parameter passes
+    _StableHop, ie. we would get the same object every time until objects
+    are added to or deleted from the tree.  Something watching the
+    attribute can then be sure it is watching the right one.
+
+    Args:
+      name: a dot-separated parameter name.
+    Returns:
+      (obj, attrname), or None if name is an object rather than a parameter,
+      or might be found in a different object next time.
+    Raises:
+      KeyError, IndexError: if a step along the way doesn't exist.
+    """
+    parts = name.split('.')
+    o = self.obj
+    for i in xrange(len(parts) - 1):
+      child = self._WalkOne(o, parts, i)
+      if self._StableHop(o, parts[i], child) is None:
+        return None
+      o = child
+    subname = parts[-1]
+    if not hasattr(o, 'Export') or subname not in o.export_params:
+      return None
+    return o, self._FixExportName(o, subname)
+
   def GetExport(self, name):
     """Get a child of this object (a parameter or object).
 
@@ -338,23 +625,46 @@ class Handle(object):
     setattr(parent.obj, subname, value)
     return parent.obj
 
+  def _AttrsObject(self, param):
+    """Returns the object that might keep attributes for param itself."""
+    if param.endswith('.'):
+      # A partial path: the object itself, not its parent.
+      return self.GetExport(param[:-1]) if param[:-1] else self.obj
+    parent, unused_name = self.FindExport(param)
+    return parent.obj
+
   def SetExportAttrs(self, param, attrs):
     """Set the attributes of a given parameter.
 
     Args:
-      param: the parameter whose attribute is going to be set.
+      param: the parameter whose attribute is going to be set, or a
+             partial path (ending in '.') to an object.
       attrs: dict of key/value pairs of attributes and
              the values to set.
     Returns:
       True:  If the object handled setting the attribute.
       False:  If the object does not hanlde setting the attribute.
     """
-    parent, unused_name = self.FindExport(param)
-    if not hasattr(parent.obj, 'SetAttributes'):
+    obj = self._AttrsObject(param)
+    if not hasattr(obj, 'SetAttributes'):
       return False
-    parent.obj.SetAttributes(attrs)
+    obj.SetAttributes(attrs)
     return True
 
+  def GetExportAttrs(self, param):
+    """Get the attributes of a given parameter.
+
+    Args:
+      param: the parameter whose attributes are wanted.
+    Returns:
+      A dict of attributes, if the object keeps track of its own attributes
+      (see SetExportAttrs), else None.
+    """
+    obj = self._AttrsObject(param)
+    if not hasattr(obj, 'GetAttributes'):
+      return None
+    return obj.GetAttributes()
+
   def _AddExportObject(self, name, idx):
     """Same as AddExportObject, but 'name' must be a direct child (no dots)."""
     objlist = self._GetExport(self.obj, name)
@@ -379,6 +689,13 @@ class Handle(object):
     except SchemaError, e:
       raise NotAddableError('%s: %s' % (name, e))
     objlist[_Int(idx)] = newobj
+    # Index it under the object that holds the list, by its name relative
+    # to that object, but only if the list is the one stored there (not a
+    # copy handed out by a @property).
+    indexname = '%s.%s' % (name, idx)
+    if Handle._IsExportedAs(self.obj, indexname, newobj):
+      core.IndexParent(newobj, self.obj, indexname)
+    core.StructureChanged()
     return idx, newobj
 
   def AddExportObject(self, name, idx=None):
@@ -413,6 +730,8 @@ class Handle(object):
     """
     objlist = self.GetExport(name)
     idx = str(idx)
+    if isinstance(objlist, dict):
+      core.UnindexParent(objlist.get(idx, objlist.get(_Int(idx))))
     try:
       del objlist[idx]
     except KeyError:
@@ -421,6 +740,7 @@ class Handle(object):
         del objlist[idx]
       except KeyError:
         raise KeyError((name, idx))
+    core.StructureChanged()
 
   def _ListExportsFromDict(self):
     if not hasattr(self.obj, 'iteritems'):
@@ -431,14 +751,19 @@ class Handle(object):
         yield '%s.' % (sidx,), self._Sub(sidx, obj), None
 
   def _ListExports(self):
-    for name in sorted(set().union(self.obj.export_params,
-                                   self.obj.export_objects,
-                                   self.obj.export_object_lists)):
-      if name in self.obj.export_objects:
+    info = core.GetExportInfo(self.obj)
+    if info is None:
+      info = core.ExportInfo(self.obj.export_params,
+                             self.obj.export_objects,
+                             self.obj.export_object_lists)
+    kinds = info.kinds
+    for name in info.names:
+      kind = kinds[name]
+      if kind & core.EXPORT_OBJECT:
         yield name + '.', self.Sub(name), None
-      elif name in self.obj.export_params:
+      elif kind & core.EXPORT_PARAM:
         yield name, self, name
-      if name in self.obj.export_object_lists:
+      if kind & core.EXPORT_LIST:
         yield name + '.', self.Sub(name), None
 
   def ListExportsEx(self, name=None, recursive=False):
@@ -30,6 +30,7 @@ import sys
 import time
 import urllib
 import urlparse
+import zlib
 
 from curtain import digest
 import helpers
@@ -174,6 +175,33 @@ def AddQueryParams(url, want_autoprov):
   return url
 
 
+def Gzip(data):
+  """Returns data, gzip-compressed for use with Content-Encoding: gzip."""
+  compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+  return compressor.compress(data) + compressor.flush()
+
+
+def _Message(req):
+  """Returns (data, terse log or None) for req, a soap.Writer or a string.
+
+  The terse log is kept, instead of the whole Writer, so the message doesn't
+  have to be parsed again to log it when it is sent.
+  """
+  listener = getattr(req, 'listener', None)
+  return str(req), listener.Summary() if listener else None
+
+
+def GzipRejected(response):
+  """Whether an HTTP error response refuses a request for being gzipped."""
+  if response.code == 415:  # Unsupported Media Type
+    return True
+  if response.code == 400:
+    # Only if it says so; a 400 can mean anything.
+    body = (response.body or '').lower()
+    return 'content-encoding' in body or 'gzip' in body
+  return False
+
+
 def CurlCreator(oldcreator, *args, **kwargs):
   """Set some pycurl options that tornado doesn't otherwise use."""
   curl = oldcreator(*args, **kwargs)
@@ -181,6 +209,103 @@ def CurlCreator(oldcreator, *args, **kwargs):
   return curl
 
 
+class _ConnectCounter(object):
+  """A curl SOCKOPTFUNCTION that counts the sockets curl opens."""
+
+  def __init__(self):
+    self.count = 0
+
+  def __call__(self, unused_fd, unused_purpose):
+    self.count += 1
+    return 0  # CURL_SOCKOPT_OK
+
+
+class AcsConnectionPool(object):
+  """The HTTP client we use to talk to the ACS, kept across CWMP sessions.
+
+  A tornado curl client keeps its curl multi handle, and the connections
+  cached in it, for as long as the client exists.  Keeping one client per
+  ACS, plus a curl share handle for TLS sessions and DNS lookups, lets
+  a new CWMP session reuse the previous session's connection, or at least
+  resume its TLS session instead of doing a full handshake.
+
+  The client belongs to one ACS (URL scheme, host and port, and the
+  certificate settings in fetch_args).  When that changes, the old client
+  is closed, along with all its connections, and a new one started.
+  """
+
+  CERT_ARGS = ('ca_certs', 'validate_cert', 'client_cert', 'client_key')
+
+  def __init__(self, ioloop, fetch_args):
+    self.ioloop = ioloop
+    self.fetch_args = fetch_args
+    self.key = None
+    self.client = None
+    self.share = None
+    self.shared = set()  # id()s of curl handles already using self.share
+    self.connects = _ConnectCounter()
+    self.posts = 0
+    self.handshakes_avoided = 0
+    self.post_seconds = 0.0
+
+  def _Key(self, url):
+    split = urlparse.urlsplit(url or '')
+    return (split.scheme, split.hostname, split.port,
+            tuple(self.fetch_args.get(arg) for arg in self.CERT_ARGS))
+
+  def Client(self, url):
+    """Return the HTTP client to use for url, starting a new one if needed."""
+    key = self._Key(url)
+    if self.client is None or key != self.key:
+      self.Close()
+      self.key = key
+      self.share = pycurl.CurlShare()
+      self.share.setopt(pycurl.SH_SHARE, pycurl.LOCK_DATA_SSL_SESSION)
+      self.share.setopt(pycurl.SH_SHARE, pycurl.LOCK_DATA_DNS)
+      self.client = session.HTTPCLIENT(max_simultaneous_connections=1,
+                                       io_loop=self.ioloop,
+                                       force_instance=True)
+    return self.client
+
+  def Close(self):
+    """Close the client and all of its connections."""
+    if self.client is not None:
+      self.client.close()
+      self.client = None
+    if self.share is not None:
+      self.share.close()
+      self.share = None
+    self.shared.clear()
+    self.key = None
+
+  def PrepareCurl(self, curl):
+    """An HTTPRequest prepare_curl_callback for requests to the ACS."""
+    # Setting SHARE again on a handle that already uses it makes curl
+    # detach and reattach it, and the handle's next request never finishes.
+    # The handles belong to self.client, so they live exactly as long as
+    # self.share does.
+    if self.share is not None and id(curl) not in self.shared:
+      self.shared.add(id(curl))
+      curl.setopt(pycurl.SHARE, self.share)
+    curl.setopt(pycurl.SOCKOPTFUNCTION, self.connects)
+
+  def Posted(self, connects_before, request_time):
+    """Record a finished POST, sent when self.connects was connects_before."""
+    self.posts += 1
+    self.post_seconds += request_time
+    if self.connects.count == connects_before:
+      self.handshakes_avoided += 1
+
+  def AveragePostLatency(self):
+    return self.post_seconds / self.posts if self.posts else 0.0
+
+  def __str__(self):
+    return ('ACS connections: %d POSTs, %d connections opened, '
+            '%d handshakes avoided, %.3fs average POST latency' % (
+                self.posts, self.connects.count, self.handshakes_avoided,
+                self.AveragePostLatency()))
+
+
 class CPEStateMachine(object):
   """A tr-69 Customer Premises Equipment implementation.
 
@@ -208,6 +333,10 @@ class CPEStateMachine(object):
     self.encode = api_soap.Encode()
     self.cwmplogger = cwmplog.Logger(full_logs=10)
     self.outstanding = None
+    self.outstanding_log = None  # the terse log of outstanding, if known
+    self.outstanding_compressed = False
+    self.bytes_sent = 0
+    self.bytes_sent_uncompressed = 0
     self.response_queue = []
     self.request_queue = []
     self.event_queue = LimitDeque(MAX_EVENT_QUEUE_SIZE, self.EventQueueHandler)
@@ -217,6 +346,11 @@ class CPEStateMachine(object):
     self.session = None
     self.my_configured_ip = ip
     self.fetch_args = fetch_args or dict()
+    self.acs_pool = AcsConnectionPool(self.ioloop, self.fetch_args)
+    self.connects_at_post = 0
+    # Seconds per session to spend precomputing cache entries recent
+    # sessions needed (see session.WarmUp); 0 to disable.
+    self.warmup_budget = 0
     self.ping_rate_limit_seconds = 2
     self.previous_ping_time = 0
     self.ping_timeout_pending = None
@@ -251,11 +385,11 @@ class CPEStateMachine(object):
     return self.cpe_management_server
 
   def Send(self, req):
-    self.request_queue.append(str(req))
+    self.request_queue.append(_Message(req))
     self.Run()
 
   def SendResponse(self, req):
-    self.response_queue.append(str(req))
+    self.response_queue.append(_Message(req))
     self.Run()
 
   def LookupDevIP6(self):
@@ -307,6 +441,9 @@ class CPEStateMachine(object):
 
   def EncodeInform(self):
     """Return an Inform message for this session."""
+    return str(self._Inform())
+
+  def _Inform(self):
     if not self.session.my_ip:
       my_ip = self._GetLocalAddr()
       self.session.my_ip = my_ip
@@ -352,10 +489,9 @@ class CPEStateMachine(object):
         parameter_list += self._changed_parameters_sent
     except (AttributeError, KeyError):
       pass
-    req = self.encode.Inform(root=self.cpe.root, events=events,
-                             retry_count=self.retry_count,
-                             parameter_list=parameter_list)
-    return str(req)
+    return self.encode.Inform(root=self.cpe.root, events=events,
+                              retry_count=self.retry_count,
+                              parameter_list=parameter_list)
 
   def SendTransferComplete(self, command_key, faultcode, faultstring,
                            starttime, endtime, event_code):
@@ -369,17 +505,22 @@ class CPEStateMachine(object):
     self.Send(cmpl)
 
   def GetNext(self):
-    """Return next request to process."""
+    """Return (next request to process, its terse log), or None."""
     if not self.session:
       return None
     if self.session.inform_required():
       self.session.state_update(sent_inform=True)
-      return self.EncodeInform()
+      inform = _Message(self._Inform())
+      if self.warmup_budget > 0:
+        # Runs once this Inform has been POSTed, while we wait for the ACS.
+        self.session.warmup = session.WarmUp(self.ioloop, self.warmup_budget)
+        self.session.warmup.Start()
+      return inform
     if self.response_queue and self.session.response_allowed():
       return self.response_queue.pop(0)
     if self.request_queue and self.session.request_allowed():
       return self.request_queue.pop(0)
-    return ''
+    return '', None
 
   def Run(self):
     """Run one transaction with the ACS."""
@@ -393,6 +534,7 @@ class CPEStateMachine(object):
       return
     if self.session.should_close():
       print 'Idle CWMP session, terminating.'
+      print self.acs_pool
       self.outstanding = None
       ping_received = self.session.close()
       self._acs_config.AcsAccessSuccess(self.session.orig_acs_url)
@@ -411,11 +553,15 @@ class CPEStateMachine(object):
       # already an outstanding request
       return
     if self.outstanding is None:
-      self.outstanding = self.GetNext()
-    if self.outstanding is None:
-      # We're not allowed to send anything yet, session not fully open.
-      return
-
+      message = self.GetNext()
+      if message is None:
+        # We're not allowed to send anything yet, session not fully open.
+        return
+      self.outstanding, self.outstanding_log = message
+    self._Post()
+
+  def _Post(self):
+    """Send self.outstanding to the ACS."""
     headers = {}
     if self.session.cookies:
       headers['Cookie'] = self.session.cookies.output(attrs=[],
@@ -429,31 +575,66 @@ class CPEStateMachine(object):
     self._acs_config.AcsAccessAttempt(self.session.acs_url)
     print 'CPE POST (at %s):' % time.ctime()
     print 'ACS URL: %s\n' % self.session.acs_url
-    print self.cwmplogger.LogSoapXML(self.outstanding)
-
+    print self.cwmplogger.LogSoapXML(self.outstanding, self.outstanding_log)
+
+    body = self.outstanding
+    self.outstanding_compressed = self._ShouldCompress(body)
+    if self.outstanding_compressed:
+      headers['Content-Encoding'] = 'gzip'
+      body = Gzip(body)
+    self.bytes_sent += len(body)
+    self.session.bytes_out += len(body)
+    self.bytes_sent_uncompressed += len(self.outstanding)
     req = tornado.httpclient.HTTPRequest(
         url=self.session.qualified_acs_url, method='POST', headers=headers,
-        body=self.outstanding, follow_redirects=True, max_redirects=5,
+        body=body, follow_redirects=True, max_redirects=5,
         request_timeout=30.0, use_gzip=True, allow_ipv6=True,
+        prepare_curl_callback=self.acs_pool.PrepareCurl,
         **self.fetch_args)
+    self.connects_at_post = self.acs_pool.connects.count
     self.session.http.fetch(req, self.GotResponse)
 
+  def _ShouldCompress(self, body):
+    """Whether to send body to the ACS with Content-Encoding: gzip."""
+    ms = self.cpe_management_server
+    return bool(body and ms.X_CATAWAMPUS_ORG_CompressRequests and
+                len(body) >= ms.X_CATAWAMPUS_ORG_CompressRequestsMinSize and
+                not self.session.gzip_rejected)
+
   def GotResponse(self, response):
     """Callback function invoked with the response an HTTP query to the ACS."""
+    outstanding = self.outstanding
     self.outstanding = None
+    self.acs_pool.Posted(self.connects_at_post, response.request_time)
     print 'CPE RECEIVED (at %s):' % time.ctime()
     print 'Effective URL was: %r' % response.effective_url
     if not self.session:
       print 'Session terminated, ignoring ACS message.'
       return
+    self.session.round_trips += 1
+    self.session.bytes_in += len(response.body or '')
+    if self.session.warmup and self.session.round_trips > 1:
+      # Past the InformResponse; the ACS wants something now.
+      self.session.warmup.Stop()
+    if self.outstanding_compressed and GzipRejected(response):
+      # The ACS doesn't understand Content-Encoding: gzip.  Send the same
+      # message again, uncompressed, for the rest of this session.
+      print 'HTTP ERROR %d for gzip request, resending uncompressed.' % (
+          response.code)
+      self.session.gzip_rejected = True
+      self.outstanding = outstanding
+      self._Post()
+      return
     if not response.error:
       self.last_success_response = time.ctime()
-      print self.cwmplogger.LogSoapXML(response.body)
+      # If the log needed a parse, Handle() can start from that one.
+      log, root = self.cwmplogger.LogRequest(response.body)
+      print log
       self.cpe_management_server.SuccessfulSession()
       for cookie in response.headers.get_list('Set-Cookie'):
         self.session.cookies.load(cookie)
       if response.body:
-        out = self.cpe_soap.Handle(response.body)
+        out = self.cpe_soap.Respond(response.body, root=root)
         if out is not None:
           self.SendResponse(out)
         # TODO(dgentry): $SPEC3 3.7.1.6 ACS Fault 8005 == retry same request
@@ -463,6 +644,7 @@ class CPEStateMachine(object):
         url = response.effective_url
         print 'Redirecting to %s for remainder of CWMP session' % url
         self.session.qualified_acs_url = self.session.acs_url = url
+        self.session.gzip_rejected = False
     else:
       print 'HTTP ERROR {0!s}: {1}'.format(response.code, response.error)
       self._ScheduleRetrySession()
@@ -487,8 +669,9 @@ class CPEStateMachine(object):
         datetime.timedelta(seconds=wait), self._SessionWaitTimer)
 
   def _CwmpSession(self):
-    s = session.CwmpSession(acs_url=self.cpe_management_server.URL,
-                            ioloop=self.ioloop)
+    url = self.cpe_management_server.URL
+    s = session.CwmpSession(acs_url=url, ioloop=self.ioloop,
+                            http=self.acs_pool.Client(url))
     s.qualified_acs_url = s.acs_url and AddQueryParams(
         s.acs_url,
         self.cpe_management_server.WantACSAutoprovisioning())
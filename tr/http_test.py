@@ -26,6 +26,7 @@ __author__ = 'dgentry@google.com (Denton Gentry)'
 import epoll_fix  # pylint:disable=unused-import
 
 import datetime
+import io
 import os
 import shutil
 import sys
@@ -33,6 +34,7 @@ import tempfile
 import time
 from wvtest import unittest
 import xml.etree.cElementTree as ET
+import zlib
 
 import google3
 
@@ -45,8 +47,10 @@ import tornado.util
 import tornado.web
 
 import api
+import api_soap
 import cpe_management_server
 import cwmpdate
+import cwmplog
 import garbage
 import handle
 import http
@@ -390,6 +394,127 @@ class HttpTest(tornado.testing.AsyncHTTPTestCase, unittest.TestCase):
 
     self.assertEqual(len(self.requestlog), 0)
 
+  def testGzipRequests(self):
+    SetMonotime(self.advanceTime)
+    cpe_machine = self.getCpe()
+    ms = cpe_machine.cpe_management_server
+    ms.X_CATAWAMPUS_ORG_CompressRequests = True
+    ms.X_CATAWAMPUS_ORG_CompressRequestsMinSize = 100
+    cpe_machine.Startup()
+
+    h = self.NextHandler()
+    self.assertEqual(h.request.headers.get('Content-Encoding'), 'gzip')
+    sent = len(h.request.body)
+    body = zlib.decompress(h.request.body, 16 + zlib.MAX_WBITS)
+    root = ET.fromstring(body)
+    self.assertTrue(root.find(SOAPNS + 'Body/' + CWMPNS + 'Inform') is not None)
+    self.assertLess(sent * 2, len(body))
+    self.assertEqual(cpe_machine.bytes_sent, sent)
+    self.assertEqual(cpe_machine.bytes_sent_uncompressed, len(body))
+
+    # An ACS which doesn't understand gzip gets the same message, uncompressed
+    h.send_error(415)
+    h = self.NextHandler()
+    self.assertFalse('Content-Encoding' in h.request.headers)
+    self.assertEqual(h.request.body, body)
+    self.assertEqual(cpe_machine.bytes_sent, sent + len(body))
+    self.assertTrue(cpe_machine.session.gzip_rejected)
+    h.finish()
+    self.wait()
+
+  def testGzipRequestsBadRequest(self):
+    SetMonotime(self.advanceTime)
+    cpe_machine = self.getCpe()
+    ms = cpe_machine.cpe_management_server
+    ms.X_CATAWAMPUS_ORG_CompressRequests = True
+    ms.X_CATAWAMPUS_ORG_CompressRequestsMinSize = 100
+    cpe_machine.Startup()
+
+    # A 400 which blames the Content-Encoding gets it resent uncompressed.
+    # (Any other 400 is an ordinary failure; see testGzipRejected.)
+    h = self.NextHandler()
+    self.assertEqual(h.request.headers.get('Content-Encoding'), 'gzip')
+    h.set_status(400)
+    h.finish('Content-Encoding: gzip is not supported')
+    h = self.NextHandler()
+    self.assertFalse('Content-Encoding' in h.request.headers)
+    self.assertTrue(cpe_machine.session.gzip_rejected)
+    h.finish()
+    self.wait()
+
+  def testMessage(self):
+    req = api_soap.Encode().GetRPCMethods()
+    data, log = http._Message(req)
+    self.assertEqual(str(req), data)
+    self.assertEqual(cwmplog.Logger(full_logs=0).LogTerse(data), log)
+    self.assertEqual(('<raw />', None), http._Message('<raw />'))
+
+  def testGzipRejected(self):
+    def Response(code, body=None):
+      return tornado.httpclient.HTTPResponse(
+          tornado.httpclient.HTTPRequest('http://example.com/'), code,
+          buffer=body and io.BytesIO(body))
+    self.assertTrue(http.GzipRejected(Response(415)))
+    self.assertFalse(http.GzipRejected(Response(400)))
+    self.assertFalse(http.GzipRejected(Response(400, '<Fault/>')))
+    self.assertTrue(http.GzipRejected(Response(400, 'Bad Content-Encoding')))
+    self.assertFalse(http.GzipRejected(Response(500, 'gzip')))
+
+  def testGzipRequestsTooSmall(self):
+    SetMonotime(self.advanceTime)
+    cpe_machine = self.getCpe()
+    ms = cpe_machine.cpe_management_server
+    ms.X_CATAWAMPUS_ORG_CompressRequests = True
+    ms.X_CATAWAMPUS_ORG_CompressRequestsMinSize = 1000000
+    cpe_machine.Startup()
+
+    h = self.NextHandler()
+    self.assertFalse('Content-Encoding' in h.request.headers)
+    self.assertTrue(ET.fromstring(h.request.body) is not None)
+    self.assertEqual(cpe_machine.bytes_sent, len(h.request.body))
+    h.finish()
+    self.wait()
+
+  def testConnectionReuse(self):
+    SetMonotime(self.advanceTime)
+    cpe_machine = self.getCpe()
+    pool = cpe_machine.acs_pool
+    msg = ('<soapenv:Envelope '
+           'xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/" '
+           'xmlns:cwmp="urn:dslforum-org:cwmp-1-2">'
+           '<soapenv:Header><cwmp:ID soapenv:mustUnderstand="1">cwmpID'
+           '</cwmp:ID></soapenv:Header><soapenv:Body><cwmp:InformResponse>'
+           '<MaxEnvelopes>1</MaxEnvelopes></cwmp:InformResponse>'
+           '</soapenv:Body></soapenv:Envelope>')
+    for i in range(2):
+      if i == 0:
+        cpe_machine.Startup()
+      else:
+        cpe_machine.NewPeriodicSession()
+      h = self.NextHandler()
+      self.assertTrue('Inform>' in h.request.body)
+      h.write(msg)
+      h.finish()
+      self.wait()
+      h = self.NextHandler()
+      self.assertEqual(h.request.body, '')  # end of CWMP session
+      h.finish()
+      self.wait()
+      self.assertEqual(cpe_machine.session, None)
+      client = pool.client
+
+    # Both CWMP sessions used the same connection.
+    self.assertEqual(client, pool.client)
+    self.assertEqual(pool.posts, 4)
+    self.assertEqual(pool.connects.count, 1)
+    self.assertEqual(pool.handshakes_avoided, 3)
+    self.assertTrue('3 handshakes avoided' in str(pool))
+
+    # A different ACS gets a new client.
+    pool.Client('https://127.0.0.1:%d/cwmp' % self.get_http_port())
+    self.assertNotEqual(client, pool.client)
+    pool.Close()
+
   def testLookupDevIP6(self):
     http.PROC_IF_INET6 = 'testdata/http/if_inet6'
     http.GETWANPORT = 'testdata/http/getwanport_eth0'
@@ -0,0 +1,184 @@
+#!/usr/bin/python
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Latency statistics for RPCs, parameter getters and ACS sessions.
+
+Nothing is collected unless Enable is set (it is exported as
+Device.X_CATAWAMPUS-ORG.Catawampus.Latency.Enable).  The callers check
+it before doing any timing, so when it is off all this costs is one
+global lookup per RPC or parameter.
+"""
+
+import bisect
+import threading
+import monohelper
+
+
+# pylint:disable=g-bad-name
+Enable = False
+
+# Upper bounds of the histogram buckets, in seconds.  Anything slower than
+# the last one is counted in one more bucket at the end.
+BUCKETS = (0.001, 0.003, 0.01, 0.03, 0.1, 0.3, 1.0, 3.0, 10.0)
+
+# Only one in this many parameter gets is timed.
+PARAM_SAMPLE_INTERVAL = 16
+
+# Each new sample moves a parameter's average this fraction of the way
+# towards it, so older samples decay away exponentially.
+PARAM_DECAY = 0.25
+
+# When more parameters than this have been sampled, the fastest half are
+# forgotten.
+MAX_PARAMS = 1024
+
+
+def _BucketName(i):
+  if i < len(BUCKETS):
+    return '<%gms' % (BUCKETS[i] * 1000)
+  return '>%gms' % (BUCKETS[-1] * 1000)
+
+
+class Histogram(object):
+  """Counts of durations, in buckets of roughly 3x each."""
+
+  def __init__(self):
+    self.Reset()
+
+  def Reset(self):
+    self.count = 0
+    self.total = 0.0
+    self.buckets = [0] * (len(BUCKETS) + 1)
+
+  def Add(self, seconds):
+    self.count += 1
+    self.total += seconds
+    self.buckets[bisect.bisect_left(BUCKETS, seconds)] += 1
+
+  def __str__(self):
+    avg = self.total / self.count if self.count else 0.0
+    counts = ' '.join('%s:%d' % (_BucketName(i), n)
+                      for i, n in enumerate(self.buckets) if n)
+    return 'count=%d avg=%.6fs %s' % (self.count, avg, counts)
+
+
+class RpcLatency(object):
+  """A Histogram for each RPC method."""
+
+  def __init__(self):
+    self.methods = {}
+
+  def Reset(self):
+    self.methods = {}
+
+  def Add(self, method, seconds):
+    h = self.methods.get(method)
+    if h is None:
+      h = self.methods[method] = Histogram()
+    h.Add(seconds)
+
+  def __str__(self):
+    return ''.join('%s: %s\n' % (method, self.methods[method])
+                   for method in sorted(self.methods))
+
+
+class ParameterLatency(object):
+  """Decaying average time taken by a sample of parameter getters.
+
+  Get() can be called from several threads at once (see api.CPE.gpv_threads).
+  """
+
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.Reset()
+
+  def Reset(self):
+    self.averages = {}
+    self.countdown = PARAM_SAMPLE_INTERVAL
+
+  def Get(self, name, getter, *args):
+    """Returns getter(*args), timing it if it's time for another sample."""
+    with self.lock:
+      self.countdown -= 1
+      sample = self.countdown <= 0
+      if sample:
+        self.countdown = PARAM_SAMPLE_INTERVAL
+    if not sample:
+      return getter(*args)
+    start = monohelper.monotime()
+    try:
+      return getter(*args)
+    finally:
+      self.Add(name, monohelper.monotime() - start)
+
+  def Add(self, name, seconds):
+    with self.lock:
+      old = self.averages.get(name)
+      if old is not None:
+        seconds = old + PARAM_DECAY * (seconds - old)
+      self.averages[name] = seconds
+      if len(self.averages) > MAX_PARAMS:
+        self.averages = dict(self._Slowest(MAX_PARAMS / 2))
+
+  def Slowest(self, n):
+    """Returns the n slowest [(name, average seconds)], slowest first."""
+    with self.lock:
+      return self._Slowest(n)
+
+  def _Slowest(self, n):
+    return sorted(self.averages.items(), key=lambda x: x[1], reverse=True)[:n]
+
+  def __str__(self):
+    return ''.join('%s: %.6fs\n' % (name, avg)
+                   for name, avg in self.Slowest(40))
+
+
+class SessionTotals(object):
+  """Wall time, bytes and round trips of completed ACS sessions."""
+
+  def __init__(self):
+    self.Reset()
+
+  def Reset(self):
+    self.wall = Histogram()
+    self.bytes_in = 0
+    self.bytes_out = 0
+    self.round_trips = 0
+    self.last = ''
+
+  def Add(self, seconds, bytes_in, bytes_out, round_trips):
+    self.wall.Add(seconds)
+    self.bytes_in += bytes_in
+    self.bytes_out += bytes_out
+    self.round_trips += round_trips
+    self.last = ('%.3fs, %d bytes in, %d bytes out, %d round trips' %
+                 (seconds, bytes_in, bytes_out, round_trips))
+
+  def __str__(self):
+    return ('sessions: %s\n'
+            'total: %d bytes in, %d bytes out, %d round trips\n'
+            'last: %s\n' % (self.wall, self.bytes_in, self.bytes_out,
+                            self.round_trips, self.last))
+
+
+def Reset():
+  rpcs.Reset()
+  parameters.Reset()
+  sessions.Reset()
+
+
+rpcs = RpcLatency()
+parameters = ParameterLatency()
+sessions = SessionTotals()
@@ -0,0 +1,90 @@
+#!/usr/bin/python
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# unittest requires method names starting in 'test'
+# pylint:disable=invalid-name
+
+"""Unit tests for latency.py."""
+
+import google3
+import latency
+from wvtest import unittest
+
+
+class LatencyTest(unittest.TestCase):
+
+  def tearDown(self):
+    latency.Reset()
+
+  def testHistogram(self):
+    h = latency.Histogram()
+    self.assertEqual('count=0 avg=0.000000s ', str(h))
+    h.Add(0.0005)
+    h.Add(0.002)
+    h.Add(0.0025)
+    h.Add(60)
+    self.assertEqual(4, h.count)
+    self.assertEqual([1, 2, 0, 0, 0, 0, 0, 0, 0, 1], h.buckets)
+    self.assertEqual('count=4 avg=15.001250s <1ms:1 <3ms:2 >10000ms:1',
+                     str(h))
+
+  def testRpcs(self):
+    latency.rpcs.Add('GetParameterValues', 0.05)
+    latency.rpcs.Add('GetParameterValues', 0.02)
+    latency.rpcs.Add('Download', 0.5)
+    self.assertEqual('Download: count=1 avg=0.500000s <1000ms:1\n'
+                     'GetParameterValues: count=2 avg=0.035000s '
+                     '<30ms:1 <100ms:1\n', str(latency.rpcs))
+
+  def testParametersSampled(self):
+    p = latency.ParameterLatency()
+    calls = []
+    for i in xrange(latency.PARAM_SAMPLE_INTERVAL * 3):
+      self.assertEqual(i, p.Get('Device.Foo', lambda x: calls.append(x) or x,
+                                i))
+    self.assertEqual(latency.PARAM_SAMPLE_INTERVAL * 3, len(calls))
+    self.assertEqual(['Device.Foo'], p.averages.keys())
+
+  def testParametersDecay(self):
+    p = latency.ParameterLatency()
+    p.Add('Device.Foo', 1.0)
+    p.Add('Device.Bar', 0.5)
+    self.assertEqual([('Device.Foo', 1.0), ('Device.Bar', 0.5)],
+                     p.Slowest(2))
+    for _ in xrange(10):
+      p.Add('Device.Foo', 0.0)
+    self.assertEqual('Device.Bar', p.Slowest(1)[0][0])
+    self.assertTrue(p.averages['Device.Foo'] < 0.1)
+
+  def testParametersBounded(self):
+    p = latency.ParameterLatency()
+    for i in xrange(latency.MAX_PARAMS + 1):
+      p.Add('Device.P%d' % i, float(i))
+    self.assertEqual(latency.MAX_PARAMS / 2, len(p.averages))
+    self.assertTrue('Device.P%d' % latency.MAX_PARAMS in p.averages)
+    self.assertFalse('Device.P0' in p.averages)
+
+  def testSessions(self):
+    latency.sessions.Add(1.5, 1000, 2000, 4)
+    latency.sessions.Add(0.5, 10, 20, 2)
+    self.assertEqual(2, latency.sessions.wall.count)
+    self.assertEqual('sessions: count=2 avg=1.000000s <1000ms:1 <3000ms:1\n'
+                     'total: 1010 bytes in, 2020 bytes out, 6 round trips\n'
+                     'last: 0.500s, 10 bytes in, 20 bytes out, '
+                     '2 round trips\n', str(latency.sessions))
+
+
+if __name__ == '__main__':
+  unittest.main()
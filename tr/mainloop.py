@@ -23,20 +23,56 @@ so on.
 __author__ = 'apenwarr@google.com (Avery Pennarun)'
 
 
+import collections
 import datetime
 import errno
 import fcntl
 import logging
 import os
+import select
 import socket
+import subprocess
 import sys
+import thread
+import threading
 import traceback
 import google3
 import helpers
+import monohelper
 import tornado.ioloop
 import tornado.iostream
 
 
+# RunCommand runs at most this many subprocesses at once; the rest wait
+# for a turn.
+MAX_COMMANDS = 4
+
+# Seconds a RunCommand subprocess may run before it is killed.
+COMMAND_TIMEOUT = 30
+
+_running_commands = set()
+_waiting_commands = collections.deque()
+# Held while using the Command queues or a Command's state, since Wait()
+# can be called from GetParameterValues threads.  The ioloop itself is only
+# used from its own thread while it runs (see _OnIOLoopThread); other
+# threads hand those calls to it with add_callback.
+_command_lock = threading.RLock()
+# {tuple(argv): _LatestOutput}, for LatestOutput()
+_latest_outputs = {}
+
+
+def _OnIOLoopThread(ioloop):
+  """True if this thread may add and remove ioloop handlers and timeouts."""
+  # pylint:disable=protected-access
+  return not ioloop.running() or ioloop._thread_ident == thread.get_ident()
+
+
+def _InIOLoop(ioloop):
+  """True if this is the ioloop's thread, and the ioloop is running."""
+  # pylint:disable=protected-access
+  return ioloop.running() and ioloop._thread_ident == thread.get_ident()
+
+
 def _CloseOnExec(fd, enabled):
   flag = fcntl.fcntl(fd, fcntl.F_GETFD) & ~fcntl.FD_CLOEXEC
   if enabled:
@@ -366,6 +402,312 @@ def WaitUntilIdle(func):
   return ScheduleIt
 
 
+class Command(object):
+  """A subprocess started by RunCommand.
+
+  Once it has finished, done is True, and returncode, out and err are set
+  like subprocess.Popen.returncode and the output of communicate().  If it
+  ran for longer than its timeout it was killed, and timed_out is True.
+
+  Wait() and Kill() may be called from any thread.
+  """
+
+  def __init__(self, argv, callback, timeout):
+    self.argv = argv
+    self.callback = callback
+    self.timeout = timeout
+    self.ioloop = tornado.ioloop.IOLoop.instance()
+    self.proc = None
+    self.error = None  # the OSError, if it couldn't be started
+    self.returncode = None
+    self.out = ''
+    self.err = ''
+    self.timed_out = False
+    self.done = False
+    self.finish_time = None  # monohelper.monotime() when it finished
+    self._bufs = {}  # fd: [data read from it so far]
+    self._open = set()  # fds which haven't reached EOF yet
+    self._handlers = set()  # fds the ioloop is watching
+    self._deadline = None
+    self._tmo = None
+
+  def __repr__(self):
+    return 'Command(%r)' % (self.argv,)
+
+  def _Start(self):
+    """Start the subprocess.  Call with _command_lock held.
+
+    On the ioloop's thread, the ioloop watches its output.  Anywhere else,
+    only Wait() reads it.
+    """
+    _running_commands.add(self)
+    self._deadline = monohelper.monotime() + self.timeout
+    try:
+      self.proc = subprocess.Popen(self.argv, stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE, close_fds=True)
+    except OSError as e:
+      self.error = e
+      self._Finish()
+      return
+    watch = _OnIOLoopThread(self.ioloop)
+    for f in (self.proc.stdout, self.proc.stderr):
+      fd = f.fileno()
+      flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+      fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+      self._bufs[fd] = []
+      self._open.add(fd)
+      if watch:
+        self.ioloop.add_handler(fd, self._Ready, self.ioloop.READ)
+        self._handlers.add(fd)
+    if watch:
+      self._tmo = self.ioloop.add_timeout(
+          datetime.timedelta(seconds=self.timeout), self._IOLoopTimedOut)
+
+  def _Read(self, fd):
+    try:
+      data = os.read(fd, 65536)
+    except OSError as e:
+      if e.errno in (errno.EAGAIN, errno.EINTR):
+        return
+      data = ''
+    if data:
+      self._bufs[fd].append(data)
+    else:
+      self._open.discard(fd)
+      if _OnIOLoopThread(self.ioloop):
+        self._Unwatch(fd)
+      # Otherwise _Ready() or _Release() does that, from the ioloop.
+
+  def _Unwatch(self, fd):
+    if fd in self._handlers:
+      self._handlers.discard(fd)
+      self.ioloop.remove_handler(fd)
+
+  def _Ready(self, fd, events):  # pylint:disable=unused-argument
+    with _command_lock:
+      if fd not in self._open:
+        self._Unwatch(fd)  # Wait() read it to EOF, on another thread
+        return
+      self._Read(fd)
+      if not self._open:
+        self._Reap()
+
+  def _Reap(self):
+    with _command_lock:
+      if self.done:
+        return
+      if self.proc.poll() is None:
+        # It closed its output but hasn't exited yet.
+        self.ioloop.add_timeout(datetime.timedelta(seconds=0.01), self._Reap)
+        return
+      self._Finish()
+
+  def _IOLoopTimedOut(self):
+    with _command_lock:
+      self._tmo = None
+      self._TimedOut()
+
+  def _TimedOut(self):
+    if not self.done and not self.timed_out:
+      print 'Command %r timed out after %gs' % (self.argv, self.timeout)
+      self.timed_out = True
+      self.Kill()
+
+  def _Finish(self):
+    if self.proc:
+      self.returncode = self.proc.returncode
+      self.out = ''.join(self._bufs[self.proc.stdout.fileno()])
+      self.err = ''.join(self._bufs[self.proc.stderr.fileno()])
+      self._bufs = {}
+    self.done = True
+    self.finish_time = monohelper.monotime()
+    self._Release()
+    _running_commands.discard(self)
+    _StartCommands()
+    callback, self.callback = self.callback, None
+    if callback:
+      self.ioloop.add_callback(lambda: callback(self))
+
+  def _Release(self):
+    """Stop the ioloop watching the pipes, and close them."""
+    with _command_lock:
+      if ((self._handlers or self._tmo) and
+          not _OnIOLoopThread(self.ioloop)):
+        # The pipes stay open until then, so the ioloop can't be left
+        # watching a reused fd.
+        self.ioloop.add_callback(self._Release)
+        return
+      for fd in list(self._handlers):
+        self._Unwatch(fd)
+      if self._tmo:
+        self.ioloop.remove_timeout(self._tmo)
+        self._tmo = None
+      if self.proc:
+        self.proc.stdout.close()
+        self.proc.stderr.close()
+
+  def Kill(self):
+    """Kill the subprocess, or stop it from starting if it hasn't yet."""
+    with _command_lock:
+      if self.done:
+        return
+      if not self.proc:
+        _waiting_commands.remove(self)
+        self._Finish()
+      elif self.proc.returncode is None:
+        try:
+          self.proc.kill()
+        except OSError:
+          pass  # it already exited
+        # _Reap() or Wait() finishes up once its pipes close.
+
+  def Wait(self):
+    """Blocks until the subprocess finishes, and returns its returncode.
+
+    This is for callers that can't wait for a callback, like parameter
+    getters on GetParameterValues threads.  If it hasn't started yet it
+    starts now, regardless of MAX_COMMANDS.  The timeout still applies.
+    It reads the output itself, so it doesn't need the ioloop to be free;
+    but called from the ioloop's thread it stops everything else until
+    the subprocess exits.  Getters should use LatestOutput() instead.
+
+    Returns:
+      The returncode, like subprocess.Popen.wait().
+    Raises:
+      OSError: if the subprocess couldn't be started.
+    """
+    with _command_lock:
+      if not self.done and not self.proc:
+        _waiting_commands.remove(self)
+        self._Start()
+    while not self.done:
+      with _command_lock:
+        fds = list(self._open)
+        wait = 1.0
+        if fds and not self.timed_out:
+          remaining = self._deadline - monohelper.monotime()
+          if remaining <= 0:
+            self._TimedOut()
+            continue
+          wait = min(wait, remaining)
+      r = []
+      if fds:
+        try:
+          # Bounded, in case another thread finishes it and closes the fds.
+          r, _, _ = select.select(fds, [], [], wait)
+        except (select.error, ValueError):
+          continue
+      with _command_lock:
+        if self.done:
+          break
+        if not fds:
+          self.proc.wait()
+          self._Finish()
+          continue
+        for fd in r:
+          if fd in self._open:
+            self._Read(fd)
+    if self.error:
+      raise self.error
+    return self.returncode
+
+
+def _StartCommands():
+  """Start waiting Commands, up to MAX_COMMANDS.
+
+  They are started from the ioloop's thread, so that it watches them.
+  """
+  ioloop = tornado.ioloop.IOLoop.instance()
+  if not _OnIOLoopThread(ioloop):
+    ioloop.add_callback(_StartCommands)
+    return
+  with _command_lock:
+    while _waiting_commands and len(_running_commands) < MAX_COMMANDS:
+      _waiting_commands.popleft()._Start()  # pylint:disable=protected-access
+
+
+def RunCommand(argv, callback=None, timeout=COMMAND_TIMEOUT):
+  """Run a subprocess without blocking the ioloop.
+
+  At most MAX_COMMANDS subprocesses run at once; any more wait their turn.
+  Their stdout and stderr are collected through non-blocking pipes, and
+  they are killed if they take longer than timeout seconds.  It can be
+  called from any thread.
+
+  Synchronous code can call Wait() on the returned Command, though on
+  the ioloop's thread that blocks the ioloop after all.  Parameter getters
+  should use LatestOutput() instead.
+
+  Args:
+    argv: the command line, as for subprocess.Popen.
+    callback: called with the Command, from the ioloop, once it finishes.
+    timeout: seconds after it starts before it is killed.
+  Returns:
+    A Command.
+  """
+  cmd = Command(argv, callback, timeout)
+  with _command_lock:
+    _waiting_commands.append(cmd)
+  _StartCommands()
+  return cmd
+
+
+class _LatestOutput(object):
+  """Output of the last successful run of a command.  See LatestOutput."""
+
+  def __init__(self):
+    self.cmd = None  # the run in progress, if any
+    self.out = None
+    self.expires = 0  # monohelper.monotime() when out needs refreshing
+
+  def Update(self, max_age):
+    """Take the output of self.cmd if it has finished.  Hold the lock."""
+    cmd = self.cmd
+    if cmd is not None and cmd.done:
+      self.cmd = None
+      if not cmd.error and not cmd.timed_out:
+        self.out = cmd.out
+        self.expires = cmd.finish_time + max_age
+
+
+def LatestOutput(argv, max_age, timeout=COMMAND_TIMEOUT):
+  """Returns the stdout of argv, run no more than max_age seconds ago.
+
+  This is for parameter getters.  On the ioloop's thread, while it runs,
+  it never waits: if the output is too old it starts argv again (with
+  RunCommand), and meanwhile returns the output of the last run which
+  finished, or '' if none has.  Anywhere else (GetParameterValues
+  threads, or before the ioloop starts) it waits for the new run.
+
+  Runs which couldn't start or timed out don't count: the last good
+  output is kept, and the next call tries again.
+
+  Args:
+    argv: the command line, as for subprocess.Popen.
+    max_age: seconds the output of a run stays good for.
+    timeout: seconds after it starts before a run is killed.
+  Returns:
+    The output, as a string.
+  """
+  key = tuple(argv)
+  with _command_lock:
+    latest = _latest_outputs.get(key)
+    if latest is None:
+      latest = _latest_outputs[key] = _LatestOutput()
+    latest.Update(max_age)
+    if latest.cmd is None and monohelper.monotime() >= latest.expires:
+      latest.cmd = RunCommand(argv, timeout=timeout)
+    cmd = latest.cmd
+  if cmd is not None and not _InIOLoop(cmd.ioloop):
+    try:
+      cmd.Wait()
+    except OSError:
+      pass  # like a timeout; we keep the last output we had
+    with _command_lock:
+      latest.Update(max_age)
+  return latest.out or ''
+
+
 def _TestGotLine(line):
   print 'got line: %r' % line
   return 'response\r\n'
@@ -17,9 +17,11 @@
 
 __author__ = 'apenwarr@google.com (Avery Pennarun)'
 
+import datetime
 import os
 import select
 import socket
+import threading
 from wvtest import unittest
 import weakref
 
@@ -188,6 +190,134 @@ class MainLoopTest(unittest.TestCase):
     loop.RunOnce()
     self.assertEquals(count[0], 2)
 
+  def testRunCommand(self):
+    loop = mainloop.MainLoop()
+    done = []
+
+    def Callback(cmd):
+      done.append(cmd)
+      loop.ioloop.stop()
+    cmd = mainloop.RunCommand(['sh', '-c', 'echo out; echo err >&2; exit 3'],
+                              callback=Callback)
+    self.assertFalse(cmd.done)
+    loop.Start(timeout=10)
+    self.assertEquals(done, [cmd])
+    self.assertEquals(cmd.returncode, 3)
+    self.assertEquals(cmd.out, 'out\n')
+    self.assertEquals(cmd.err, 'err\n')
+    self.assertFalse(cmd.timed_out)
+
+  def testRunCommandLimit(self):
+    loop = mainloop.MainLoop()
+    old_max = mainloop.MAX_COMMANDS
+    mainloop.MAX_COMMANDS = 2
+    done = []
+
+    def Callback(cmd):
+      done.append(cmd)
+      if len(done) == 4:
+        loop.ioloop.stop()
+    try:
+      cmds = [mainloop.RunCommand(['echo', str(i)], callback=Callback)
+              for i in range(4)]
+      self.assertEquals([bool(c.proc) for c in cmds],
+                        [True, True, False, False])
+      loop.Start(timeout=10)
+    finally:
+      mainloop.MAX_COMMANDS = old_max
+    self.assertEquals(sorted(c.out for c in done),
+                      ['0\n', '1\n', '2\n', '3\n'])
+    self.assertEquals(mainloop._running_commands, set())
+
+  def testRunCommandTimeout(self):
+    loop = mainloop.MainLoop()
+    done = []
+
+    def Callback(cmd):
+      done.append(cmd)
+      loop.ioloop.stop()
+    cmd = mainloop.RunCommand(['sleep', '10'], callback=Callback, timeout=0.1)
+    loop.Start(timeout=10)
+    self.assertEquals(done, [cmd])
+    self.assertTrue(cmd.timed_out)
+    self.assertEquals(cmd.returncode, -9)
+
+  def testRunCommandWait(self):
+    loop = mainloop.MainLoop()
+    cmd = mainloop.RunCommand(['echo', 'hello'])
+    self.assertEquals(cmd.Wait(), 0)
+    self.assertEquals(cmd.out, 'hello\n')
+    self.assertEquals(cmd.Wait(), 0)
+    cmd = mainloop.RunCommand(['sleep', '10'], timeout=0.1)
+    self.assertEquals(cmd.Wait(), -9)
+    self.assertTrue(cmd.timed_out)
+    cmd = mainloop.RunCommand(['/nonexistent/command'])
+    self.assertRaises(OSError, cmd.Wait)
+    loop.RunOnce()
+
+  def testRunCommandThread(self):
+    loop = mainloop.MainLoop()
+    results = []
+    cmds = []
+
+    def Worker(cmd, done):
+      results.append(cmd.Wait())
+      results.append(cmd.out)
+      cmd = mainloop.RunCommand(['sleep', '10'], timeout=0.1)
+      results.append(cmd.Wait())
+      done.set()
+
+    def Busy():
+      # Started and watched by the ioloop, then waited for from another
+      # thread while the ioloop is stuck, like during a parallel GPV.
+      cmd = mainloop.RunCommand(['echo', 'hello'])
+      cmds.append(cmd)
+      done = threading.Event()
+      t = threading.Thread(target=Worker, args=(cmd, done))
+      t.daemon = True
+      t.start()
+      done.wait(10)
+      loop.ioloop.stop()
+    loop.ioloop.add_callback(Busy)
+    loop.Start(timeout=10)
+    self.assertEquals(results, [0, 'hello\n', -9])
+    self.assertEquals(mainloop._running_commands, set())
+    # The ioloop stops watching its pipes, and then they're closed.
+    loop.RunOnce()
+    self.assertTrue(cmds[0].proc.stdout.closed)
+
+  def testLatestOutput(self):
+    loop = mainloop.MainLoop()
+    pid = ['sh', '-c', 'echo $$']
+    out = mainloop.LatestOutput(pid, max_age=60)
+    self.assertTrue(out)
+    self.assertEquals(out, mainloop.LatestOutput(pid, max_age=60))
+    self.assertNotEqual(out, mainloop.LatestOutput(pid + ['x'], max_age=60))
+    # Failures and timeouts aren't kept; the next call tries again.
+    self.assertEquals('', mainloop.LatestOutput(['/nonexistent'], max_age=60))
+    slow = ['sh', '-c', 'echo slow; sleep 10']
+    self.assertEquals('', mainloop.LatestOutput(slow, max_age=60, timeout=0.1))
+    self.assertEquals('', mainloop.LatestOutput(slow, max_age=60, timeout=0.1))
+    loop.RunOnce()
+
+  def testLatestOutputIOLoop(self):
+    loop = mainloop.MainLoop()
+    argv = ['echo', 'ioloop']
+    results = []
+
+    def Get():
+      # On the ioloop, it never waits for the command.
+      results.append(mainloop.LatestOutput(argv, max_age=60))
+      if results[-1] or len(results) > 500:
+        loop.ioloop.stop()
+      else:
+        loop.ioloop.add_timeout(datetime.timedelta(seconds=0.01), Get)
+    loop.ioloop.add_callback(Get)
+    loop.Start(timeout=10)
+    Get = None  # it refers to itself
+    self.assertEquals('', results[0])
+    self.assertEquals('ioloop\n', results[-1])
+
 
 if __name__ == '__main__':
   unittest.main()
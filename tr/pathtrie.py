@@ -0,0 +1,184 @@
+#!/usr/bin/python
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A dict-like container keyed on dot-separated parameter paths.
+
+Keys look like tr-069 names: 'Device.Hosts.Host.1.IPAddress' for a
+parameter, 'Device.Hosts.' for a partial path.  Internally they are stored
+in a tree with one node per path segment, so it is cheap to find the
+entries above a given name, or to remove all the entries below one.
+
+A partial path and the object name without its trailing dot
+('Device.Hosts.' and 'Device.Hosts') refer to the same entry.
+"""
+
+
+def _Segments(key):
+  if not key:
+    return []
+  if key.endswith('.'):
+    key = key[:-1]
+  return key.split('.')
+
+
+class _Node(object):
+  __slots__ = ('children', 'key', 'value')
+
+  def __init__(self):
+    self.children = {}
+    self.key = None  # None if this node has no value
+    self.value = None
+
+
+class PathTrie(object):
+  """A dict of parameter paths, which knows what's above and below what."""
+
+  def __init__(self):
+    self.root = _Node()
+    self.count = 0
+
+  def _Find(self, key):
+    node = self.root
+    for segment in _Segments(key):
+      node = node.children.get(segment)
+      if node is None:
+        return None
+    return node
+
+  def __len__(self):
+    return self.count
+
+  def __contains__(self, key):
+    node = self._Find(key)
+    return node is not None and node.key is not None
+
+  def __getitem__(self, key):
+    node = self._Find(key)
+    if node is None or node.key is None:
+      raise KeyError(key)
+    return node.value
+
+  def get(self, key, default=None):
+    node = self._Find(key)
+    if node is None or node.key is None:
+      return default
+    return node.value
+
+  def __setitem__(self, key, value):
+    node = self.root
+    for segment in _Segments(key):
+      child = node.children.get(segment)
+      if child is None:
+        child = node.children[segment] = _Node()
+      node = child
+    if node.key is None:
+      self.count += 1
+    node.key = key
+    node.value = value
+
+  def __delitem__(self, key):
+    path = [self.root]
+    segments = _Segments(key)
+    for segment in segments:
+      node = path[-1].children.get(segment)
+      if node is None:
+        raise KeyError(key)
+      path.append(node)
+    node = path[-1]
+    if node.key is None:
+      raise KeyError(key)
+    node.key = node.value = None
+    self.count -= 1
+    self._Prune(path, segments)
+
+  def _Prune(self, path, segments):
+    """Remove now-empty nodes from the end of path."""
+    for i in xrange(len(segments), 0, -1):
+      node = path[i]
+      if node.key is not None or node.children:
+        break
+      del path[i - 1].children[segments[i - 1]]
+
+  def __iter__(self):
+    return self.iterkeys()
+
+  def iterkeys(self):
+    for key, _ in self.iteritems():
+      yield key
+
+  def itervalues(self):
+    for _, value in self.iteritems():
+      yield value
+
+  def iteritems(self):
+    return self.IterSubtree('')
+
+  def keys(self):
+    return list(self.iterkeys())
+
+  def values(self):
+    return list(self.itervalues())
+
+  def items(self):
+    return list(self.iteritems())
+
+  def IterSubtree(self, key):
+    """Yield (key, value) for key and every entry below it."""
+    node = self._Find(key)
+    if node is None:
+      return
+    stack = [node]
+    while stack:
+      node = stack.pop()
+      if node.key is not None:
+        yield node.key, node.value
+      stack.extend(node.children.itervalues())
+
+  def Ancestors(self, key):
+    """Returns [(key, value)] for key and every entry above it, top first."""
+    out = []
+    node = self.root
+    if node.key is not None:
+      out.append((node.key, node.value))
+    for segment in _Segments(key):
+      node = node.children.get(segment)
+      if node is None:
+        break
+      if node.key is not None:
+        out.append((node.key, node.value))
+    return out
+
+  def DeleteSubtree(self, key):
+    """Remove key and every entry below it.
+
+    Args:
+      key: the path to remove.
+    Returns:
+      A list of the (key, value) pairs that were removed.
+    """
+    path = [self.root]
+    segments = _Segments(key)
+    for segment in segments:
+      node = path[-1].children.get(segment)
+      if node is None:
+        return []
+      path.append(node)
+    removed = list(self.IterSubtree(key))
+    self.count -= len(removed)
+    node = path[-1]
+    node.children = {}
+    node.key = node.value = None
+    self._Prune(path, segments)
+    return removed
@@ -0,0 +1,91 @@
+#!/usr/bin/python
+# Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# unittest requires method names starting in 'test'
+# pylint:disable=invalid-name
+
+"""Unit tests for pathtrie.py."""
+
+import google3
+import pathtrie
+from wvtest import unittest
+
+
+class PathTrieTest(unittest.TestCase):
+
+  def testDict(self):
+    t = pathtrie.PathTrie()
+    self.assertEqual(0, len(t))
+    self.assertFalse('A.B' in t)
+    t['A.B.C'] = 1
+    t['A.B.'] = 2
+    t['A.D'] = 3
+    self.assertEqual(3, len(t))
+    self.assertEqual(1, t['A.B.C'])
+    self.assertEqual(2, t['A.B.'])
+    self.assertEqual(2, t['A.B'])
+    self.assertFalse('A' in t)
+    self.assertEqual(None, t.get('A'))
+    self.assertRaises(KeyError, lambda: t['A'])
+    self.assertEqual(['A.B.', 'A.B.C', 'A.D'], sorted(t.keys()))
+    t['A.B.C'] = 4
+    self.assertEqual(3, len(t))
+    self.assertEqual(4, t['A.B.C'])
+    del t['A.B.']
+    self.assertEqual(2, len(t))
+    self.assertEqual(4, t['A.B.C'])
+    self.assertRaises(KeyError, t.__delitem__, 'A.B.')
+    self.assertRaises(KeyError, t.__delitem__, 'A.X.Y')
+    del t['A.B.C']
+    del t['A.D']
+    self.assertEqual(0, len(t))
+    self.assertEqual({}, t.root.children)
+
+  def testAncestors(self):
+    t = pathtrie.PathTrie()
+    t['A.'] = 1
+    t['A.B.C.'] = 2
+    t['A.B.C.D'] = 3
+    t['A.E'] = 4
+    self.assertEqual([('A.', 1), ('A.B.C.', 2), ('A.B.C.D', 3)],
+                     t.Ancestors('A.B.C.D'))
+    self.assertEqual([('A.', 1), ('A.B.C.', 2)], t.Ancestors('A.B.C.X.Y'))
+    self.assertEqual([('A.', 1)], t.Ancestors('A.B'))
+    self.assertEqual([], t.Ancestors('X.Y'))
+    t[''] = 0
+    self.assertEqual([('', 0), ('A.', 1), ('A.E', 4)], t.Ancestors('A.E.F'))
+
+  def testSubtree(self):
+    t = pathtrie.PathTrie()
+    for i in range(100):
+      t['Device.Hosts.Host.%d.IPAddress' % i] = i
+      t['Device.Hosts.Host.%d.' % i] = i
+    t['Device.Hosts.'] = 'all'
+    t['Device.DeviceInfo.UpTime'] = 'up'
+    self.assertEqual(202, len(t))
+    self.assertEqual(2, len(list(t.IterSubtree('Device.Hosts.Host.7'))))
+    self.assertEqual(
+        [('Device.Hosts.Host.7.', 7), ('Device.Hosts.Host.7.IPAddress', 7)],
+        sorted(t.DeleteSubtree('Device.Hosts.Host.7.')))
+    self.assertEqual(200, len(t))
+    self.assertFalse('Device.Hosts.Host.7.IPAddress' in t)
+    self.assertEqual([], t.DeleteSubtree('Device.Hosts.Host.7.'))
+    self.assertEqual(199, len(t.DeleteSubtree('Device.Hosts.')))
+    self.assertEqual(['Device.DeviceInfo.UpTime'], t.keys())
+    self.assertEqual(['DeviceInfo'], t.root.children['Device'].children.keys())
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -67,7 +67,7 @@ class RemoteCommandStreamer(quotedblock.QuotedBlockStreamer):
     except Exception as e:  # pylint:disable=broad-except
       print traceback.format_exc()
       return [['ERROR', '-1', str(e)]]
-    session.cache.flush()
+    session.cache.expire()
     return [['OK']] + out
 
   def CmdHelp(self):
@@ -23,10 +23,17 @@ __author__ = 'dgentry@google.com (Denton Gentry)'
 import collections
 import Cookie
 import functools
+import itertools
+import thread
+import threading
 import types
 import weakref
 import tornado.httpclient
 import tornado.ioloop
+import cwmptypes
+import handle
+import latency
+import monohelper
 
 # SPEC3 = TR-069_Amendment-3.pdf
 # http://www.broadband-forum.org/technical/download/TR-069_Amendment-3.pdf
@@ -52,6 +59,20 @@ digraph DLstates {
 HTTPCLIENT = tornado.httpclient.AsyncHTTPClient
 _run_at_end = []
 
+# Most results kept by @cache; beyond this, the least recently used go.
+MAX_CACHE_ENTRIES = 4096
+
+# The filenotifier.FileNotifier used for @cache(files=...), if any.
+_cache_notifier = None
+
+# Every @cache, for cache.Counters().
+_all_caches = weakref.WeakSet()
+
+# WarmUp repeats the @cache calls from this many of the most recent ACS
+# sessions, but at most this many calls.
+WARMUP_SESSIONS = 3
+MAX_WARMUP_CALLS = 512
+
 
 class CwmpSession(object):
   """State machine to handle the lifecycle of a TCP session with the ACS."""
@@ -62,9 +83,10 @@ class CwmpSession(object):
   NOMORE = 'NOMORE'
   DONE = 'DONE'
 
-  def __init__(self, acs_url, ioloop=None):
-    self.http = HTTPCLIENT(max_simultaneous_connections=1,
-                           io_loop=ioloop or tornado.ioloop.IOLoop.instance())
+  def __init__(self, acs_url, ioloop=None, http=None):
+    self.http = http or HTTPCLIENT(
+        max_simultaneous_connections=1,
+        io_loop=ioloop or tornado.ioloop.IOLoop.instance())
     self.acs_url = self.orig_acs_url = acs_url
     self.qualified_acs_url = None
     self.cookies = None
@@ -72,6 +94,14 @@ class CwmpSession(object):
     self.ping_received = False
     self.state = self.CONNECT
     self.cookies = Cookie.SimpleCookie()
+    self.start = monohelper.monotime()
+    self.bytes_in = 0
+    self.bytes_out = 0
+    self.round_trips = 0
+    self.warmup = None  # a WarmUp, once the Inform has been sent
+    self.gzip_rejected = False  # the ACS refused a gzip request
+    self.ended = False  # close() can be called more than once
+    _recent_calls.recording = True
 
   def state_update(self, sent_inform=None, on_hold=None,
                    cpe_to_acs_empty=None, acs_to_cpe_empty=None):
@@ -121,7 +151,22 @@ class CwmpSession(object):
     self.close()
 
   def close(self):
-    cache.flush()
+    if not self.ended:
+      self.ended = True
+      if self.warmup:
+        self.warmup.Stop()
+        print self.warmup
+      _recent_calls.EndSession()
+      if latency.Enable:
+        latency.sessions.Add(monohelper.monotime() - self.start,
+                             self.bytes_in, self.bytes_out, self.round_trips)
+    cache.expire()
+    if handle.session_path_cache.hits or handle.session_path_cache.misses:
+      print handle.session_path_cache
+    handle.session_path_cache.Reset()
+    if cwmptypes.file_reads.reads or cwmptypes.file_reads.avoided:
+      print cwmptypes.file_reads
+    cwmptypes.file_reads.Reset()
     _RunEndCallbacks()
     self.http = None
     return self.ping_received
@@ -134,8 +179,19 @@ def _make_hashable(obj):
     return repr(obj)
 
 
+class _CacheEntry(object):
+  __slots__ = ('value', 'expires', 'session', 'used', 'warm')
+
+  def __init__(self, value, expires, session, used, warm):
+    self.value = value
+    self.expires = expires  # monotime() after which it's stale, or None
+    self.session = session  # True if it only lasts until cache.expire()
+    self.used = used  # for LRU eviction; bigger is more recent
+    self.warm = warm  # computed by WarmUp, and not used since
+
+
 class cache(object):
-  """A global cache of arbitrary data for the lifetime of one CWMP session.
+  """A global cache of arbitrary data, normally for one CWMP session.
 
   @session.cache is a decorator to cache the return
   value of a function for the remainder of the session with the ACS.
@@ -144,51 +200,364 @@ class cache(object):
 
   This is intended for very expensive operations, particularly where
   a process is forked and its output parsed.
+
+  Functions whose results stay good for longer can say so, so that they
+  are kept across sessions (and across periodic statistics samples and
+  rcommand requests, which expire the cache too):
+
+    @session.cache(max_age=60)
+      the result is good for 60 seconds, no matter how many sessions that
+      spans.
+    @session.cache(files=['/tmp/foo'])
+      the result is good until /tmp/foo is created, written, moved or
+      deleted.  This needs a notifier (see SetFileNotifier); without one,
+      or if the file can't be watched, the result only lasts the session.
+
+  Both can be given; whichever runs out first wins.
+
+  Results of methods are stored with the object they belong to, so they
+  don't keep short-lived objects (Hosts, AssociatedDevices...) alive, and
+  go away with them.  At most MAX_CACHE_ENTRIES results are kept; past
+  that, the least recently used are thrown away.  Each function counts
+  its hits, misses and the time it spent computing results; see
+  cache.Counters().
+
+  It is safe to use from more than one thread (see CPE.gpv_threads): if a
+  value is already being computed, other callers wait for it rather than
+  computing it again.
   """
 
-  _thecache = dict()
+  _thecache = dict()  # {key: _CacheEntry} for plain functions
+  # {obj: {key: _CacheEntry}} for methods, so results don't keep obj alive
+  _byobj = weakref.WeakKeyDictionary()
+  _size = 0  # at least the number of entries in all the tables
+  _lock = threading.Lock()
+  # key: (threading.Event set when it's done computing, thread computing it)
+  _inflight = dict()
+  _ticks = itertools.count()
+  classname = None  # for methods, the class they were first called on
+
+  @staticmethod
+  def _Tables():
+    """Returns all the {key: _CacheEntry} dicts.  Call with _lock held."""
+    return [cache._thecache] + cache._byobj.values()
 
   @staticmethod
   def flush():
     """Flush all cached data."""
-    if cache._thecache:
-      print 'Flushing session cache (%d entries)' % len(cache._thecache)
-    cache._thecache.clear()
+    with cache._lock:
+      count = sum(len(table) for table in cache._Tables())
+      if count:
+        print 'Flushing session cache (%d entries)' % count
+      cache._thecache.clear()
+      cache._byobj.clear()
+      cache._size = 0
 
-  def __init__(self, func):
+  @staticmethod
+  def expire():
+    """Flush the data which only lasts a session, or is past its max_age."""
+    now = monohelper.monotime()
+    with cache._lock:
+      expired = kept = 0
+      for table in cache._Tables():
+        stale = [key for key, entry in table.iteritems()
+                 if entry.session or
+                 (entry.expires is not None and entry.expires <= now)]
+        for key in stale:
+          del table[key]
+        expired += len(stale)
+        kept += len(table)
+      cache._size = kept
+      if expired:
+        print 'Expiring session cache (%d entries, %d kept)' % (expired, kept)
+
+  @staticmethod
+  def Counters():
+    """Returns [(name, hits, misses, seconds, entries)], one per function."""
+    entries = collections.defaultdict(int)
+    with cache._lock:
+      for table in cache._Tables():
+        for key in table:
+          entries[key[0]] += 1
+    return sorted((c.name, c.hits, c.misses, c.seconds, entries[c.funckey])
+                  for c in list(_all_caches))
+
+  @staticmethod
+  def _Evict():
+    """Throw away the least recently used quarter.  Call with _lock held."""
+    entries = [(entry.used, table, key) for table in cache._Tables()
+               for key, entry in table.iteritems()]
+    if len(entries) > MAX_CACHE_ENTRIES:
+      entries.sort(key=lambda x: x[0])
+      evict = len(entries) / 4 + 1
+      for _, table, key in entries[:evict]:
+        del table[key]
+      del entries[:evict]
+    cache._size = len(entries)
+
+  def __init__(self, func=None, max_age=None, files=None):
+    self.max_age = max_age
+    self.files = tuple(files or ())
+    self.watches = None
+    self.hits = 0
+    self.misses = 0
+    self.seconds = 0.0  # total time spent computing results
+    self._SetFunc(func)
+
+  def _SetFunc(self, func):
     self.func = func
+    self.funckey = _make_hashable(func)
+    self.key0 = (self.funckey, (), ())  # the key when there are no arguments
+    self.name = None
+    if func is not None:
+      self.name = '%s.%s' % (func.__module__, func.__name__)
+      _all_caches.add(self)
 
   def __get__(self, obj, objtype):
     """Support instance methods."""
     if obj is None: return self
-    return functools.partial(self._call, weakref.ref(obj))
+    if self.classname is None:
+      self.classname = objtype.__name__
+      self.name = '%s.%s.%s' % (self.func.__module__, self.classname,
+                                self.func.__name__)
+    return functools.partial(self._call, obj)
 
   def __call__(self, *args, **kwargs):
+    if self.func is None:
+      # @cache(max_age=...) gets constructed first, then called to decorate.
+      self._SetFunc(*args)
+      return self
     return self._call(None, *args, **kwargs)
 
   def _call(self, obj, *args, **kwargs):
-    key = self._cache_key(obj, args, kwargs)
+    key = self._cache_key(args, kwargs) if args or kwargs else self.key0
+    byobj = obj is not None
+    if byobj:
+      try:
+        cache._byobj.get(obj)
+      except TypeError:
+        # obj can't be weakly referenced (or hashed), so its results go in
+        # the global table, and keep it alive until they're flushed.
+        byobj = False
+        key += (_make_hashable(obj),)
+    inflight = (id(obj), key)  # obj can't go away while it's in flight
+    while True:
+      table = cache._byobj.get(obj) if byobj else cache._thecache
+      entry = table.get(key) if table is not None else None
+      if entry is not None and (entry.expires is None or
+                                entry.expires > monohelper.monotime()):
+        entry.used = next(cache._ticks)
+        self.hits += 1
+        if entry.warm and _recent_calls.recording:
+          entry.warm = False
+          _recent_calls.Add(self, obj, byobj, key, args, kwargs)
+        return entry.value
+      me = thread.get_ident()
+      with cache._lock:
+        table = cache._byobj.get(obj) if byobj else cache._thecache
+        if (table.get(key) if table is not None else None) is not entry:
+          continue
+        flight = cache._inflight.get(inflight)
+        if flight is None:
+          done = threading.Event()
+          cache._inflight[inflight] = (done, me)
+          break
+      done, owner = flight
+      if owner == me:
+        # We're already computing it, further up the stack.  Waiting for
+        # ourselves would never finish, so this one call goes uncached.
+        self.misses += 1
+        return self._Compute(obj, args, kwargs)
+      # Another thread is computing it.  If that fails, try it ourselves.
+      done.wait()
     try:
-      return cache._thecache[key]
-    except KeyError:
-      if obj:
-        val = self.func(obj(), *args, **kwargs)
-      else:
-        val = self.func(*args, **kwargs)
-      if isinstance(val, types.GeneratorType):
-        raise TypeError('cannot cache generators; use cache_as_list instead')
-      cache._thecache[key] = val
+      if self.files and self.watches is None:
+        self._Watch()
+      self.misses += 1
+      start = monohelper.monotime()
+      val = self._Compute(obj, args, kwargs)
+      now = monohelper.monotime()
+      self.seconds += now - start
+      expires = None
+      if self.max_age is not None:
+        expires = now + self.max_age
+      entry = _CacheEntry(val, expires,
+                          self.max_age is None and not self.watches,
+                          next(cache._ticks), _recent_calls.warming)
+      if _recent_calls.recording:
+        _recent_calls.Add(self, obj, byobj, key, args, kwargs)
+      with cache._lock:
+        if byobj:
+          table = cache._byobj.get(obj)
+          if table is None:
+            table = cache._byobj[obj] = {}
+        else:
+          table = cache._thecache
+        table[key] = entry
+        cache._size += 1
+        if cache._size > MAX_CACHE_ENTRIES:
+          cache._Evict()
       return val
+    finally:
+      with cache._lock:
+        del cache._inflight[inflight]
+      done.set()
+
+  def _Compute(self, obj, args, kwargs):
+    if obj is not None:
+      val = self.func(obj, *args, **kwargs)
+    else:
+      val = self.func(*args, **kwargs)
+    if isinstance(val, types.GeneratorType):
+      raise TypeError('cannot cache generators; use cache_as_list instead')
+    return val
+
+  def _Watch(self):
+    """Start watching self.files, if there's a notifier to do it with."""
+    notifier = _cache_notifier
+    if not notifier:
+      return
+    # The notifier holds on to the callback, so don't let it hold on to us.
+    self_ref = weakref.ref(self)
+    callback = lambda: _CacheFileChanged(self_ref)
+    watches = []
+    for filename in self.files:
+      try:
+        watches.append(notifier.WatchObj(filename, callback))
+      except notifier.Error as e:
+        # Not fatal; results last the session, and we try again next time.
+        print repr(e)
+        return
+    self.watches = watches
+
+  def _FileChanged(self):
+    with cache._lock:
+      for table in cache._Tables():
+        stale = [key for key in table if key[0] == self.funckey]
+        for key in stale:
+          del table[key]
+
+  def _cache_key(self, args, kwargs):
+    """Concatenate the function and all arguments."""
+    key = (self.funckey, args, tuple(sorted(kwargs.iteritems())))
+    try:
+      hash(key)
+      return key
+    except TypeError:
+      # Only pay for repr() when some argument isn't hashable.
+      return (self.funckey,
+              tuple(_make_hashable(x) for x in args),
+              tuple((k, _make_hashable(v))
+                    for k, v in sorted(kwargs.iteritems())))
+
+
+class _RecentCalls(object):
+  """The @cache calls ACS sessions needed lately, for WarmUp to repeat."""
+
+  def __init__(self):
+    self.calls = {}  # (id(obj), key): (cache, obj ref, args, kwargs, session)
+    self.session = 0  # the number of sessions that have ended
+    self.recording = False  # True during an ACS session
+    self.warming = False  # True while WarmUp is computing something
+
+  def Add(self, c, obj, byobj, key, args, kwargs):
+    if obj is None:
+      ref = None
+    elif byobj:
+      ref = weakref.ref(obj)
+    else:
+      return  # can't hold on to obj without keeping it alive
+    self.calls[(id(obj), key)] = (c, ref, args, kwargs, self.session)
+
+  def EndSession(self):
+    """Forget the calls no longer among the last WARMUP_SESSIONS."""
+    self.session += 1
+    self.recording = False
+    oldest = self.session - WARMUP_SESSIONS
+    calls = [(k, v) for k, v in self.calls.iteritems()
+             if v[4] >= oldest and (v[1] is None or v[1]() is not None)]
+    calls.sort(key=lambda x: x[1][4], reverse=True)
+    self.calls = dict(calls[:MAX_WARMUP_CALLS])
+
+  def Calls(self):
+    """Returns [(cache, obj ref, args, kwargs)], most recently used first."""
+    calls = sorted(self.calls.itervalues(), key=lambda x: x[4], reverse=True)
+    return [call[:4] for call in calls]
+
+
+class WarmUp(object):
+  """Computes the @cache results recent ACS sessions used, ahead of time.
+
+  Between sending the Inform and receiving the ACS's first request, cwmpd
+  would otherwise just be waiting.  This uses that time to fill in the
+  cache entries the last few sessions had to compute (see
+  WARMUP_SESSIONS), so the ACS's requests don't have to wait for them.
+
+  Each entry is computed in its own ioloop callback, so an arriving
+  response waits for at most one of them.  It stops when Stop() is
+  called, or after spending budget seconds.
+  """
 
-  def _cache_key(self, obj, args, kwargs):
-    """Concatenate the function, object, and all arguments."""
-    return (_make_hashable(self.func),
-            _make_hashable(obj() if obj else None),
-            tuple(_make_hashable(x) for x in list(args)),
-            tuple(_make_hashable(x) for x in list(kwargs)))
-
-
-def cache_as_list(f):
+  def __init__(self, ioloop, budget):
+    self.ioloop = ioloop
+    self.budget = budget
+    self.calls = _recent_calls.Calls()
+    self.total = len(self.calls)
+    self.done = 0
+    self.spent = 0.0
+    self.stopped = False
+
+  def Start(self):
+    if self.calls and self.budget > 0:
+      self.ioloop.add_callback(self._Next)
+
+  def Stop(self):
+    self.stopped = True
+
+  def _Next(self):
+    while self.calls and not self.stopped and self.spent < self.budget:
+      c, ref, args, kwargs = self.calls.pop(0)
+      obj = ref() if ref else None
+      if ref and obj is None:
+        continue  # the object it was for has gone away
+      recording = _recent_calls.recording
+      _recent_calls.recording = False
+      _recent_calls.warming = True
+      start = monohelper.monotime()
+      try:
+        c._call(obj, *args, **kwargs)  # pylint:disable=protected-access
+      except Exception as e:  # pylint:disable=broad-except
+        # It'll fail again, and be reported properly, if the ACS asks for it.
+        print 'cache warm-up of %s failed: %r' % (c.name, e)
+      finally:
+        self.spent += monohelper.monotime() - start
+        _recent_calls.recording = recording
+        _recent_calls.warming = False
+      self.done += 1
+      self.ioloop.add_callback(self._Next)
+      return
+
+  def __str__(self):
+    return 'cache warm-up: %d of %d calls, %.3fs' % (self.done, self.total,
+                                                     self.spent)
+
+
+def _CacheFileChanged(cache_ref):
+  c = cache_ref()
+  if c is not None:
+    c._FileChanged()  # pylint:disable=protected-access
+
+
+_recent_calls = _RecentCalls()
+
+
+def SetFileNotifier(notifier):
+  """Use notifier (a filenotifier.FileNotifier) for @cache(files=...)."""
+  global _cache_notifier
+  _cache_notifier = notifier
+
+
+def cache_as_list(f=None, max_age=None, files=None):
   """Like cache(), but caches the return value as a list.
 
   You can't cache the output of generator functions (ie. functions that
@@ -198,11 +567,17 @@ def cache_as_list(f):
 
   Args:
     f: the function being wrapped.
+    max_age: like cache(max_age=...).
+    files: like cache(files=...).
   Returns:
     A new function that, when called, passes its arguments to f and typecasts
     its return value into a list.
   """
-  @cache
+  if f is None:
+    return functools.partial(cache_as_list, max_age=max_age, files=files)
+
+  @cache(max_age=max_age, files=files)
+  @functools.wraps(f)
   def AsList(*args, **kwargs):
     return list(f(*args, **kwargs))
   return AsList
@@ -20,7 +20,11 @@
 
 __author__ = 'dgentry@google.com (Denton Gentry)'
 
+import gc
+import itertools
+import threading
 import time
+import weakref
 import google3
 import session
 from wvtest import unittest
@@ -232,9 +236,116 @@ def CacheAsListFunction():
   return _CacheIterFunction()
 
 
+slow_calls = []
+
+
+@session.cache
+def SlowCacheFunction(arg):
+  slow_calls.append(arg)
+  time.sleep(0.1)
+  return arg * 2
+
+
+counted_calls = []
+
+
+@session.cache(max_age=10)
+def MaxAgeFunction(arg):
+  counted_calls.append(('maxage', arg))
+  return arg
+
+
+@session.cache(files=['/tmp/session_test/foo'])
+def FileFunction():
+  counted_calls.append('file')
+  return len(counted_calls)
+
+
+@session.cache_as_list(max_age=10)
+def MaxAgeListFunction():
+  counted_calls.append('list')
+  yield 1
+
+
+class EphemeralHost(object):
+  """Like a Device.Hosts.Host, which only lasts until the next refresh."""
+
+  def __init__(self, n):
+    self.n = n
+
+  @session.cache
+  def Name(self):
+    return 'host%d' % self.n
+
+  @session.cache(max_age=10)
+  def Stats(self, which, extra=None):
+    return [which, extra]
+
+
+@session.cache
+def RecursiveFunction(n):
+  counted_calls.append(('recursive', n))
+  if len(counted_calls) < 3:
+    RecursiveFunction(n)  # asks for itself while it's being computed
+  return n
+
+
+@session.cache
+def WarmFunction(arg):
+  counted_calls.append(('warm', arg))
+  if arg < 0:
+    raise ValueError(arg)
+  return arg
+
+
+class FakeIOLoop(object):
+  """Just enough of tornado.ioloop.IOLoop for session.WarmUp."""
+
+  def __init__(self):
+    self.callbacks = []
+
+  def add_callback(self, callback):
+    self.callbacks.append(callback)
+
+  def RunOne(self):
+    self.callbacks.pop(0)()
+
+  def RunAll(self):
+    while self.callbacks:
+      self.RunOne()
+
+
+class FakeNotifier(object):
+  """Just enough of filenotifier.FileNotifier for session.cache."""
+
+  class Error(Exception):
+    pass
+
+  def __init__(self):
+    self.callbacks = {}
+
+  def WatchObj(self, filename, callback):
+    self.callbacks[filename] = callback
+    return filename
+
+
 class SessionCacheTest(unittest.TestCase):
   """tests for SessionCache."""
 
+  def setUp(self):
+    self.now = 1000.0
+    self.old_monotime = session.monohelper.monotime
+    session.monohelper.monotime = lambda: self.now
+    session.cache.flush()
+    del counted_calls[:]
+    session._recent_calls.calls.clear()
+    session._recent_calls.recording = False
+
+  def tearDown(self):
+    session.monohelper.monotime = self.old_monotime
+    session.SetFileNotifier(None)
+    FileFunction.watches = None
+
   def testCacheObject(self):
     t1 = SimpleCacheObject()
     t2 = SimpleCacheObject()
@@ -295,6 +406,212 @@ class SessionCacheTest(unittest.TestCase):
     self.assertEqual(CacheListFunction(), [1, 2])
     self.assertEqual(CacheAsListFunction(), [3, 4])
 
+  def testCacheSingleFlight(self):
+    session.cache.flush()
+    del slow_calls[:]
+    results = []
+
+    def Call(arg):
+      results.append(SlowCacheFunction(arg))
+    threads = [threading.Thread(target=Call, args=(i % 2,))
+               for i in range(6)]
+    for t in threads:
+      t.start()
+    for t in threads:
+      t.join()
+    self.assertEqual(sorted(slow_calls), [0, 1])
+    self.assertEqual(sorted(results), [0, 0, 0, 2, 2, 2])
+    self.assertEqual(session.cache._inflight, {})
+
+  def testCacheMaxAge(self):
+    SimpleCacheFunction()
+    self.assertEqual(1, MaxAgeFunction(1))
+    self.assertEqual(1, MaxAgeFunction(1))
+    self.assertEqual([1], list(MaxAgeListFunction()))
+    self.assertEqual([1], MaxAgeListFunction())
+    self.assertEqual([('maxage', 1), 'list'], counted_calls)
+    self.assertEqual(3, len(session.cache._thecache))
+
+    # Ending a session only throws away what's not good for longer.
+    session.cache.expire()
+    self.assertEqual(2, len(session.cache._thecache))
+    self.now += 9
+    MaxAgeFunction(1)
+    MaxAgeListFunction()
+    self.assertEqual(2, len(counted_calls))
+
+    # Too old to be used, even before the cache is expired.
+    self.now += 1
+    MaxAgeFunction(1)
+    self.assertEqual(3, len(counted_calls))
+    session.cache.expire()
+    self.assertEqual(1, len(session.cache._thecache))
+    MaxAgeFunction(1)
+    self.assertEqual(3, len(counted_calls))
+
+  def testCacheFiles(self):
+    # Without a notifier, results only last the session.
+    self.assertEqual(1, FileFunction())
+    self.assertEqual(1, FileFunction())
+    session.cache.expire()
+    self.assertEqual(2, FileFunction())
+
+    notifier = FakeNotifier()
+    session.SetFileNotifier(notifier)
+    session.cache.flush()
+    self.assertEqual(3, FileFunction())
+    self.assertEqual(['/tmp/session_test/foo'], notifier.callbacks.keys())
+    session.cache.expire()
+    self.assertEqual(3, FileFunction())
+    MaxAgeFunction(1)
+    notifier.callbacks['/tmp/session_test/foo']()
+    self.assertEqual(1, len(session.cache._thecache))
+    self.assertEqual(5, FileFunction())
+
+  def _UseHosts(self, i):
+    hosts = [EphemeralHost(j) for j in xrange(i % 5)]
+    for host in hosts:
+      host.Name()
+      host.Name()
+      host.Stats('tx')
+      host.Stats('rx', extra={'unhashable': [i]})
+    SimpleCacheFunction()
+    return [weakref.ref(host) for host in hosts]
+
+  def testCacheNoLeaks(self):
+    host = EphemeralHost(0)
+    self.assertEqual('host0', host.Name())
+    self.assertEqual(['rx', [1]], host.Stats('rx', extra=[1]))
+    self.assertEqual(2, len(session.cache._byobj[host]))
+    ref = weakref.ref(host)
+    del host
+    self.assertEqual(None, ref())
+    self.assertEqual(0, len(session.cache._byobj))
+
+    gc.collect()
+    before = len(gc.get_objects())
+    alive = 0
+    for i in xrange(1000):
+      cs = session.CwmpSession(acs_url='http://example.com/', http=object())
+      alive += sum(1 for ref in self._UseHosts(i) if ref())
+      cs.close()
+    del cs
+    self.assertEqual(0, alive)
+    self.assertEqual(0, len(session.cache._byobj))
+    self.assertEqual(0, len(session.cache._thecache))
+    self.assertEqual(0, gc.collect())
+    self.assertLess(len(gc.get_objects()) - before, 100)
+
+  def testCacheCounters(self):
+    def Counters(name):
+      for c in session.cache.Counters():
+        if c[0] == '%s.%s' % (__name__, name):
+          return c[1:3] + c[4:]
+    hosts = [EphemeralHost(i) for i in range(3)]
+    for host in hosts * 2:
+      host.Name()
+    MaxAgeFunction(1)
+    self.assertEqual((3, 3, 3), Counters('EphemeralHost.Name'))
+    self.assertEqual((0, 1, 1), Counters('MaxAgeFunction'))
+    MaxAgeListFunction()
+    self.assertEqual((0, 1, 1), Counters('MaxAgeListFunction'))
+    del hosts, host
+    self.assertEqual((3, 3, 0), Counters('EphemeralHost.Name'))
+
+  def testCacheReentrant(self):
+    self.assertEqual(5, RecursiveFunction(5))
+    self.assertEqual(5, RecursiveFunction(5))
+    self.assertEqual([('recursive', 5)] * 3, counted_calls)
+    self.assertEqual(session.cache._inflight, {})
+
+  def _Session(self, *args):
+    cs = session.CwmpSession(acs_url='http://example.com/', http=object())
+    for arg in args:
+      WarmFunction(arg)
+    return cs
+
+  def testWarmUp(self):
+    host = EphemeralHost(1)
+    cs = self._Session(1, 2)
+    host.Name()
+    cs.close()
+    self.assertEqual([('warm', 1), ('warm', 2)], counted_calls)
+
+    # The next session computes them before they're asked for.
+    loop = FakeIOLoop()
+    cs = self._Session()
+    cs.warmup = session.WarmUp(loop, budget=10)
+    cs.warmup.Start()
+    loop.RunAll()
+    self.assertEqual(3, cs.warmup.done)
+    self.assertEqual(4, len(counted_calls))
+    self.assertEqual('host1', host.Name())
+    WarmFunction(2)  # only this one is used
+    self.assertEqual(4, len(counted_calls))
+    cs.close()
+
+    # Whatever wasn't used ages out after WARMUP_SESSIONS.
+    for _ in range(session.WARMUP_SESSIONS):
+      del counted_calls[:]
+      cs = self._Session()
+      cs.warmup = session.WarmUp(loop, budget=10)
+      cs.warmup.Start()
+      loop.RunAll()
+      cs.close()
+    self.assertEqual([('warm', 2)], counted_calls)
+    self.assertEqual([], session._recent_calls.Calls())
+
+  def testWarmUpLimits(self):
+    hosts = [EphemeralHost(i) for i in range(3)]
+    cs = self._Session(1, 2, 3)
+    self.assertRaises(ValueError, WarmFunction, -1)
+    for host in hosts:
+      host.Name()
+    del hosts[1:], host
+    cs.close()
+
+    # Objects which have gone away are skipped, and failures not repeated.
+    loop = FakeIOLoop()
+    warmup = session.WarmUp(loop, budget=10)
+    self.assertEqual(4, warmup.total)
+    warmup.Start()
+    loop.RunOne()
+    loop.RunOne()
+    warmup.Stop()
+    loop.RunAll()
+    self.assertEqual(2, warmup.done)
+
+    # It stops once it has spent its budget.
+    session.cache.flush()
+    clock = itertools.count()
+    session.monohelper.monotime = lambda: next(clock)
+    warmup = session.WarmUp(loop, budget=0.5)
+    warmup.Start()
+    loop.RunAll()
+    self.assertEqual(1, warmup.done)
+
+    warmup = session.WarmUp(loop, budget=0)
+    warmup.Start()
+    self.assertEqual([], loop.callbacks)
+
+  def testCacheEviction(self):
+    old_max = session.MAX_CACHE_ENTRIES
+    session.MAX_CACHE_ENTRIES = 8
+    try:
+      for i in range(8):
+        MaxAgeFunction(i)
+      MaxAgeFunction(0)  # now the most recently used
+      MaxAgeFunction(8)
+      self.assertEqual(6, len(session.cache._thecache))
+      del counted_calls[:]
+      MaxAgeFunction(0)
+      MaxAgeFunction(8)
+      self.assertEqual([], counted_calls)
+      MaxAgeFunction(1)
+      self.assertEqual([('maxage', 1)], counted_calls)
+    finally:
+      session.MAX_CACHE_ENTRIES = old_max
+
 
 RunAtEndTestResults = {}
 
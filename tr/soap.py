@@ -22,9 +22,13 @@
 __author__ = 'apenwarr@google.com (Avery Pennarun)'
 
 
+import contextlib
+import io
 import re
+from xml.sax import saxutils
 import xml.etree.cElementTree as ET
 import google3
+import cwmplog
 import xmlwitch
 
 
@@ -98,9 +102,208 @@ def Enterable(func):
   return Wrap
 
 
+_INVALID_XML_CHARS = re.compile(xmlwitch.INVALID_XML_CHARS)
+
+
+def _NamePrep(name):
+  """Undo keyword and colon mangling, the same way xmlwitch does."""
+  name = xmlwitch.Element.PYTHON_KWORD_MAP.get(name, name)
+  return name.replace('__', ':')
+
+
+def _Unicode(s):
+  return s if type(s) is unicode else s.decode('utf-8')
+
+
+def _AsParsed(text):
+  """Returns text the way ElementTree would parse it back out of a document."""
+  text = _INVALID_XML_CHARS.sub(u'?', _Unicode(text))
+  text = text.replace(u'\r\n', u'\n').replace(u'\r', u'\n')
+  if not text:
+    return None
+  try:
+    return text.encode('ascii')
+  except UnicodeError:
+    return text
+
+
+def _Escape(text):
+  """The same as saxutils.escape, only faster."""
+  if type(text) is not unicode:
+    text = text.decode('utf-8')
+  return text.replace(u'&', u'&amp;').replace(u'<', u'&lt;').replace(
+      u'>', u'&gt;')
+
+
+# Responses tend to use the same few attributes over and over, like
+# xsi:type="xsd:string", so remember how they were serialized.
+_attrs_cache = {}
+MAX_ATTRS_CACHE = 100
+
+
+def _Attrs(attrs):
+  if not attrs:
+    return u''
+  key = tuple(attrs.items())
+  out = _attrs_cache.get(key)
+  if out is None:
+    out = u''.join(u' %s=%s' % (_NamePrep(k), _Unicode(saxutils.quoteattr(v)))
+                   for k, v in key)
+    if len(_attrs_cache) < MAX_ATTRS_CACHE:
+      _attrs_cache[key] = out
+  return out
+
+
+class _WriterElement(object):
+  """The xmlwitch.Element interface, on top of a Writer."""
+
+  __slots__ = ('name', 'writer', 'attributes')
+
+  def __init__(self, name, writer):
+    self.name = _NamePrep(name)
+    self.writer = writer
+    self.attributes = {}
+
+  def __enter__(self):
+    self.writer.StartTag(self.name, self.attributes)
+    return self
+
+  def __exit__(self, unused_type, unused_value, unused_tb):
+    self.writer.EndTag(self.name)
+
+  def __call__(self, *args, **kwargs):
+    self.attributes.update(kwargs)
+    if args:
+      if args[0] is None:
+        self.writer.EmptyElement(self.name, self.attributes)
+      else:
+        self.writer.TextElement(self.name, args[0], self.attributes)
+    return self
+
+
+class Writer(object):
+  """Builds an XML document, one fragment at a time.
+
+  The output is exactly what xmlwitch.Builder would produce, and the same
+  xml.Name(value) and "with xml['cwmp:Name']:" interface works, so this
+  can be used wherever a Builder is.  It's a lot cheaper, though: escaped
+  fragments are appended to a list, and only joined, checked for invalid
+  characters and encoded once, at the end.  Big responses can call
+  StartTag(), TextElement() and EndTag() directly, which skips creating
+  an object for every element.
+
+  If given, listener is told about each element as it is written, with
+  listener.Start(tag) and listener.End(tag, text), the same as a parser
+  would see them.  (See cwmplog.TerseLog.)  If something gets written
+  that the listener can't be told about, listener.Invalidate() is called.
+  AllOrNothing() uses listener.Mark() and listener.Rewind(mark) to forget
+  about elements it throws away.
+  """
+
+  def __init__(self, version=None, encoding='utf-8', indent='  ',
+               listener=None):
+    self.listener = listener
+    self._chunks = []
+    self._encoding = encoding
+    self._indent = _Unicode(indent)
+    self._indentation = 0
+    self._prefix = u''
+    if version is not None:
+      self._chunks.append(u'<?xml version="%s" encoding="%s"?>\n' % (
+          version, encoding))
+
+  def __getattr__(self, name):
+    if name.startswith('__'):
+      raise AttributeError(name)
+    return _WriterElement(name, self)
+
+  def __getitem__(self, name):
+    return _WriterElement(name, self)
+
+  def __str__(self):
+    text = _INVALID_XML_CHARS.sub(u'?', u''.join(self._chunks))
+    return text.encode(self._encoding).strip()
+
+  def _Indent(self, delta):
+    self._indentation += delta
+    self._prefix = self._indent * self._indentation
+
+  def write(self, content):  # pylint:disable=invalid-name
+    """Write raw content to the document (like xmlwitch.Builder.write)."""
+    if self.listener:
+      self.listener.Invalidate()
+    self._chunks.append(_Unicode(content))
+
+  def StartTag(self, name, attrs=None):
+    if self.listener:
+      self.listener.Start(name)
+    self._chunks.append(u'%s<%s%s>\n' % (self._prefix, name, _Attrs(attrs)))
+    self._Indent(1)
+
+  def EndTag(self, name):
+    if self.listener:
+      self.listener.End(name, None)
+    self._Indent(-1)
+    self._chunks.append(u'%s</%s>\n' % (self._prefix, name))
+
+  def TextElement(self, name, text, attrs=None):
+    if self.listener:
+      self.listener.Start(name)
+      self.listener.End(name, _AsParsed(text))
+    self._chunks.append(u'%s<%s%s>%s</%s>\n' % (
+        self._prefix, name, _Attrs(attrs), _Escape(text), name))
+
+  def EmptyElement(self, name, attrs=None):
+    if self.listener:
+      self.listener.Start(name)
+      self.listener.End(name, None)
+    self._chunks.append(u'%s<%s%s />\n' % (self._prefix, name, _Attrs(attrs)))
+
+  def ReserveStartTag(self, name):
+    """Like StartTag(name), but the attributes are filled in later.
+
+    Use this when an attribute (like a soap-enc:arrayType) depends on
+    elements which haven't been written yet.
+
+    Args:
+      name: the element name.
+    Returns:
+      a slot to pass to FillStartTag().
+    """
+    if self.listener:
+      self.listener.Start(name)
+    slot = (len(self._chunks), self._prefix, name)
+    self._chunks.append(None)
+    self._Indent(1)
+    return slot
+
+  def FillStartTag(self, slot, attrs):
+    idx, prefix, name = slot
+    self._chunks[idx] = u'%s<%s%s>\n' % (prefix, name, _Attrs(attrs))
+
+  @contextlib.contextmanager
+  def AllOrNothing(self):
+    """If the block raises an exception, discard everything it wrote.
+
+    That way a fault can still be written in place of a response which
+    failed partway through.
+    """
+    mark = len(self._chunks)
+    indentation = self._indentation
+    listener_mark = self.listener and self.listener.Mark()
+    try:
+      yield self
+    except:  # pylint:disable=bare-except
+      if self.listener:
+        self.listener.Rewind(listener_mark)
+      del self._chunks[mark:]
+      self._Indent(indentation - self._indentation)
+      raise
+
+
 @Enterable
 def Envelope(request_id, hold_requests):
-  xml = xmlwitch.Builder(version='1.0', encoding='utf-8')
+  xml = Writer(version='1.0', encoding='utf-8', listener=cwmplog.TerseLog())
   attrs = {'xmlns:soap': 'http://schemas.xmlsoap.org/soap/envelope/',
            'xmlns:soap-enc': 'http://schemas.xmlsoap.org/soap/encoding/',
            'xmlns:xsd': 'http://www.w3.org/2001/XMLSchema',
@@ -164,12 +367,16 @@ def SimpleFault(xml, cpefault, faultstring):
 
 
 def _StripNamespace(tagname):
-  return re.sub(r'^\{.*\}', '', tagname)
+  if tagname.startswith('{'):
+    return tagname[tagname.rindex('}') + 1:]
+  return tagname
 
 
 class NodeWrapper(object):
   """Wrap an XML node to make it easier to access its members."""
 
+  __slots__ = ('name', 'attrib', '_list', '_dict')
+
   def __init__(self, name, attrib, items):
     self.name = name
     self.attrib = attrib
@@ -243,6 +450,155 @@ def Parse(xmlstring):
   return _Parse(root)
 
 
+class StreamingRequest(NodeWrapper):
+  """The method element of a SOAP request, parsed as it gets used.
+
+  The underlying ET.iterparse is only advanced far enough to find whatever
+  is asked for, and each child element is discarded once it has been
+  converted.  Stream() goes further, and yields the entries of a list
+  (like a ParameterList) one at a time, so no NodeWrapper for the whole
+  list is ever built.
+
+  Otherwise this works just like a NodeWrapper, parsing as much of the
+  rest of the request as necessary.
+  """
+
+  __slots__ = ('_elem', '_events', '_depth')
+
+  def __init__(self, elem, events):
+    super(StreamingRequest, self).__init__(_StripNamespace(elem.tag),
+                                           elem.attrib, [])
+    self._elem = elem
+    self._events = events  # None once we reach the end of elem
+    self._depth = 0  # relative to elem
+
+  def _NextEvent(self):
+    event, elem = next(self._events)
+    self._depth += 1 if event == 'start' else -1
+    if self._depth < 0:
+      # the end of the method element itself
+      self._events = None
+    return event, elem
+
+  def _Add(self, elem):
+    key = _StripNamespace(elem.tag)
+    value = _Parse(elem)
+    self._list.append((key, value))
+    self._dict[key] = value
+    self._elem.remove(elem)
+
+  def _ParseChild(self):
+    """Parse the next child element, if there is one."""
+    while self._events is not None:
+      event, elem = self._NextEvent()
+      if event == 'end' and self._depth == 0:
+        self._Add(elem)
+        return
+
+  def _ParseAll(self):
+    while self._events is not None:
+      self._ParseChild()
+
+  def _Get(self, key):
+    if isinstance(key, slice):
+      self._ParseAll()
+    while self._events is not None:
+      try:
+        return NodeWrapper._Get(self, key)
+      except (KeyError, IndexError):
+        self._ParseChild()
+    return NodeWrapper._Get(self, key)
+
+  def Stream(self, key):
+    """Yield the parsed children of child element key, one at a time.
+
+    The entries are discarded as they are yielded, so this only works once
+    per key.  If key has already been parsed (because something after it
+    was looked up first), this yields its entries from there instead.
+
+    Args:
+      key: the name of the child element, like 'ParameterList'.
+    Yields:
+      NodeWrappers or strings, as NodeWrapper.iteritems() would.
+    Raises:
+      AttributeError: if there is no such child.
+    """
+    while self._events is not None:
+      event, elem = self._NextEvent()
+      if (event == 'start' and self._depth == 1 and
+          _StripNamespace(elem.tag) == key):
+        while True:
+          event, sub = self._NextEvent()
+          if event == 'end' and self._depth == 1:
+            value = _Parse(sub)
+            elem.remove(sub)
+            yield value
+          elif self._depth == 0:
+            self._elem.remove(elem)
+            return
+      elif event == 'end' and self._depth == 0:
+        self._Add(elem)
+    for _, value in getattr(self, key).iteritems():
+      yield value
+
+  def iteritems(self):  # pylint:disable=invalid-name
+    self._ParseAll()
+    return NodeWrapper.iteritems(self)
+
+  def __unicode__(self):
+    self._ParseAll()
+    return NodeWrapper.__unicode__(self)
+
+  def __repr__(self):
+    self._ParseAll()
+    return NodeWrapper.__repr__(self)
+
+
+def _Walk(elem):
+  """Yield ('start' or 'end', element) events for an already-parsed tree."""
+  yield 'start', elem
+  for child in list(elem):  # a copy: StreamingRequest removes children
+    for event in _Walk(child):
+      yield event
+  yield 'end', elem
+
+
+def ParseRequest(xmlstring, root=None):
+  """Parse a SOAP request up to the start of its RPC method.
+
+  Args:
+    xmlstring: the request, as utf-8 encoded bytes.
+    root: if not None, the ElementTree root of xmlstring, already parsed
+      (see cwmplog.Logger.LogRequest), to use instead of parsing it again.
+  Returns:
+    (header, request): the soap:Header as a NodeWrapper (empty if there
+    wasn't one), and a StreamingRequest for the first element of the
+    soap:Body, which parses the rest of the request as it is used.
+  Raises:
+    IndexError: if the soap:Body is empty.
+  """
+  if root is not None:
+    events = _Walk(root)
+  else:
+    xmlstring = bytes(xmlstring)  # expects bytes; ET decodes as utf-8
+    events = ET.iterparse(io.BytesIO(xmlstring), events=('start', 'end'))
+  header = NodeWrapper('Header', {}, [])
+  depth = 0
+  section = None
+  for event, elem in events:
+    if event == 'start':
+      depth += 1
+      if depth == 2:
+        section = _StripNamespace(elem.tag)
+      elif depth == 3 and section == 'Body':
+        return header, StreamingRequest(elem, events)
+    else:
+      depth -= 1
+      if depth == 1 and section == 'Header':
+        header = _Parse(elem)
+  raise IndexError('SOAP request has no Body')
+
+
 def main():
   with Envelope(1234, False) as xml:
     print GetParameterNames(xml, 'System.', 1)
@@ -17,10 +17,13 @@
 
 __author__ = 'dgentry@google.com (Denton Gentry)'
 
+import xml.etree.cElementTree as ET
 from wvtest import unittest
 
 import google3
+import cwmplog
 import soap
+import xmlwitch
 
 
 xml = """<?xml version="1.0" encoding="UTF-8"?>
@@ -49,6 +52,26 @@ xml = """<?xml version="1.0" encoding="UTF-8"?>
   </soapenv:Envelope>"""
 
 
+spv_xml = """<soapenv:Envelope
+    xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/"
+    xmlns:cwmp="urn:dslforum-org:cwmp-1-2">
+  <soapenv:Header>
+    <cwmp:ID soapenv:mustUnderstand="1">spv</cwmp:ID>
+  </soapenv:Header>
+  <soapenv:Body>
+    <cwmp:SetParameterValues>
+      <ParameterList>
+        <ParameterValueStruct><Name>A.B</Name><Value>1</Value>
+        </ParameterValueStruct>
+        <ParameterValueStruct><Name>A.C</Name><Value>two</Value>
+        </ParameterValueStruct>
+      </ParameterList>
+      <ParameterKey>key</ParameterKey>
+    </cwmp:SetParameterValues>
+  </soapenv:Body>
+</soapenv:Envelope>"""
+
+
 class SoapTest(unittest.TestCase):
   """Tests for soap."""
 
@@ -63,6 +86,136 @@ class SoapTest(unittest.TestCase):
     self.assertEqual(getattr(req, 'DoesNotExist', 'DefaultValue'),
                      'DefaultValue')
 
+  def testParseRequest(self):
+    header, req = soap.ParseRequest(xml)
+    self.assertEqual('acs', header.ID)
+    self.assertEqual('Download', req.name)
+    # Nothing past the start of the method has been parsed yet.
+    self.assertEqual([], req._list)
+    self.assertEqual('https://www.example.com/', req.URL)
+    self.assertEqual(3, len(req._list))
+    self.assertEqual(repr(soap.Parse(xml).Body[0]), repr(req))
+    self.assertEqual(unicode(soap.Parse(xml).Body[0]), unicode(req))
+    self.assertEqual('0', req.DelaySeconds)
+    self.assertEqual(None, req.get('Username'))
+    self.assertRaises(AttributeError, req.__getattr__, 'Username')
+
+    self.assertRaises(IndexError, soap.ParseRequest,
+                      '<Envelope><Header/><Body></Body></Envelope>')
+
+  def testParseRequestTree(self):
+    header, req = soap.ParseRequest(spv_xml, root=ET.fromstring(spv_xml))
+    self.assertEqual('spv', header.get('ID'))
+    self.assertEqual('SetParameterValues', req.name)
+    self.assertEqual(['A.B', 'A.C'],
+                     [p.Name for p in req.Stream('ParameterList')])
+    self.assertEqual('key', req.ParameterKey)
+
+  def testStream(self):
+    header, req = soap.ParseRequest(spv_xml)
+    self.assertEqual('spv', header.get('ID'))
+    structs = req.Stream('ParameterList')
+    self.assertEqual(('A.B', '1'), tuple(next(structs)))
+    # The elements are thrown away once they have been parsed.
+    self.assertEqual(1, len(req._elem[0]))
+    self.assertEqual(('A.C', 'two'), tuple(next(structs)))
+    self.assertRaises(StopIteration, next, structs)
+    # (iterparse reads ahead, so ParameterKey might be there already.)
+    self.assertFalse('ParameterList' in [e.tag for e in req._elem])
+    self.assertEqual('key', req.ParameterKey)
+
+    # Asking for something later first means the list has to be parsed
+    # the old way, but streaming it still works.
+    unused_header, req = soap.ParseRequest(spv_xml)
+    self.assertEqual('key', req.ParameterKey)
+    self.assertEqual(['A.B', 'A.C'],
+                     [p.Name for p in req.Stream('ParameterList')])
+    self.assertRaises(AttributeError, list, req.Stream('Nonexistent'))
+
+  def _Build(self, xml):
+    with xml['soap:Envelope'](**{'xmlns:soap': 'urn:x', 'xmlns:xsi': 'urn:y'}):
+      with xml['soap:Body']:
+        xml['cwmp:ID']('id', soap__mustUnderstand='1')
+        xml.class_('<&> "quoted"')
+        xml.Empty(None)
+        xml.Value(u'caf\xe9 \x01\x1f', xsi__type='xsd:string')
+        xml.Value('caf\xc3\xa9', attr='a "quoted" <value>')
+        with xml.MethodList:
+          for name in ['a', 'b']:
+            xml.string(name)
+    return xml
+
+  def testWriter(self):
+    expected = str(self._Build(xmlwitch.Builder(version='1.0')))
+    self.assertEqual(expected, str(self._Build(soap.Writer(version='1.0'))))
+    self.assertEqual(str(self._Build(xmlwitch.Builder())),
+                     str(self._Build(soap.Writer())))
+
+    # The fast interface gives the same result.
+    xml = soap.Writer(version='1.0')
+    xml.StartTag('soap:Envelope', {'xmlns:soap': 'urn:x', 'xmlns:xsi': 'urn:y'})
+    xml.StartTag('soap:Body')
+    xml.TextElement('cwmp:ID', 'id', {'soap:mustUnderstand': '1'})
+    xml.TextElement('class', '<&> "quoted"')
+    xml.EmptyElement('Empty')
+    xml.TextElement('Value', u'caf\xe9 \x01\x1f', {'xsi:type': 'xsd:string'})
+    xml.TextElement('Value', 'caf\xc3\xa9', {'attr': 'a "quoted" <value>'})
+    slot = xml.ReserveStartTag('MethodList')
+    xml.TextElement('string', 'a')
+    xml.TextElement('string', 'b')
+    xml.FillStartTag(slot, {})
+    xml.EndTag('MethodList')
+    xml.EndTag('soap:Body')
+    xml.EndTag('soap:Envelope')
+    self.assertEqual(expected, str(xml))
+
+  def testWriterAllOrNothing(self):
+    xml = soap.Writer()
+    with xml.Envelope:
+      with xml.AllOrNothing():
+        xml.Kept('yes')
+
+      def Fail():
+        with xml.AllOrNothing():
+          with xml.Response:
+            xml.Value('half')
+            raise KeyError('oops')
+      self.assertRaises(KeyError, Fail)
+      xml.Fault('instead')
+    self.assertEqual('<Envelope>\n  <Kept>yes</Kept>\n'
+                     '  <Fault>instead</Fault>\n</Envelope>', str(xml))
+
+  def testWriterListener(self):
+    log = cwmplog.TerseLog()
+    xml = soap.Writer(listener=log)
+    attrs = {'xmlns:soap': 'urn:soap', 'xmlns:cwmp': 'urn:cwmp',
+             'xmlns:xsi': 'urn:xsi'}
+    with xml['soap:Envelope'](**attrs):
+      with xml['soap:Body']:
+        with xml['cwmp:GetParameterValuesResponse']:
+          with xml.AllOrNothing():
+            with xml.ParameterList:
+              with xml.ParameterValueStruct:
+                xml.Name('Device.Foo')
+                xml.Value('a\r\nb \x01<c>', {'xsi:type': 'xsd:string'})
+
+          def Fail():
+            with xml.AllOrNothing():
+              xml.Value('discarded')
+              raise KeyError('oops')
+          self.assertRaises(KeyError, Fail)
+          xml.MaxEnvelopes('1')
+    data = str(xml)
+    logger = cwmplog.Logger(full_logs=0)
+    self.assertEqual(logger.LogTerse(data), log.result)
+    self.assertEqual(log.result, logger.LogSoapXML(data, log.Summary()))
+
+    log = cwmplog.TerseLog()
+    xml = soap.Writer(listener=log)
+    with xml.Envelope:
+      xml.write('<raw />')
+    self.assertFalse(log.valid)
+
 
 if __name__ == '__main__':
   unittest.main()